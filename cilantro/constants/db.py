@@ -24,3 +24,54 @@ else:
                    'db': settings.get('DB', 'database'),
                    'host': settings.get('DB', 'hostname')
                    }
+
+# If True, raw transactions and block contenders are stored as binary blobs instead of hex strings. This halves their
+# on disk size and saves a hex encode/decode on every read and write. An existing hex encoded database can be converted
+# in place with scripts/migrate_blob_storage.py
+BINARY_STORAGE = settings.getboolean('DB', 'binary_storage', fallback=False)
+
+# If True, raw transactions are compressed with a dictionary built from the contract templates before they are written to
+# the transactions table (see storage/transactions.py). Either way, transactions stored with the other setting stay readable
+TX_COMPRESSION = settings.getboolean('DB', 'tx_compression', fallback=True)
+
+# Where BlockStorageDriver persists blocks and their raw transactions. With 'mysql' they are stored in the blocks and
+# transactions tables. With 'segments' they are appended to segment files in SEGMENT_STORE_DIR (see storage/segments.py)
+BLOCK_STORAGE_BACKEND = settings.get('DB', 'block_storage_backend', fallback='mysql')
+SEGMENT_STORE_DIR = settings.get('DB', 'segment_store_dir',
+                                 fallback=os.path.join(this_dir, '../../segment_store', DB_SETTINGS['db']))
+
+# With block_storage_backend set to 'sharded', block bodies and raw transactions are spread over the MySQL schemas in
+# BLOCK_SHARDS (a comma separated list of 'schema' or 'host/schema'), in ranges of BLOCK_SHARD_RANGE_SIZE consecutive
+# blocks. Each range is stored on BLOCK_REPLICATION_FACTOR shards. Block headers and the tx_index stay in the local
+# database (see storage/sharding.py)
+BLOCK_SHARDS = [s.strip() for s in settings.get('DB', 'block_shards', fallback='').split(',') if s.strip()]
+BLOCK_SHARD_RANGE_SIZE = settings.getint('DB', 'block_shard_range_size', fallback=1000)
+BLOCK_REPLICATION_FACTOR = settings.getint('DB', 'block_replication_factor', fallback=2)
+
+# If True, stored blocks are appended to a write-ahead log at BLOCK_WAL_PATH, and committed to the block storage backend
+# asynchronously. A block is durable once it is synced to the log, so storing it does not wait on the backend (see
+# storage/wal.py). Blocks left in the log by a crash are committed the next time the node starts
+BLOCK_WAL = settings.getboolean('DB', 'block_wal', fallback=False)
+BLOCK_WAL_PATH = settings.get('DB', 'block_wal_path',
+                              fallback=os.path.join(this_dir, '../../block_wal', DB_SETTINGS['db'] + '.wal'))
+
+# If True, delegates maintain a sparse Merkle tree over the contract state, and record its root after every block (see
+# storage/state.py). This installs triggers on every state table
+STATE_ROOTS = settings.getboolean('DB', 'state_roots', fallback=True)
+
+# Max number of MySQL connections each process opens for read-only queries (see DB.reader in storage/db.py)
+DB_READ_POOL_SIZE = settings.getint('DB', 'read_pool_size', fallback=4)
+
+# Number of worker threads each process uses to run storage calls made through AsyncBlockStorage (see
+# storage/async_storage.py), off of its event loop
+ASYNC_STORAGE_WORKERS = settings.getint('DB', 'async_storage_workers', fallback=DB_READ_POOL_SIZE)
+
+# Raw transactions of blocks more than TX_ARCHIVE_DEPTH blocks behind the latest block are moved out of the transactions
+# table, into compressed archive segments in TX_ARCHIVE_DIR (see storage/archive.py). If 0, transactions are not archived
+TX_ARCHIVE_DEPTH = settings.getint('DB', 'tx_archive_depth', fallback=0)
+TX_ARCHIVE_DIR = settings.get('DB', 'tx_archive_dir',
+                              fallback=os.path.join(this_dir, '../../tx_archive', DB_SETTINGS['db']))
+
+# Where BlockStorageDriver saves its Bloom filter over the hashes of committed transactions (see storage/tx_filter.py)
+TX_FILTER_PATH = settings.get('DB', 'tx_filter_path',
+                              fallback=os.path.join(this_dir, '../../tx_filter', DB_SETTINGS['db'] + '.bloom'))
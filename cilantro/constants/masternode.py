@@ -13,3 +13,9 @@ NUM_WORKERS = 2  # Number of Sanic worker procs
 
 # Transaction Batcher
 BATCH_INTERVAL = 2
+
+# Max number of blocks returned in a single BlockMetaDataReply. Delegates that are further behind just request again.
+MAX_BLOCKS_PER_META_REPLY = 64
+
+# Max number of replies to BlockMetaDataRequests and TransactionRequests cached for the latest block
+RESPONSE_CACHE_SIZE = 256
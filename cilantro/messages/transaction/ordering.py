@@ -16,7 +16,7 @@ class OrderingContainer(MessageBase):
     """
 
     def validate(self):
-        assert self.masternode_vk in VKBook.get_masternodes(), 'Not a masternode VK'
+        assert VKBook.is_masternode(self.masternode_vk), 'Not a masternode VK'
 
     @classmethod
     def _deserialize_data(cls, data: bytes):
@@ -93,7 +93,7 @@ class DelegateCatchupState(DelegateBaseState):
         for contract_blob in reply.transactions:
             self.parent.interpreter.interpret(ContractTransaction.from_bytes(contract_blob), async=False)
             self.parent.pending_txs.remove(Hasher.hash(contract_blob))
-        self.parent.interpret.flush(update_state=True)
+        self.parent.interpreter.flush(update_state=True, block_hash=self.current_block.block_hash)
 
         # Finally, store this new block and update our current block hash. Reset self.current_block, update next block
         BlockStorageDriver.store_block_from_meta(self.current_block)
@@ -89,7 +89,7 @@ class DelegateConsensusState(DelegateBaseState):
         self.log.debugv("Validating signature: {}".format(sig))
 
         # Verify sender's vk exists in the state
-        if sig.sender not in VKBook.get_delegates():
+        if not VKBook.is_delegate(sig.sender):
             self.log.warning("Received merkle sig from sender {} who was not registered nodes {}"
                              .format(sig.sender, VKBook.get_delegates()))
             return False
@@ -150,7 +150,7 @@ class DelegateConsensusState(DelegateBaseState):
             self.log.success("Prev block hash matches ours. Delegate in consensus!")
 
             BlockStorageDriver.store_block_from_meta(notif)
-            self.parent.interpreter.flush(update_state=True)
+            self.parent.interpreter.flush(update_state=True, block_hash=notif.block_hash)
             self.parent.transition(DelegateInterpretState)
             return
 
@@ -133,16 +133,16 @@ class DelegateBootState(DelegateBaseState):
 
     @input_socket_connected
     def socket_connected(self, socket_type: int, vk: str, url: str):
-        assert vk in VKBook.get_all(), "Connected to vk {} that is not present in VKBook.get_all()!!!".format(vk)
+        assert VKBook.is_member(vk), "Connected to vk {} that is not present in VKBook.get_all()!!!".format(vk)
         key = vk + '_' + str(socket_type)
         self.log.spam("Delegate connected to vk {} with sock type {}".format(vk, socket_type))
 
         # TODO make less ugly pls
-        if vk in VKBook.get_delegates():
+        if VKBook.is_delegate(vk):
             self.connected_delegates.add(key)
-        elif vk in VKBook.get_masternodes():
+        elif VKBook.is_masternode(vk):
             self.connected_masternodes.add(key)
-        elif vk in VKBook.get_witnesses():
+        elif VKBook.is_witness(vk):
             self.connected_witnesses.add(key)
 
         self._check_ready()
@@ -3,6 +3,7 @@ from cilantro.storage.blocks import BlockStorageDriver
 from cilantro.messages.transaction.ordering import OrderingContainer
 from cilantro.constants.nodes import BLOCK_SIZE
 from cilantro.protocol.states.decorators import input, enter_from_any, exit_to_any, exit_to, enter_from
+from cilantro.utils import Hasher
 
 DelegateBootState = "DelegateBootState"
 DelegateInterpretState = "DelegateInterpretState"
@@ -59,6 +60,12 @@ class DelegateInterpretState(DelegateBaseState):
         self.interpret_tx(tx=tx)
 
     def interpret_tx(self, tx: OrderingContainer):
+        # Replays of committed transactions are rejected by the tx filter, usually without touching the DB
+        tx_hash = Hasher.hash(tx.transaction.serialize())
+        if BlockStorageDriver.has_transaction(tx_hash):
+            self.log.warning("Dropping transaction with hash {}, as it is already in a block".format(tx_hash))
+            return
+
         self.parent.interpreter.interpret(tx)
         self.log.debugv("Current size of transaction queue: {}".format(len(self.parent.interpreter.queue)))
 
@@ -7,7 +7,7 @@
     the behavior of nodes and tell the network who is misbehaving.
 """
 from cilantro.constants.zmq_filters import WITNESS_MASTERNODE_FILTER, MASTERNODE_DELEGATE_FILTER
-from cilantro.constants.masternode import STAGING_TIMEOUT
+from cilantro.constants.masternode import STAGING_TIMEOUT, MAX_BLOCKS_PER_META_REPLY
 from cilantro.constants.ports import MN_NEW_BLOCK_PUB_PORT, MN_TX_PUB_PORT
 from cilantro.constants.nodes import BLOCK_SIZE
 from cilantro.constants.testnet import MAJORITY
@@ -21,6 +21,7 @@ from cilantro.messages.block_data.transaction_data import TransactionReply, Tran
 from cilantro.messages.block_data.block_metadata import BlockMetaDataRequest, BlockMetaDataReply
 from cilantro.messages.envelope.envelope import Envelope
 from cilantro.storage.blocks import BlockStorageDriver, BlockMetaData
+from cilantro.storage.async_storage import AsyncBlockStorage
 from cilantro.messages.transaction.container import TransactionContainer
 from cilantro.messages.transaction.ordering import OrderingContainer
 from cilantro.messages.transaction.base import TransactionBase
@@ -35,6 +36,7 @@ from multiprocessing import Queue
 from cilantro.nodes import NodeBase
 from cilantro.nodes.masternode.webserver import start_webserver
 from cilantro.nodes.masternode.transaction_batcher import TransactionBatcher
+from cilantro.nodes.masternode.response_cache import ResponseCache
 
 MNNewBlockState = 'MNNewBlockState'
 MNStagingState = 'MNStagingState'
@@ -42,7 +44,10 @@ MNBootState = 'MNBootState'
 
 
 class Masternode(NodeBase):
-    pass
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.response_cache = ResponseCache()
 
 
 class MNBaseState(State):
@@ -81,39 +86,45 @@ class MNBaseState(State):
         self.log.debug('Reply: {}'.format(reply))
 
     @input_request(TransactionRequest)
-    def handle_tx_request(self, request: TransactionRequest):
+    async def handle_tx_request(self, request: TransactionRequest):
         self.log.debug("Masternode received TransactionRequest request: {}".format(request))
-        tx_blobs = BlockStorageDriver.get_raw_transactions(request.tx_hashes)
-        reply = TransactionReply.create(raw_transactions=tx_blobs)
-        return reply
+        tx_hashes = request.tx_hashes
+        return await self.parent.response_cache.get(('tx', tuple(tx_hashes)), BlockStorageDriver.get_latest_block_hash(),
+                                                    lambda: self._build_tx_reply(tx_hashes))
+
+    async def _build_tx_reply(self, tx_hashes: list) -> TransactionReply:
+        tx_blobs = await AsyncBlockStorage.get_raw_transactions(tx_hashes)
+        return TransactionReply.create(raw_transactions=tx_blobs)
 
     @input_timeout(TransactionRequest)
     def handle_tx_request_timeout(self, request: TransactionRequest, envelope: Envelope):
         self.log.warning("Current state {} not configured to handle tx request timeout".format(self))
 
     @input_request(BlockMetaDataRequest)
-    def handle_blockmeta_request(self, request: BlockMetaDataRequest, envelope: Envelope):
+    async def handle_blockmeta_request(self, request: BlockMetaDataRequest, envelope: Envelope):
         vk = envelope.seal.verifying_key
-        assert vk in VKBook.get_delegates(), "Got BlockMetaDataRequest from VK {} not in delegate VKBook!".format(vk)
+        assert VKBook.is_delegate(vk), "Got BlockMetaDataRequest from VK {} not in delegate VKBook!".format(vk)
         self.log.notice("Masternode received BlockMetaDataRequest from delegate {}\n...request={}".format(vk, request))
 
-        # Get a list of block hashes up until this most recent block
-        # TODO get_child_block_hashes return an error/assertion/something if block cannot be found
-        child_hashes = BlockStorageDriver.get_child_block_hashes(request.current_block_hash)
-        self.log.debugv("Got descendant block hashes {} for block hash {}".format(child_hashes, request.current_block_hash))
+        block_hash = request.current_block_hash
+        return await self.parent.response_cache.get(('blockmeta', block_hash), BlockStorageDriver.get_latest_block_hash(),
+                                                    lambda: self._build_blockmeta_reply(block_hash))
 
-        # If this hash could not be found or if it was the latest hash, no need to lookup any blocks
-        if not child_hashes:
-            self.log.debug("Requested block hash {} is already up to date".format(request.current_block_hash))
+    async def _build_blockmeta_reply(self, block_hash: str) -> BlockMetaDataReply:
+        # Fetch the descendant blocks (up to MAX_BLOCKS_PER_META_REPLY of them) in one query
+        # TODO return an error/assertion/something if the requested block cannot be found
+        child_blocks = await AsyncBlockStorage.get_blocks(after_hash=block_hash, limit=MAX_BLOCKS_PER_META_REPLY,
+                                                          include_number=False)
+        self.log.debugv("Got {} descendant blocks for block hash {}".format(len(child_blocks), block_hash))
+
+        # If this hash could not be found or if it was the latest hash, there are no blocks to send
+        if not child_blocks:
+            self.log.debug("Requested block hash {} is already up to date".format(block_hash))
             reply = BlockMetaDataReply.create(block_metas=None)
             return reply
 
         # Build a BlockMetaData object for each descendant block
-        block_metas = []
-        for block_hash in child_hashes:
-            block_data = BlockStorageDriver.get_block(hash=block_hash, include_number=False)
-            meta = BlockMetaData.create(**block_data)
-            block_metas.append(meta)
+        block_metas = [BlockMetaData.create(**block_data) for block_data in child_blocks]
 
         reply = BlockMetaDataReply.create(block_metas=block_metas)
         return reply
@@ -197,6 +208,8 @@ class MNStagingState(MNBaseState):
 
     def reset_attrs(self):
         self.ready_delegates = set()
+        self.transitioned = False  # True once this visit to StagingState has transitioned to RunState
+        self.entry_count = getattr(self, 'entry_count', 0) + 1  # Identifies the current visit to StagingState
 
     @timeout_after(STAGING_TIMEOUT)
     def timeout(self):
@@ -214,10 +227,16 @@ class MNStagingState(MNBaseState):
         raise Exception("OH NO! This should not get called anymore. TransactionBase processing should be done by ")
 
     @input_request(BlockMetaDataRequest)
-    def handle_blockmeta_request(self, request: BlockMetaDataRequest, envelope: Envelope):
-        reply = super().handle_blockmeta_request(request, envelope)
+    async def handle_blockmeta_request(self, request: BlockMetaDataRequest, envelope: Envelope):
+        entry_count = self.entry_count
+        reply = await super().handle_blockmeta_request(request, envelope)
         self.parent.composer.send_reply(message=reply, request_envelope=envelope)
 
+        # Other requests are handled while this one awaits its reply, so by now the node may have left StagingState
+        # (or left and come back), in which case this delegate's readiness no longer counts
+        if self.parent.state is not self or self.entry_count != entry_count or self.transitioned:
+            return
+
         if not reply.block_metas:
             vk = envelope.seal.verifying_key
             self.log.notice("Delegate with vk {} has the latest blockchain state!".format(vk))
@@ -238,6 +257,7 @@ class MNStagingState(MNBaseState):
         if num_ready >= majority:
             self.log.important("{}/{} Delegates are at the latest blockchain state! MN exiting StagingState."
                                "\n(Ready Delegates = {})".format(num_ready, len(VKBook.get_delegates()), self.ready_delegates))
+            self.transitioned = True
             self.parent.transition(MNRunState)
             return
         else:
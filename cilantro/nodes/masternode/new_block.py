@@ -1,11 +1,13 @@
 from cilantro.constants.zmq_filters import MASTERNODE_DELEGATE_FILTER
 from cilantro.constants.masternode import NEW_BLOCK_TIMEOUT, FETCH_BLOCK_TIMEOUT
 from cilantro.constants.ports import MN_NEW_BLOCK_PUB_PORT
+from cilantro.constants.db import TX_ARCHIVE_DEPTH
 from cilantro.nodes.masternode import MNBaseState, Masternode
 
 from cilantro.utils import Hasher
 
-from cilantro.storage.blocks import List, BlockStorageDriver, BlockStorageException
+from cilantro.storage.blocks import List, BlockStorageDriver, BlockStorageException, TX_ARCHIVE_BATCH_SIZE
+from cilantro.storage.async_storage import AsyncBlockStorage
 
 from cilantro.protocol.states.decorators import enter_from_any, enter_from, input_request, input_timeout, input, timeout_after
 
@@ -95,11 +97,24 @@ class MNNewBlockState(MNBaseState):
             self._try_next_block()
             return
 
+        # Replies cached for the previous block may be stale now
+        self.parent.response_cache.clear()
+
         # Notify delegates that a new block was published
         self.log.info("Masternode sending NewBlockNotification to TESTNET_DELEGATES with new block hash {} ".format(block_hash))
         notif = NewBlockNotification.create(**BlockStorageDriver.get_latest_block(include_number=False))
         self.parent.composer.send_pub_msg(filter=MASTERNODE_DELEGATE_FILTER, message=notif, port=MN_NEW_BLOCK_PUB_PORT)
 
+        # Move transactions of old blocks to the archive, once a full batch of them is due. This runs on the storage
+        # thread pool, so a batch being archived does not hold up the event loop
+        if TX_ARCHIVE_DEPTH:
+            future = AsyncBlockStorage.archive_transactions(min_blocks=TX_ARCHIVE_BATCH_SIZE)
+            future.add_done_callback(self._log_archive_error)
+
+    def _log_archive_error(self, future):
+        if not future.cancelled() and future.exception():
+            self.log.error("Error archiving transactions!\nError = {}".format(future.exception()))
+
     @input_request(BlockContender)
     def handle_block_contender(self, block: BlockContender):
         if self.validate_block_contender(block):
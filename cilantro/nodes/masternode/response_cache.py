@@ -0,0 +1,72 @@
+"""
+A cache of replies to the read-only requests a Masternode serves (ie. BlockMetaDataRequests and TransactionRequests).
+
+When a block is published, every delegate requests roughly the same data at once. Replies are cached by the request's
+parameters, along with the hash of the latest block, so each distinct reply is only built (queried and serialized)
+once per block. Requests that arrive while a reply is still being built wait on that same build. When the latest
+block changes, the whole cache is dropped, as any cached reply may be stale.
+
+Cached replies are MessageBase instances, which memoize their serialized bytes (see MessageBase.serialize). Only the
+reply envelope, which is unique to each request, is built per request.
+"""
+
+from cilantro.logger import get_logger
+from cilantro.constants.masternode import RESPONSE_CACHE_SIZE
+from cilantro.messages.base.base import MessageBase
+from collections import OrderedDict
+import asyncio
+
+log = get_logger("ResponseCache")
+
+
+class ResponseCache:
+
+    def __init__(self, max_size: int=RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self.tip = None  # Hash of the latest block when the cached replies were built
+        self.replies = OrderedDict()  # Request key -> asyncio Future for the reply, in LRU order
+        self.hits = self.misses = 0
+
+    def get(self, key: tuple, tip: str, build) -> asyncio.Future:
+        """
+        Returns the cached reply for a request, building it if it is not cached
+        :param key: A hashable tuple identifying the request, which should start with the request type
+        :param tip: The hash of the latest block. If this differs from the last call, the cache is cleared first
+        :param build: A coroutine function taking no arguments, which builds the reply
+        :return: An awaitable for the reply
+        """
+        if tip != self.tip:
+            self.clear()
+            self.tip = tip
+
+        future = self.replies.get(key)
+        if future is not None:
+            self.hits += 1
+            self.replies.move_to_end(key)
+        else:
+            self.misses += 1
+            future = self.replies[key] = asyncio.ensure_future(self._build(build))
+            future.add_done_callback(lambda f: self._drop_failed(key, f))
+
+            while len(self.replies) > self.max_size:
+                self.replies.popitem(last=False)
+
+        # Shielded so a request that gets cancelled does not cancel the build for every other request waiting on it
+        return asyncio.shield(future)
+
+    def clear(self):
+        if self.replies:
+            log.debugv("Clearing {} cached replies".format(len(self.replies)))
+        self.replies.clear()
+        self.tip = None
+
+    async def _build(self, build) -> MessageBase:
+        reply = await build()
+        if reply is not None:
+            reply.serialize()  # Memoized on the reply, so it is serialized once for all requests it is sent to
+        return reply
+
+    def _drop_failed(self, key: tuple, future: asyncio.Future):
+        # A failed build is not cached, so the next request for it retries
+        if (future.cancelled() or future.exception()) and self.replies.get(key) is future:
+            del self.replies[key]
@@ -5,6 +5,8 @@ from cilantro.constants.masternode import BATCH_INTERVAL
 
 from cilantro.protocol.multiprocessing.worker import Worker
 from cilantro.messages.transaction.ordering import OrderingContainer
+from cilantro.storage.async_storage import AsyncBlockStorage
+from cilantro.utils import Hasher
 import asyncio
 
 
@@ -23,8 +25,18 @@ class TransactionBatcher(Worker):
             await asyncio.sleep(BATCH_INTERVAL)
 
             self.log.debug("Sending {} transactions in batch".format(self.queue.qsize()))
-            for _ in range(self.queue.qsize()):
-                tx = self.queue.get()
+            txs = [self.queue.get() for _ in range(self.queue.qsize())]
+
+            # Drop replays of committed transactions. Blocks are stored by the main Masternode process, so the tip is
+            # refreshed from the DB once per batch. The lookup (which builds the tx filter the first time) runs off the
+            # event loop
+            tx_hashes = [Hasher.hash(tx.serialize()) for tx in txs]
+            committed = await AsyncBlockStorage.get_committed_transactions(tx_hashes, refresh=True) if txs else set()
+
+            for tx, tx_hash in zip(txs, tx_hashes):
+                if tx_hash in committed:
+                    self.log.warning("Dropping transaction with hash {}, as it is already in a block".format(tx_hash))
+                    continue
 
                 oc = OrderingContainer.create(tx=tx, masternode_vk=self.verifying_key)
                 self.log.spam("masternode about to publish transaction from sender {}".format(tx.sender))
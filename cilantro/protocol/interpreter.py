@@ -7,11 +7,12 @@ from seneca.engine.storage.mysql_spits_executer import Executer
 from cilantro.constants.protocol import MAX_QUEUE_DELAY_MS
 from cilantro.storage.tables import DB_NAME
 from cilantro.storage.db import DB
+from cilantro.storage.state import StateCommitment
 from typing import List
 from heapq import heappush, heappop
 import time
 import asyncio
-from cilantro.constants.db import DB_SETTINGS
+from cilantro.constants.db import DB_SETTINGS, STATE_ROOTS
 
 
 class SenecaInterpreter:
@@ -24,8 +25,12 @@ class SenecaInterpreter:
         self.max_delay_ms = MAX_QUEUE_DELAY_MS
         self.ex = Executer(**DB_SETTINGS)
 
+        # Tracks the state written through self.ex, so the state root can be updated as each block is committed
+        self.state = StateCommitment() if STATE_ROOTS else None
+        self.state_root = None
+
         # Grab a reference to contracts table from DB singleton
-        with DB() as db:
+        with DB().reader() as db:
             self.contracts_table = db.tables.contracts
 
         self.loop = asyncio.get_event_loop()
@@ -35,13 +40,17 @@ class SenecaInterpreter:
         # Ensure contracts table was seeded properly
         assert self.contracts_table.select().run(self.ex), "Expected contracts table to be seeded with at least one row"
 
-    def flush(self, update_state=True):
+    def flush(self, update_state=True, block_hash=''):
         """
         Flushes internal queue of transactions. If update_state is True, this will also commit the changes
-        to the database. Otherwise, this method will discard any changes
+        to the database. Otherwise, this method will discard any changes. If state roots are enabled, committing also
+        updates self.state_root, and records it as the state root of block_hash (if specified)
         """
         if update_state:
             self.log.info("Flushing queue and committing queue of {} items".format(len(self.queue)))
+            if self.state:
+                self.state_root = self.state.commit(self.ex, block_hash=block_hash)
+                self.log.info("State root after block {} is {}".format(block_hash, self.state_root))
             self.ex.commit()
         else:
             self.log.info("Flushing queue and rolling back {} transactions".format(len(self.queue)))
@@ -93,7 +93,7 @@ class OverlayInterface(object):
     def _get_node_from_vk(cls, event_id, vk: str, timeout=3):
         async def coro():
             node = None
-            if vk in VKBook.get_all():
+            if VKBook.is_member(vk):
                 try:
                     node, cached = await asyncio.wait_for(cls.dht.network.lookup_ip(vk), timeout)
                 except:
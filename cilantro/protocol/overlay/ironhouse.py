@@ -231,4 +231,4 @@ class Ironhouse:
 
     @staticmethod
     def auth_validate(vk):
-        return vk in VKBook.get_all()
+        return VKBook.is_member(vk)
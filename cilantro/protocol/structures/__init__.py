@@ -2,3 +2,5 @@ from cilantro.protocol.structures.merkle_tree import MerkleTree
 from cilantro.protocol.structures.envelope_auth import EnvelopeAuth
 from cilantro.protocol.structures.capped_containers import CappedDict, CappedSet
 from cilantro.protocol.structures.bidict import Bidict
+from cilantro.protocol.structures.bloom_filter import BloomFilter
+from cilantro.protocol.structures.sparse_merkle_tree import SparseMerkleTree
@@ -0,0 +1,74 @@
+"""
+A Bloom filter is a fixed size set that can only be added to, and that answers membership checks with either 'definitely
+not in the set' or 'probably in the set'. The chance of a wrong 'probably' (the false positive rate) stays at or below
+the error rate the filter was created with, as long as no more than 'capacity' elements are added. Past that point
+the false positive rate climbs, so the filter should be rebuilt with a larger capacity.
+
+Each element sets NUM_HASHES bits, whose positions are derived from a single blake2b digest of the element with double
+hashing (see Kirsch & Mitzenmacher, "Less Hashing, Same Performance: Building a Better Bloom Filter").
+"""
+from hashlib import blake2b
+import struct
+import math
+
+
+class BloomFilter:
+    HEADER = struct.Struct('<QdQ')  # capacity, error rate, number of elements added
+
+    def __init__(self, capacity: int, error_rate: float=0.001, bits: bytes=None, count: int=0):
+        """
+        Creates an empty Bloom filter sized to hold 'capacity' elements with a false positive rate of at most
+        'error_rate'. The bits and count arguments are used by from_bytes to restore a serialized filter.
+        """
+        assert capacity > 0, "Capacity must be > 0 (not {})".format(capacity)
+        assert 0 < error_rate < 1, "Error rate must be between 0 and 1 (not {})".format(error_rate)
+
+        self.capacity, self.error_rate, self.count = capacity, error_rate, count
+
+        # The optimal number of bits, and of hashes, for this capacity and error rate
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+
+        num_bytes = (self.num_bits + 7) // 8
+        if bits is None:
+            self.bits = bytearray(num_bytes)
+        else:
+            assert len(bits) == num_bytes, "Expected {} bytes of bits, got {}".format(num_bytes, len(bits))
+            self.bits = bytearray(bits)
+
+    def add(self, element: bytes or str):
+        for pos in self._positions(element):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def update(self, elements):
+        for element in elements:
+            self.add(element)
+
+    def is_full(self) -> bool:
+        """
+        Returns True if more than 'capacity' elements were added, so the false positive rate may exceed the error rate
+        """
+        return self.count > self.capacity
+
+    def to_bytes(self) -> bytes:
+        return self.HEADER.pack(self.capacity, self.error_rate, self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        capacity, error_rate, count = cls.HEADER.unpack_from(data)
+        return cls(capacity, error_rate, bits=data[cls.HEADER.size:], count=count)
+
+    def _positions(self, element: bytes or str):
+        if isinstance(element, str):
+            element = element.encode()
+
+        digest = blake2b(element, digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def __contains__(self, element: bytes or str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(element))
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,139 @@
+"""
+A sparse Merkle tree is a Merkle tree with a leaf for every possible 256 bit key, almost all of which are empty. It
+authenticates a key -> value map: two maps hold the same entries if and only if their trees have the same root, no
+matter in which order the entries were written.
+
+This is a compact sparse Merkle tree. An empty subtree hashes to EMPTY_HASH, and a subtree holding a single key is not
+expanded any further, but stored as that key's leaf at the top of the subtree. So the tree holds about 2n nodes for n
+keys, and its depth is about log2(n). Updating k keys rehashes only the paths to those keys, which is O(k log n).
+
+Node hashes (all SHA3-256):
+ - A leaf: H(0x00 || key || value hash)
+ - An inner node: H(0x01 || left child hash || right child hash)
+
+Nodes are kept in a dictionary keyed by position, (depth, prefix), where prefix is the first 'depth' bits of the keys
+below the node. update() returns the positions it changed, so a caller can persist the tree incrementally.
+"""
+from hashlib import sha3_256
+
+KEY_BITS = 256
+EMPTY_HASH = bytes(32)
+
+
+def leaf_hash(key: bytes, value_hash: bytes) -> bytes:
+    return sha3_256(b'\x00' + key + value_hash).digest()
+
+
+def inner_hash(left: bytes, right: bytes) -> bytes:
+    return sha3_256(b'\x01' + left + right).digest()
+
+
+class SparseMerkleTree:
+
+    def __init__(self, nodes: dict=None):
+        """
+        Creates a tree, empty unless the nodes of an existing tree are passed in.
+        :param nodes: A dictionary of (depth, prefix) -> (hash, leaf key, value hash), as returned by update(). Leaf key
+        and value hash are None for inner nodes
+        """
+        self.nodes = nodes if nodes is not None else {}
+
+    @property
+    def root(self) -> bytes:
+        node = self.nodes.get((0, 0))
+        return node[0] if node else EMPTY_HASH
+
+    def get(self, key: bytes) -> bytes or None:
+        """
+        Returns the value hash stored for a key, or None if the key is not in the tree
+        """
+        k, depth, prefix = int.from_bytes(key, 'big'), 0, 0
+        while True:
+            node = self.nodes.get((depth, prefix))
+            if node is None:
+                return None
+            if node[1] is not None:
+                return node[2] if node[1] == key else None
+            prefix = prefix * 2 + self._bit(k, depth)
+            depth += 1
+
+    def update(self, changes: dict) -> dict:
+        """
+        Sets (or deletes) a batch of keys.
+        :param changes: A dictionary of key (32 bytes) -> value hash (32 bytes), or None to delete the key
+        :return: A dictionary of every position that changed -> its new node, or None if the position is now empty
+        """
+        assert all(len(key) == KEY_BITS // 8 for key in changes), "Keys must be {} bytes".format(KEY_BITS // 8)
+
+        diff = {}
+        if changes:
+            self._update(0, 0, {int.from_bytes(k, 'big'): (k, v) for k, v in changes.items()}, diff)
+        return diff
+
+    def _update(self, depth: int, prefix: int, changes: dict, diff: dict) -> tuple or None:
+        node = self.nodes.get((depth, prefix))
+
+        if node is None or node[1] is not None:
+            # An empty or single leaf subtree is rebuilt from its (at most one) existing leaf and the changes
+            leaves = {int.from_bytes(node[1], 'big'): (node[1], node[2])} if node else {}
+            for k, (key, value_hash) in changes.items():
+                if value_hash is None:
+                    leaves.pop(k, None)
+                else:
+                    leaves[k] = (key, value_hash)
+            new = self._build(depth, prefix, leaves, diff)
+        else:
+            left, right = self._split(depth, changes)
+            children = [self._update(depth + 1, prefix * 2 + bit, half, diff) if half
+                        else self.nodes.get((depth + 1, prefix * 2 + bit)) for bit, half in ((0, left), (1, right))]
+            new = self._combine(depth, prefix, *children, diff=diff)
+
+        self._set(depth, prefix, new, diff)
+        return new
+
+    def _build(self, depth: int, prefix: int, leaves: dict, diff: dict) -> tuple or None:
+        if not leaves:
+            return None
+        if len(leaves) == 1:
+            key, value_hash = next(iter(leaves.values()))
+            return leaf_hash(key, value_hash), key, value_hash
+
+        left, right = self._split(depth, leaves)
+        children = []
+        for bit, half in ((0, left), (1, right)):
+            child = self._build(depth + 1, prefix * 2 + bit, half, diff)
+            self._set(depth + 1, prefix * 2 + bit, child, diff)
+            children.append(child)
+        return self._combine(depth, prefix, *children, diff=diff)
+
+    def _combine(self, depth: int, prefix: int, left: tuple, right: tuple, diff: dict) -> tuple or None:
+        if left is None and right is None:
+            return None
+
+        # A lone leaf moves up to the top of the subtree it is alone in
+        for child in (left, right):
+            if child is not None and child[1] is not None and (left is None or right is None):
+                self._set(depth + 1, prefix * 2, None, diff)
+                self._set(depth + 1, prefix * 2 + 1, None, diff)
+                return child
+
+        return inner_hash(left[0] if left else EMPTY_HASH, right[0] if right else EMPTY_HASH), None, None
+
+    def _set(self, depth: int, prefix: int, node: tuple or None, diff: dict):
+        pos = (depth, prefix)
+        if node is None:
+            if self.nodes.pop(pos, None) is not None:
+                diff[pos] = None
+        elif self.nodes.get(pos) != node:
+            self.nodes[pos] = diff[pos] = node
+
+    @staticmethod
+    def _bit(k: int, depth: int) -> int:
+        return (k >> (KEY_BITS - 1 - depth)) & 1
+
+    @classmethod
+    def _split(cls, depth: int, items: dict) -> tuple:
+        left, right = {}, {}
+        for k, v in items.items():
+            (right if cls._bit(k, depth) else left)[k] = v
+        return left, right
@@ -1,4 +1,6 @@
+import traceback
 import inspect
+import asyncio
 from cilantro.protocol.states.statemachine import StateMachine
 from cilantro.protocol.states.state import StateInput
 from cilantro.messages.reactor.reactor_command import ReactorCommand
@@ -41,9 +43,13 @@ class Router:
     def _route(self, input_type, *args, **kwargs):
         """
         Should be for internal use only.
-        Routes an envelope to the appropriate @input or @timeout receiver
+        Routes an envelope to the appropriate @input or @timeout receiver. If the receiver is a coroutine function, it
+        is scheduled on the event loop.
         """
-        self.handler.call_input_handler(input_type, *args, **kwargs)
+        output = self.handler.call_input_handler(input_type, *args, **kwargs)
+
+        if inspect.isawaitable(output):
+            asyncio.ensure_future(self._await_handler(output, input_type))
 
     def _route_timeout(self, input_type, *args, **kwargs):
         self.handler.call_input_handler(StateInput.TIMEOUT, *args, **kwargs)
@@ -61,6 +67,25 @@ class Router:
         envelope = kwargs['envelope']
         reply = self.handler.call_input_handler(input_type, *args, **kwargs)
 
+        # @input_request coroutine functions (such as those awaiting storage lookups) reply once they complete, so the
+        # event loop is free to handle other messages in the meantime
+        if inspect.isawaitable(reply):
+            asyncio.ensure_future(self._await_handler(reply, input_type, envelope=envelope))
+            return
+
+        self._send_reply(reply, envelope)
+
+    async def _await_handler(self, output, input_type, envelope=None):
+        try:
+            output = await output
+        except Exception:
+            self.log.error("Error in {} coroutine handler:\n{}".format(input_type, traceback.format_exc()))
+            return
+
+        if envelope:
+            self._send_reply(output, envelope)
+
+    def _send_reply(self, reply, envelope):
         if not reply:
             self.log.debug("Warning -- No reply returned for request msg of type {}".format(type(envelope.message)))
             return
@@ -0,0 +1,75 @@
+"""
+Cold storage for the raw transactions of old blocks.
+
+Transactions are rarely read once their block is deep in the chain, but with the MySQL backend they stay in the
+transactions table (and its indexes, and the InnoDB buffer pool) forever. BlockStorageDriver.archive_transactions moves
+the transactions of blocks more than TX_ARCHIVE_DEPTH blocks behind the latest block into a TransactionArchive, and
+deletes them from the transactions table. Lookups through BlockStorageDriver fall back to the archive for any hash that
+is not found in the transactions table, so archived transactions are still served transparently.
+
+A TransactionArchive is a SegmentStore (see storage/segments.py) opened in compressed mode, so each block's
+transactions are stored as a single zlib compressed record, and can be looked up by tx hash or block hash. Archived
+blocks are stored under their block hash, with their block number as the block data.
+"""
+
+from cilantro.logger import get_logger
+from cilantro.storage.segments import SegmentStore
+from typing import List
+import struct
+
+log = get_logger("TxArchive")
+
+BLOCK_NUMBER = struct.Struct('<Q')
+
+
+class TransactionArchive:
+    """
+    Holds the raw transactions of archived blocks. Blocks must be archived in ascending block number order. Like a
+    SegmentStore, only the first archive opened on a path can be written to. Archives opened on it while that one is
+    open are read only.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.store = SegmentStore(path, compress=True)
+
+    def archive_block(self, number: int, block_hash: str, transactions: List[tuple]):
+        """
+        Adds a block's transactions to the archive. They are not guaranteed to be on disk until sync() is called.
+        :param number: The number of the block
+        :param block_hash: The hash of the block
+        :param transactions: A list of (tx hash, raw transaction) tuples, in the order they appear in the block
+        """
+        assert number > self.last_block_number(), "Block number {} archived out of order (last archived block is {})"\
+                                                  .format(number, self.last_block_number())
+        self.store.append_block(block_hash, BLOCK_NUMBER.pack(number), transactions)
+
+    def last_block_number(self) -> int:
+        """
+        Returns the number of the last archived block, or 0 if no blocks have been archived
+        """
+        latest = self.store.latest()
+        if latest is None:
+            return 0
+
+        return BLOCK_NUMBER.unpack(self.store.get_block(number=latest[0]))[0]
+
+    def get_transaction(self, tx_hash: str) -> bytes or None:
+        return self.store.get_transaction(tx_hash)
+
+    def get_block_transactions(self, block_hash: str) -> List[bytes] or None:
+        """
+        Returns the archived transactions of the block with the given hash, in order, or None if the block has not been
+        archived
+        """
+        return self.store.get_block_transactions(block_hash)
+
+    def sync(self):
+        self.store.sync()
+
+    def close(self):
+        self.store.close()
+
+    def destroy(self):
+        log.info("Deleting transaction archive at {}".format(self.path))
+        self.store.destroy()
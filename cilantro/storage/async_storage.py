@@ -0,0 +1,109 @@
+"""
+An asynchronous facade over BlockStorageDriver, for use from code running on an event loop (such as state input
+handlers). Each call runs the corresponding BlockStorageDriver method on a pool of worker threads, and returns an
+asyncio Future for its result, so a slow query does not stall the event loop.
+
+Worker threads read through DB().reader() like any other thread, so up to DB_READ_POOL_SIZE lookups run concurrently,
+each on its own MySQL connection (see storage/db.py). ASYNC_STORAGE_WORKERS is the size of the thread pool.
+
+Usage, from a coroutine:
+    tx_blobs = await AsyncBlockStorage.get_raw_transactions(tx_hashes)
+"""
+
+from cilantro.logger import get_logger
+from cilantro.storage.blocks import BlockStorageDriver
+from cilantro.constants.db import ASYNC_STORAGE_WORKERS
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import functools
+import threading
+import asyncio
+import atexit
+import os
+
+log = get_logger("AsyncStorage")
+
+
+class AsyncBlockStorage:
+    """
+    Runs BlockStorageDriver methods on a per-process thread pool. Every method returns an asyncio Future, bound to the
+    current event loop.
+    """
+
+    _executor = None
+    _executor_pid = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self):
+        raise NotImplementedError("Do not instantiate this class! Instead, use the class methods.")
+
+    @classmethod
+    def run(cls, func, *args, **kwargs) -> asyncio.Future:
+        """
+        Runs func(*args, **kwargs) on the worker thread pool
+        :return: An asyncio Future for the result of the call
+        """
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(cls._get_executor(), functools.partial(func, *args, **kwargs))
+
+    @classmethod
+    def get_raw_transactions(cls, tx_hashes: str or List[str]) -> asyncio.Future:
+        return cls.run(BlockStorageDriver.get_raw_transactions, tx_hashes)
+
+    @classmethod
+    def get_raw_transactions_from_block(cls, block_hashes: str or List[str]) -> asyncio.Future:
+        return cls.run(BlockStorageDriver.get_raw_transactions_from_block, block_hashes)
+
+    @classmethod
+    def get_block(cls, number: int=0, hash: str='', include_number=True) -> asyncio.Future:
+        return cls.run(BlockStorageDriver.get_block, number=number, hash=hash, include_number=include_number)
+
+    @classmethod
+    def get_blocks(cls, *args, **kwargs) -> asyncio.Future:
+        """
+        Takes the same arguments as BlockStorageDriver.get_blocks
+        """
+        return cls.run(BlockStorageDriver.get_blocks, *args, **kwargs)
+
+    @classmethod
+    def get_latest_block(cls, include_number=True) -> asyncio.Future:
+        return cls.run(BlockStorageDriver.get_latest_block, include_number=include_number)
+
+    @classmethod
+    def get_latest_block_hash(cls) -> asyncio.Future:
+        return cls.run(BlockStorageDriver.get_latest_block_hash)
+
+    @classmethod
+    def get_committed_transactions(cls, tx_hashes: List[str], refresh=False) -> asyncio.Future:
+        return cls.run(BlockStorageDriver.get_committed_transactions, tx_hashes, refresh=refresh)
+
+    @classmethod
+    def archive_transactions(cls, *args, **kwargs) -> asyncio.Future:
+        """
+        Takes the same arguments as BlockStorageDriver.archive_transactions
+        """
+        return cls.run(BlockStorageDriver.archive_transactions, *args, **kwargs)
+
+    @classmethod
+    def shutdown(cls, wait=True):
+        """
+        Shuts down this process's thread pool, if it has one. Calls made after this start a new pool. This is called
+        when the process exits.
+        """
+        with cls._executor_lock:
+            if cls._executor and cls._executor_pid == os.getpid():
+                cls._executor.shutdown(wait=wait)
+            cls._executor = cls._executor_pid = None
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        with cls._executor_lock:
+            # A forked child does not inherit the parent's worker threads, so it needs its own pool
+            if cls._executor is None or cls._executor_pid != os.getpid():
+                log.debug("Creating async storage thread pool with {} workers".format(ASYNC_STORAGE_WORKERS))
+                cls._executor = ThreadPoolExecutor(max_workers=ASYNC_STORAGE_WORKERS)
+                cls._executor_pid = os.getpid()
+            return cls._executor
+
+
+atexit.register(AsyncBlockStorage.shutdown)
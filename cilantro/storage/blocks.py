@@ -1,15 +1,27 @@
 from cilantro.logger import get_logger
 import seneca.engine.storage.easy_db as t
 from seneca.engine.storage.easy_db import and_, or_
-from cilantro.storage.tables import create_table
+from cilantro.storage.tables import create_table, insert_rows, use_binary_column, ensure_index, execute_raw, \
+    column_type
 from cilantro.messages.consensus.block_contender import BlockContender
 from cilantro.utils import is_valid_hex, Hasher
 from cilantro.protocol.structures import MerkleTree
 from cilantro.protocol import wallet
 from cilantro.storage.db import DB
-from cilantro.storage.transactions import encode_tx, decode_tx
+from cilantro.storage.transactions import encode_tx, decode_tx, compress_tx, decompress_tx
+from cilantro.storage.archive import TransactionArchive
+from cilantro.storage.tx_filter import TransactionFilter
+from cilantro.constants.db import BINARY_STORAGE, BLOCK_STORAGE_BACKEND, SEGMENT_STORE_DIR, TX_ARCHIVE_DEPTH, \
+    TX_ARCHIVE_DIR, TX_FILTER_PATH, BLOCK_WAL, BLOCK_WAL_PATH, BLOCK_SHARDS, BLOCK_SHARD_RANGE_SIZE, \
+    BLOCK_REPLICATION_FACTOR
 from typing import List
+from collections import OrderedDict
+import multiprocessing
+import atexit
+import threading
+import math
 import time
+import os
 
 from cilantro.messages.block_data.block_metadata import BlockMetaData, NewBlockNotification
 # import cilantro.messages.block_data.block_metadata.BlockMetaData
@@ -23,10 +35,29 @@ Block Data fields
 REQUIRED_COLS must exist in all Cilantro based blockchains
 Custom Cilantro configurations can configure OPTIONAL_COLS to add additional fields to block metadata
 """
-REQUIRED_COLS = {'merkle_root': str, 'merkle_leaves': str, 'prev_block_hash': str, 'block_contender': str}  # TODO block_contender should be binary blob
+REQUIRED_COLS = {'merkle_root': str, 'merkle_leaves': str, 'prev_block_hash': str, 'block_contender': str}  # block_contender is a blob in BINARY_STORAGE mode
 OPTIONAL_COLS = {'timestamp': int, 'masternode_signature': str, 'masternode_vk': str}
 
 BLOCK_DATA_COLS = {**REQUIRED_COLS, **OPTIONAL_COLS}  # combines the 2 dictionaries
+BLOCK_COLS = ('number', 'hash') + tuple(BLOCK_DATA_COLS.keys())  # All columns of a block, in order
+
+# Header columns are the small, fixed width columns of a block. These are everything except the (potentially very large)
+# body columns 'merkle_leaves' and 'block_contender'. With the MySQL backend, headers are stored in the 'blocks' table,
+# and bodies in the 'block_bodies' table
+BLOCK_HEADER_COLS = ('number', 'hash', 'merkle_root', 'prev_block_hash', 'timestamp', 'masternode_signature',
+                     'masternode_vk')
+BLOCK_BODY_COLS = ('merkle_leaves', 'block_contender')
+
+HEADER_CACHE_SIZE = 1024  # Max number of block headers kept in the in-process LRU cache
+BLOCK_PAGE_SIZE = 256  # Default number of blocks fetched per query when streaming blocks with iter_blocks
+VALIDATION_MIN_RANGE_SIZE = 64  # Min number of blocks validated per task when validating the chain in parallel
+
+TX_FETCH_CHUNK_SIZE = 1000  # Max number of hashes in the IN-list of a single transaction lookup query
+TX_FETCH_TEMP_TABLE_MIN = 20000  # Lookups for at least this many hashes join against a temporary key table instead
+TX_ARCHIVE_BATCH_SIZE = 64  # Number of blocks whose transactions are moved to the archive per batch
+TX_FILTER_CAPACITY = 1000000  # Initial number of tx hashes the tx filter is sized for. It is rebuilt at double the size when full
+TX_FILTER_ERROR_RATE = 0.001  # Max false positive rate of the tx filter, while it is not full
+TX_FILTER_SAVE_INTERVAL = 256  # The tx filter is saved to disk whenever this many blocks were added since it was last saved
 
 GENESIS_EMPTY_STR = ''
 GENESIS_TIMESTAMP = 0
@@ -44,40 +75,144 @@ GENESIS_BLOCK_DATA = {
 }
 
 """
-Methods to create and seed the 'blocks' table
+Methods to create and seed the 'blocks' and 'block_bodies' tables
+
+The 'blocks' table holds block headers, so tip lookups and walks along the chain only scan narrow rows. The body columns
+of each block are in the 'block_bodies' table, keyed by block number, and are only joined in when they are selected.
 """
 
 
+def blocks_table():
+    return t.Table('blocks', t.AutoIncrementColumn('number'), [t.Column('hash', t.str_len(64), True)] +
+                   [t.Column(col, BLOCK_DATA_COLS[col]) for col in BLOCK_HEADER_COLS if col in BLOCK_DATA_COLS])
+
+
+def block_bodies_table():
+    return t.Table('block_bodies', t.Column('number', int, True),
+                   [t.Column(col, BLOCK_DATA_COLS[col]) for col in BLOCK_BODY_COLS])
+
+
 def build_blocks_table(ex, should_drop=True):
-    blocks = t.Table('blocks', t.AutoIncrementColumn('number'), [t.Column('hash', t.str_len(64), True)] +
-                     [t.Column(field_name, field_type) for field_name, field_type in BLOCK_DATA_COLS.items()])
+    blocks = create_table(ex, blocks_table(), should_drop)
+    ensure_index(ex, 'blocks', ('hash',), unique=True)
+
+    return blocks
+
+
+def build_block_bodies_table(ex, should_drop=True):
+    block_bodies = create_table(ex, block_bodies_table(), should_drop)
+
+    if BINARY_STORAGE:
+        use_binary_column(ex, 'block_bodies', 'block_contender')
 
-    return create_table(ex, blocks, should_drop)
+    _split_block_bodies(ex)
 
+    return block_bodies
 
-def seed_blocks(ex, blocks_table):
-    blocks_table.insert([{'hash': GENESIS_HASH, **GENESIS_BLOCK_DATA}]).run(ex)
+
+def _split_block_bodies(ex):
+    """
+    Moves the body columns out of a 'blocks' table built before headers and bodies were split, into 'block_bodies'.
+    This is a no-op if the blocks table has no body columns, so it is safe to call every time the tables are built.
+    """
+    if column_type(ex, 'blocks', 'merkle_leaves') is None:
+        return
+
+    log.notice("Moving block bodies out of the blocks table...")
+    execute_raw(ex, "INSERT IGNORE INTO block_bodies (`number`, {0}) SELECT `number`, {0} FROM blocks"
+                    .format(', '.join('`{}`'.format(c) for c in BLOCK_BODY_COLS)))
+    ex.conn.commit()
+    ex.raw('ALTER TABLE blocks {};'.format(', '.join('DROP COLUMN `{}`'.format(c) for c in BLOCK_BODY_COLS)))
+    log.notice("Done moving block bodies.")
+
+
+def seed_blocks(ex, blocks_table, block_bodies_table):
+    genesis = {'hash': GENESIS_HASH, **GENESIS_BLOCK_DATA}
+    # Block numbers are always assigned explicitly (see MySQLBlockBackend.insert_blocks), and the genesis block is 1
+    blocks_table.insert([{'number': 1, **{col: genesis[col] for col in BLOCK_HEADER_COLS if col != 'number'}}]).run(ex)
+    body = {col: genesis[col] for col in BLOCK_BODY_COLS}
+    block_bodies_table.insert([{'number': 1, **body}]).run(ex)
 
 
 """
 Utility Functions to encode/decode block data for serialization
 
-TODO -- a lot of this encoding can be completely omitted or at least improved once we get blob types in EasyDB
+In binary storage mode (see BINARY_STORAGE in constants/db.py) the serialized BlockContender is stored as is in a blob
+column. Otherwise it is hex encoded into a text column.
 """
 
 
-def _serialize_contender(block_contender: BlockContender) -> str:
+def _serialize_contender(block_contender: BlockContender) -> str or bytes:
+    if BINARY_STORAGE:
+        return block_contender.serialize()
+
     hex_str = block_contender.serialize().hex()
     return hex_str
 
 
-def _deserialize_contender(block_contender: str) -> BlockContender:
+def _deserialize_contender(block_contender: str or bytes) -> BlockContender:
     # Genesis Block Contender is None/Empty and thus should not be deserialized
-    if block_contender == GENESIS_BLOCK_CONTENDER:
-        return block_contender
+    if not block_contender:
+        return GENESIS_BLOCK_CONTENDER
+
+    if BINARY_STORAGE:
+        return BlockContender.from_bytes(bytes(block_contender))
+
     return BlockContender.from_bytes(bytes.fromhex(block_contender))
 
 
+"""
+In-process caches for chain state
+"""
+
+
+class BlockHeaderCache:
+    """
+    A bounded LRU cache of block headers, indexed by both block hash and block number. Since blocks are immutable once
+    stored, a cached header never goes stale; entries are only evicted when the cache is full, or dropped entirely if
+    the database is reset.
+    """
+
+    def __init__(self, max_size=HEADER_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits, self.misses = 0, 0
+        self._by_hash = OrderedDict()  # Ordered by recency of use, least recently used first
+        self._hash_for_number = {}
+
+    def get(self, number: int=0, hash: str='') -> dict or None:
+        if number > 0:
+            hash = self._hash_for_number.get(number)
+
+        header = self._by_hash.get(hash) if hash else None
+        if header is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._by_hash.move_to_end(hash)
+        return dict(header)
+
+    def put(self, header: dict):
+        h = header['hash']
+        if h in self._by_hash:
+            self._by_hash.move_to_end(h)
+            return
+
+        if len(self._by_hash) >= self.max_size:
+            _, evicted = self._by_hash.popitem(last=False)
+            del self._hash_for_number[evicted['number']]
+
+        self._by_hash[h] = dict(header)
+        self._hash_for_number[header['number']] = h
+
+    def clear(self):
+        self._by_hash.clear()
+        self._hash_for_number.clear()
+
+    def __len__(self):
+        return len(self._by_hash)
+
+
 """
 Custom Exceptions for block storage operations
 """
@@ -91,6 +226,264 @@ class InvalidBlockSignatureException(BlockStorageValidationException): pass
 class InvalidBlockHashException(BlockStorageValidationException): pass
 class InvalidBlockLinkException(BlockStorageValidationException): pass
 
+NO_BLOCKS_ERROR = "No blocks found! There should be a genesis block. Was the block storage properly seeded?"
+
+
+"""
+Block storage backends
+
+A backend persists (encoded) block rows and raw transactions for BlockStorageDriver, which does all validation, encoding,
+and caching on top of it. BLOCK_STORAGE_BACKEND (in constants/db.py) selects between MySQLBlockBackend, and
+SegmentBlockBackend in storage/segments.py. Backends expose the same methods, and lock internally as needed. If
+BLOCK_WAL is set, the selected backend is wrapped in a WALBlockBackend (see storage/wal.py), which makes blocks durable
+in a write-ahead log and commits them to the backend asynchronously.
+"""
+
+
+def _create_backend(recover=True):
+    if BLOCK_STORAGE_BACKEND == 'segments':
+        from cilantro.storage.segments import SegmentBlockBackend
+        backend = SegmentBlockBackend(SEGMENT_STORE_DIR, genesis_block={'hash': GENESIS_HASH, **GENESIS_BLOCK_DATA})
+    elif BLOCK_STORAGE_BACKEND == 'sharded':
+        from cilantro.storage.sharding import ShardedBlockBackend
+        backend = ShardedBlockBackend(BLOCK_SHARDS, BLOCK_SHARD_RANGE_SIZE, BLOCK_REPLICATION_FACTOR)
+    else:
+        assert BLOCK_STORAGE_BACKEND == 'mysql', "Unknown block storage backend {}".format(BLOCK_STORAGE_BACKEND)
+        backend = MySQLBlockBackend()
+
+    if BLOCK_WAL:
+        from cilantro.storage.wal import WALBlockBackend
+        backend = WALBlockBackend(backend, BLOCK_WAL_PATH, recover=recover)
+    return backend
+
+
+class MySQLBlockBackend:
+    """
+    Stores block headers in the 'blocks' table, block bodies in the 'block_bodies' table, and transactions in the
+    'transactions' table, using the process-specific DB Singleton. The tables are built and seeded with the genesis
+    block along with the rest of the database (see tables.py). Lookups are done in DB reader blocks, so they can run
+    concurrently with each other. Lookups which only select header columns do not touch the block_bodies table.
+    """
+
+    def insert_blocks(self, blocks: List[tuple], store_bodies=True, first_num: int=0) -> List[int]:
+        """
+        Inserts blocks, along with their transactions and tx_index rows, in a single DB transaction. All block rows are
+        written with one multi-row insert, as are all transaction rows, and all tx_index rows. If anything fails,
+        nothing is committed.
+
+        Blocks are numbered explicitly, consecutively after the tip. The tip row is locked with SELECT ... FOR UPDATE
+        under the DB write lock, so no other writer (in this process or another) can number a block in between.
+        Autoincrement ids are not used, since they are neither guaranteed to be consecutive within a multi-row insert
+        nor to follow the tip.
+        :param blocks: A list of (block row, raw transactions, tx hashes) tuples, in chain order. The raw transactions
+        may be empty, in which case only the tx hashes are indexed
+        :param store_bodies: If False, only the block headers and tx_index rows are inserted, and the block bodies and
+        raw transactions are left for the caller to store elsewhere (see ShardedBlockBackend)
+        :param first_num: If set, the number the caller expects the first block to get. If the tip has moved on since
+        the caller read it, nothing is inserted
+        :return: A list of the numbers assigned to the inserted blocks
+        :raises: A BlockStorageDatabaseException if first_num is set and does not follow the tip
+        """
+        block_rows = [{col: block[col] for col in block if col not in BLOCK_BODY_COLS} for block, _, _ in blocks]
+        tx_rows = []
+        for block, raw_transactions, tx_hashes in blocks if store_bodies else ():
+            for tx_hash, raw_tx in zip(tx_hashes, raw_transactions):
+                payload, dict_version = compress_tx(raw_tx)
+                tx_rows.append({'hash': tx_hash, 'data': encode_tx(payload), 'block_hash': block['hash'],
+                                'dict_version': dict_version})
+
+        with DB() as db:
+            try:
+                # Locks the tip row (and the gap after it), so no other writer can number a block until we commit
+                rows = execute_raw(db.ex, "SELECT `number` FROM blocks ORDER BY `number` DESC LIMIT 1 FOR UPDATE")
+                tip_num = rows[0][0] if rows else 0
+                if first_num and first_num != tip_num + 1:
+                    raise BlockStorageDatabaseException("Expected to insert blocks as number {} onwards, but the tip "
+                                                        "is block {}".format(first_num, tip_num))
+                first_num = tip_num + 1
+
+                for i, row in enumerate(block_rows):
+                    row['number'] = first_num + i
+
+                res = insert_rows(db.ex, 'blocks', block_rows, commit=False)
+                if not res:
+                    raise BlockStorageDatabaseException("Error inserting block! Got None/False result back "
+                                                        "from insert query. Result={}".format(res))
+
+                if store_bodies:
+                    body_rows = [{'number': first_num + i, **{col: block[col] for col in BLOCK_BODY_COLS}}
+                                 for i, (block, _, _) in enumerate(blocks)]
+                    insert_rows(db.ex, 'block_bodies', body_rows, commit=False)
+
+                if tx_rows:
+                    res = insert_rows(db.ex, 'transactions', tx_rows, commit=False)
+                    if not res:
+                        raise BlockStorageDatabaseException("Error inserting raw transactions! Got None/False result "
+                                                            "back from insert query. Result={}".format(res))
+
+                # Blocks stored from meta data come without raw transactions, but their tx hashes are still indexed
+                index_rows = [{'hash': tx_hash, 'block_number': first_num + i, 'block_hash': block['hash'],
+                               'position': position}
+                              for i, (block, _, tx_hashes) in enumerate(blocks)
+                              for position, tx_hash in enumerate(tx_hashes)]
+                if index_rows:
+                    insert_rows(db.ex, 'tx_index', index_rows, commit=False)
+
+                db.ex.conn.commit()
+            except Exception:
+                db.ex.conn.rollback()
+                raise
+
+        log.info("Committed {} blocks with {} transactions".format(len(block_rows), len(tx_rows)))
+        return list(range(first_num, first_num + len(block_rows)))
+
+    def get_block(self, number: int=0, hash: str='', cols: tuple=()) -> dict or None:
+        """
+        Returns the block with the given number or hash, or None if there is no such block
+        :param cols: The columns to fetch. If empty, all columns in BLOCK_COLS are fetched
+        """
+        cols = cols or BLOCK_COLS
+        if number > 0:
+            blocks = self._select_blocks(cols, "h.`number` = %s", [number])
+        else:
+            blocks = self._select_blocks(cols, "h.`hash` = %s", [hash])
+        return blocks[0] if blocks else None
+
+    def get_latest_block(self) -> dict:
+        latest = self._select_blocks(BLOCK_COLS, "h.`number` = (SELECT MAX(`number`) FROM blocks)", [])
+        assert latest, "No blocks found! There should be a genesis. Was the database properly seeded?"
+        return latest[0]
+
+    def get_blocks(self, after_hash: str='', after_number: int=0, limit: int=0, cols: tuple=()) -> List[dict]:
+        if after_hash:
+            where, args = "h.`number` > (SELECT `number` FROM blocks WHERE `hash` = %s)", [after_hash]
+        else:
+            where, args = "h.`number` > %s", [after_number]
+
+        where += " ORDER BY h.`number` ASC"
+        if limit:
+            where += " LIMIT %s"
+            args.append(limit)
+
+        return self._select_blocks(cols, where, args)
+
+    def get_tip(self) -> tuple:
+        with DB().reader() as db:
+            rows = db.tables.blocks.select('number', 'hash').order_by('number', desc=True).limit(1).run(db.ex)
+            if not rows:
+                raise BlockStorageDatabaseException(NO_BLOCKS_ERROR)
+            return rows[0]['number'], rows[0]['hash']
+
+    def iter_raw_transactions(self, hashes: List[str], is_block_hashes=False):
+        """
+        A generator which looks up the raw transactions for a list of (pre-validated) hashes, and yields them along with
+        the hash they were found by, in the order of 'hashes'. Lookups are done with IN-lists of at most TX_FETCH_CHUNK_SIZE hashes, one query per chunk, so
+        results for the first chunks are yielded before the later chunks are queried. For very large lookups (more
+        than TX_FETCH_TEMP_TABLE_MIN hashes) the hashes are instead loaded into a temporary key table and joined
+        against the transactions table in a single query.
+        :param hashes: A list of transaction hashes, or block hashes if is_block_hashes is True
+        :param is_block_hashes: If True, all transactions belonging to each block hash are yielded
+        :return: A generator of (hash, raw transaction) tuples, with each raw transaction as bytes
+        """
+        key_col = 'block_hash' if is_block_hashes else 'hash'
+
+        if len(hashes) >= TX_FETCH_TEMP_TABLE_MIN:
+            yield from self._fetch_raw_transactions_with_key_table(hashes, key_col)
+            return
+
+        for i in range(0, len(hashes), TX_FETCH_CHUNK_SIZE):
+            chunk = hashes[i:i + TX_FETCH_CHUNK_SIZE]
+            unique_chunk = list(set(chunk))
+            query = "SELECT `{}`, `data`, `dict_version` FROM transactions WHERE `{}` IN ({})"\
+                    .format(key_col, key_col, ', '.join(['%s'] * len(unique_chunk)))
+
+            with DB().reader() as db:
+                rows = execute_raw(db.ex, query, unique_chunk)
+
+            # Group the fetched transactions by key, so we can emit them in the order they were requested
+            txs_for_key = {}
+            for key, data, dict_version in rows:
+                txs_for_key.setdefault(key, []).append((data, dict_version))
+
+            for h in chunk:
+                for data, dict_version in txs_for_key.get(h, ()):
+                    yield h, decompress_tx(decode_tx(data), dict_version)
+
+    def get_tx_locations(self, tx_hashes: List[str]) -> dict:
+        """
+        Looks up the tx_index rows for a list of (pre-validated) transaction hashes, with IN-lists of at most
+        TX_FETCH_CHUNK_SIZE hashes
+        :return: A dictionary mapping each hash that was found to a tuple of (block number, block hash, position)
+        """
+        locations = {}
+        for i in range(0, len(tx_hashes), TX_FETCH_CHUNK_SIZE):
+            chunk = tx_hashes[i:i + TX_FETCH_CHUNK_SIZE]
+            query = "SELECT `hash`, `block_number`, `block_hash`, `position` FROM tx_index WHERE `hash` IN ({})"\
+                    .format(', '.join(['%s'] * len(chunk)))
+
+            with DB().reader() as db:
+                rows = execute_raw(db.ex, query, chunk)
+
+            locations.update((h, (number, block_hash, position)) for h, number, block_hash, position in rows)
+
+        return locations
+
+    def delete_transactions(self, block_hashes: List[str]):
+        """
+        Deletes all transactions belonging to the given blocks, in a single DB transaction
+        """
+        with DB() as db:
+            try:
+                for i in range(0, len(block_hashes), TX_FETCH_CHUNK_SIZE):
+                    chunk = block_hashes[i:i + TX_FETCH_CHUNK_SIZE]
+                    execute_raw(db.ex, "DELETE FROM transactions WHERE block_hash IN ({})"
+                                       .format(', '.join(['%s'] * len(chunk))), chunk)
+                db.ex.conn.commit()
+            except Exception:
+                db.ex.conn.rollback()
+                raise
+
+    def reset(self):
+        # The tables are dropped and rebuilt along with the rest of the database, so there is nothing to do here
+        pass
+
+    def _select_blocks(self, cols: tuple, where: str, args: list) -> List[dict]:
+        """
+        Selects columns of the blocks matching a WHERE clause, in which the blocks table is aliased as 'h'. The
+        block_bodies table is only joined in if any body columns are selected.
+        :return: A list of dictionaries, with a key for each column in 'cols'
+        """
+        query = "SELECT {} FROM blocks h".format(', '.join('{}.`{}`'.format('b' if c in BLOCK_BODY_COLS else 'h', c)
+                                                            for c in cols))
+        if any(c in BLOCK_BODY_COLS for c in cols):
+            query += " JOIN block_bodies b ON b.`number` = h.`number`"
+        query += " WHERE " + where
+
+        with DB().reader() as db:
+            rows = execute_raw(db.ex, query, args)
+
+        return [dict(zip(cols, row)) for row in rows]
+
+    def _fetch_raw_transactions_with_key_table(self, hashes: List[str], key_col: str) -> List[bytes]:
+        """
+        Looks up the raw transactions for a large list of hashes by loading them into a temporary table, and joining it
+        against the transactions table. Temporary tables are private to the DB connection, so concurrent readers (which
+        each use their own pooled connection) do not interfere. Returns a list of raw transactions in the order of
+        'hashes', as (hash, raw transaction) tuples.
+        """
+        with DB().reader() as db:
+            execute_raw(db.ex, "CREATE TEMPORARY TABLE tx_fetch_keys (pos INT PRIMARY KEY, `hash` VARCHAR(64), "
+                               "INDEX (`hash`))")
+            try:
+                execute_raw(db.ex, "INSERT INTO tx_fetch_keys (pos, `hash`) VALUES (%s, %s)",
+                            list(enumerate(hashes)), many=True)
+                rows = execute_raw(db.ex, "SELECT k.`hash`, t.`data`, t.`dict_version` FROM tx_fetch_keys k "
+                                          "JOIN transactions t ON t.`{}` = k.`hash` ORDER BY k.pos".format(key_col))
+            finally:
+                execute_raw(db.ex, "DROP TEMPORARY TABLE IF EXISTS tx_fetch_keys")
+
+        return [(h, decompress_tx(decode_tx(data), dict_version)) for h, data, dict_version in rows]
+
 
 class BlockStorageDriver:
     """
@@ -98,8 +491,29 @@ class BlockStorageDriver:
     database under the hood using the process-specific DB Singleton. This allows all methods on this class to be
     implemented as class methods, since database cursors are provided via the Singleton instead of stored as
     properties on the BlockStorageDriver class/instance.
+
+    Blocks and transactions are persisted through a storage backend, which is selected by BLOCK_STORAGE_BACKEND (see
+    _create_backend above). Each process lazily creates its own backend instance. The transactions of old blocks may
+    be moved from the backend to a TransactionArchive (see archive_transactions), which transaction lookups fall back to.
+
+    The latest block (the 'tip' of the chain) and recently used block headers are cached in process. Any block stored
+    through this class updates these caches, so cached chain state is always consistent with blocks written by this
+    process. Blocks written by other processes (or inserted directly into the blocks table) are not visible to the
+    cache until invalidate_cache() is called.
     """
 
+    _cache_lock = threading.RLock()
+    _cache_pid = None
+    _backend = None
+    _archive = None
+    _tx_filter = None
+    _tx_filter_verified = False  # False if the tx filter must be checked against the chain before it is used again
+    _tx_filter_lock = threading.RLock()
+    _archive_lock = threading.Lock()  # Held while transactions are being archived
+    _stores_blocks = False  # True once this process has stored a block. Only such a process saves the tx filter
+    _tip = None  # Tuple of (block number, block hash) for the latest block, or None if not cached yet
+    _headers = BlockHeaderCache()
+
     def __init__(self):
         raise NotImplementedError("Do not instantiate this class! Instead, use the class methods.")
 
@@ -131,22 +545,24 @@ class BlockStorageDriver:
         if not timestamp:
             timestamp = int(time.time())
 
+        # The tree is built once here, and reused for validation. Its leaves are the hashes of the raw transactions.
         tree = MerkleTree.from_raw_transactions(raw_transactions)
 
         publisher_vk = wallet.get_vk(publisher_sk)
         publisher_sig = wallet.sign(publisher_sk, tree.root)
 
-        # Build and validate block_data
+        # Build and validate block_data. The block is numbered after the same (cached) tip it links to
+        tip_num, tip_hash = cls._get_tip()
         block_data = {
             'block_contender': block_contender,
             'timestamp': timestamp,
             'merkle_root': tree.root_as_hex,
             'merkle_leaves': tree.leaves_as_concat_hex_str,
-            'prev_block_hash': cls.get_latest_block_hash(),
+            'prev_block_hash': tip_hash,
             'masternode_signature': publisher_sig,
             'masternode_vk': publisher_vk,
         }
-        cls.validate_block_data(block_data)
+        cls.validate_block_data(block_data, tree=tree)
 
         # Compute block hash
         block_hash = cls.compute_block_hash(block_data)
@@ -155,29 +571,17 @@ class BlockStorageDriver:
         log.info("Attempting to persist new block with hash {}".format(block_hash))
         block_data = cls._encode_block(block_data)
 
-        # Finally, persist the data
-        with DB() as db:
-            # Store block
-            res = db.tables.blocks.insert([{'hash': block_hash, **block_data}]).run(db.ex)
-            if res:
-                log.success2("Successfully inserted new block with number {} and hash {}".format(res['last_row_id'], block_hash))
-            else:
-                raise BlockStorageDatabaseException("Error inserting block! Got None/False result back "
-                                                    "from insert query. Result={}".format(res))
-
-            # Store raw transactions
-            log.info("Attempting to store {} raw transactions associated with block hash {}"
-                     .format(len(raw_transactions), block_hash))
-            tx_rows = [{'hash': Hasher.hash(raw_tx), 'data': encode_tx(raw_tx), 'block_hash': block_hash}
-                       for raw_tx in raw_transactions]
-
-            res = db.tables.transactions.insert(tx_rows).run(db.ex)
-            if res:
-                log.info("Successfully inserted {} transactions".format(res['row_count']))
-            else:
-                log.error("Error inserting raw transactions! Got None from insert query. Result={}".format(res))
+        # Finally, persist the block along with its raw transactions in a single commit
+        block_data['hash'] = block_hash
+        block_num = cls._insert_blocks([(block_data, raw_transactions, tree.leaves_as_hex)], tip_num + 1)[0]
+        log.success2("Successfully inserted new block with number {} and hash {}, containing {} transactions"
+                     .format(block_num, block_hash, len(raw_transactions)))
+
+        cls._stores_blocks = True
+        cls._update_tip(block_num, block_data)
+        cls._add_to_tx_filter(block_num, block_hash, tree.leaves_as_hex)
 
-            return block_hash
+        return block_hash
 
     @classmethod
     def store_block_from_meta(cls, block: BlockMetaData or NewBlockNotification) -> str:
@@ -187,24 +591,41 @@ class BlockStorageDriver:
         :return: The hash of the stored block (as a string)
         :raises: A BlockStorageException (or specific subclass) if any validation or storage fails
         """
-        assert issubclass(type(block), BlockMetaData), "Can only store BlockMetaData objects or subclasses"
+        return cls.store_blocks_from_meta([block])[0]
 
-        # Ensure this block's previous hash matches the latest block hash in the DB
-        if block.prev_block_hash != cls.get_latest_block_hash():
-            raise InvalidBlockLinkException("Attempted to store a block with previous_hash {} that does not match the "
-                                            "database latest block hash {}".format(block.prev_block_hash,
-                                                                                   cls.get_latest_block_hash()))
+    @classmethod
+    def store_blocks_from_meta(cls, blocks: List[BlockMetaData]) -> List[str]:
+        """
+        Stores a list of consecutive blocks from BlockMetaData objects, committing them all at once. The first block
+        must be the child of the current latest block, and each following block must be the child of the one before it.
+        If any block fails to link, nothing is stored.
+        :param blocks: A list of BlockMetaData objects (or subclasses), in chain order
+        :return: A list of the hashes of the stored blocks
+        :raises: A BlockStorageException (or specific subclass) if any validation or storage fails
+        """
+        assert blocks, "Expected at least one block to store"
 
-        with DB() as db:
-            encoded_block_data = cls._encode_block(block.block_dict())
-            res = db.tables.blocks.insert([encoded_block_data]).run(db.ex)
-            if res:
-                log.success2("Successfully inserted new block with number {} and hash {}".format(res['last_row_id'], block.block_hash))
-            else:
-                raise BlockStorageDatabaseException("Error inserting block! Got None/False result back "
-                                                    "from insert query. Result={}".format(res))
+        # Ensure the blocks form a chain starting at the latest block hash in the DB
+        tip_num, prev_hash = cls._get_tip()
+        for block in blocks:
+            assert issubclass(type(block), BlockMetaData), "Can only store BlockMetaData objects or subclasses"
 
-            return block.block_hash
+            if block.prev_block_hash != prev_hash:
+                raise InvalidBlockLinkException("Attempted to store a block with previous_hash {} that does not match "
+                                                "the previous block hash {}".format(block.prev_block_hash, prev_hash))
+            prev_hash = block.block_hash
+
+        encoded_blocks = [cls._encode_block(block.block_dict()) for block in blocks]
+        tx_hashes = [_split_leaves(b['merkle_leaves']) for b in encoded_blocks]
+        block_nums = cls._insert_blocks([(b, [], leaves) for b, leaves in zip(encoded_blocks, tx_hashes)], tip_num + 1)
+        cls._stores_blocks = True
+
+        for block_num, block_data, leaves in zip(block_nums, encoded_blocks, tx_hashes):
+            log.success2("Successfully inserted new block with number {} and hash {}".format(block_num, block_data['hash']))
+            cls._update_tip(block_num, block_data)
+            cls._add_to_tx_filter(block_num, block_data['hash'], leaves)
+
+        return [block.block_hash for block in blocks]
 
 
     @classmethod
@@ -219,24 +640,19 @@ class BlockStorageDriver:
         """
         assert bool(number > 0) ^ bool(hash), "Either 'number' XOR 'hash' arg must be given"
 
-        with DB() as db:
-            blocks = db.tables.blocks
-
-            if number > 0:
-                block = blocks.select().where(blocks.number == number).run(db.ex)
-                return cls._decode_block(block[0]) if block else None
+        if number > 0:
+            block = cls._get_backend().get_block(number=number)
+            return cls._decode_block(block) if block else None
 
-            elif hash:
-                assert is_valid_hex(hash, length=64), "Invalid block hash {}".format(hash)
-                block = blocks.select().where(blocks.hash == hash).run(db.ex)
+        assert is_valid_hex(hash, length=64), "Invalid block hash {}".format(hash)
+        block = cls._get_backend().get_block(hash=hash)
+        if not block:
+            return None
 
-                if block:
-                    b = cls._decode_block(block[0])
-                    if not include_number:
-                        del b['number']
-                    return b
-                else:
-                    return None
+        b = cls._decode_block(block)
+        if not include_number:
+            del b['number']
+        return b
 
     @classmethod
     def get_latest_block(cls, include_number=True) -> dict:
@@ -244,15 +660,47 @@ class BlockStorageDriver:
         Retrieves the latest block published in the chain.
         :return: A dictionary representing the latest block, containing a key for each column in the blocks table.
         """
-        with DB() as db:
-            latest = db.tables.blocks.select().order_by('number', desc=True).limit(1).run(db.ex)
-            assert latest, "No blocks found! There should be a genesis. Was the database properly seeded?"
+        # TODO unit tests around include_number functionality
+        block = cls._decode_block(cls._get_backend().get_latest_block())
+        if not include_number:
+            del block['number']
+        return block
+
+    @classmethod
+    def get_blocks(cls, after_hash: str='', after_number: int=0, limit: int=0, headers_only=False,
+                   include_number=True) -> List[dict]:
+        """
+        Retrieves a range of consecutive blocks following (and excluding) the block specified by 'after_hash' or
+        'after_number'. With the MySQL backend, this is a single query. If after_hash refers to a block that does not
+        exist, an empty list is returned.
+        :param after_hash: The hash of the block to start after. Must be valid 64 char hex string
+        :param after_number: The number of the block to start after. Pass 0 to start at the genesis block (number 1)
+        :param limit: The max number of blocks to return. If 0, all blocks up to the latest block are returned
+        :param headers_only: If True, only the columns in BLOCK_HEADER_COLS are fetched, leaving out the (large)
+        'merkle_leaves' and 'block_contender' columns
+        :param include_number: If False, the 'number' key is removed from each returned block
+        :return: A list of dictionaries, one for each block, sorted by their order in the block chain. Full blocks have
+        a key for each column in the blocks table, and headers have a key for each column in BLOCK_HEADER_COLS.
+        """
+        assert not (after_hash and after_number), "Only one of 'after_hash' or 'after_number' can be specified"
+        assert after_number >= 0, "after_number must be >= 0 (not {})".format(after_number)
+        assert limit >= 0, "Limit must be >= 0 (not {})".format(limit)
+
+        if after_hash:
+            assert is_valid_hex(after_hash, length=64), "Invalid block hash {}".format(after_hash)
 
-            # TODO unit tests around include_number functionality
-            block = cls._decode_block(latest[0])
+        cols = BLOCK_HEADER_COLS if headers_only else ('number', 'hash') + tuple(BLOCK_DATA_COLS.keys())
+        rows = cls._get_backend().get_blocks(after_hash=after_hash, after_number=after_number, limit=limit, cols=cols)
+
+        blocks = []
+        for block in rows:
+            if not headers_only:
+                block = cls._decode_block(block)
             if not include_number:
                 del block['number']
-            return block
+            blocks.append(block)
+
+        return blocks
 
     @classmethod
     def get_child_block_hashes(cls, parent_hash: str, limit=0) -> List[str] or None:
@@ -260,55 +708,192 @@ class BlockStorageDriver:
         Retrieve a list of child block hashes from a given a parent block. In other words, this method gets the hashes
         for all blocks created "after" the specified block with hash 'parent_hash'.
         :param parent_hash: The hash of the parent block
-        :param limit: If specified,
+        :param limit: If specified, at most this many hashes are returned (the ones immediately after parent_hash)
         :return: A list of hashes for the blocks that descend the parent block. These will be sorted by their order
         in the block chain, such that the first element is the block immediately after parent_hash, and the last element
         is the latest block in the block chain. Returns None if parent_hash is already the latest block, or if no
         block with 'parent_hash' can be found.
         """
         assert is_valid_hex(parent_hash, 64), "parent_hash {} is not valid 64 char hex str".format(parent_hash)
-        assert limit >= 0, "Limit must be >= 0 (not {})".format(limit)
-
-        # TODO implement functionality for limits
-        if limit:
-            raise NotImplementedError("Limiting logic not implemented")
-
-        # TODO optimize this once we get more functionality in EasyDB ...
-        # we would like to select all rows where the number >= the number associated with 'parent_hash', ordered
-        # ascending by number. For now, we must do this in 2 queries
-        with DB() as db:
-            blocks = db.tables.blocks
 
-            # Get block index number associated with 'parent_hash'
-            row = blocks.select().where(blocks.hash == parent_hash).run(db.ex)
-            if not row:
-                log.warning("No block with hash {} could be found!".format(parent_hash))
-                return None
-            parent_number = row[0]['number']
-
-            rows = blocks.select('hash').where(blocks.number > parent_number).order_by('number', desc=False).run(db.ex)
-            if not rows:
-                return None
-            return [row['hash'] for row in rows]
+        headers = cls.get_blocks(after_hash=parent_hash, limit=limit, headers_only=True)
+        if not headers:
+            return None
+        return [header['hash'] for header in headers]
 
     @classmethod
     def get_latest_block_hash(cls) -> str:
         """
-        Looks into the DB, and returns the latest block's hash. If the latest block_hash is for whatever reason invalid,
-        (ie. not valid 64 char hex string), then this method will raise an assertion.
+        Returns the latest block's hash. This is served from the in-process tip cache, and only hits the DB if the tip
+        is not cached yet. If the latest block_hash is for whatever reason invalid, (ie. not valid 64 char hex string),
+        then this method will raise an assertion.
         :return: A string, representing the latest (most recent) block's hash
         :raises: An assertion if the latest block hash is not vaild 64 character hex. If this happens, something was
         seriously messed up in the block storage process.
+        """
+        return cls._get_tip()[1]
 
-        # TODO this can perhaps be made more efficient by memoizing the new block_hash each time we store it
+    @classmethod
+    def get_latest_block_number(cls) -> int:
         """
-        with DB() as db:
-            row = db.tables.blocks.select('hash').order_by('number', desc=True).limit(1).run(db.ex)[0]
-            last_hash = row['hash']
+        Returns the latest block's number. Like get_latest_block_hash, this is served from the in-process tip cache.
+        :return: An int, representing the latest (most recent) block's number. The genesis block is number 1.
+        """
+        return cls._get_tip()[0]
 
-            assert is_valid_hex(last_hash, length=64), "Latest block hash is invalid 64 char hex! Got {}".format(last_hash)
+    @classmethod
+    def get_chain_start_number(cls) -> int:
+        """
+        Returns the number of the first block stored after the genesis block. This is 2, unless the chain was
+        bootstrapped from a snapshot (see snapshots.py), in which case it is the number of the snapshot block, as the
+        blocks between genesis and the snapshot block are not stored.
+        """
+        blocks = cls._get_backend().get_blocks(after_number=1, limit=1, cols=('number',))
+        return blocks[0]['number'] if blocks else 2
 
-            return last_hash
+    @classmethod
+    def get_latest_block_header(cls) -> dict:
+        """
+        Returns the latest block's header (see get_block_header). Unlike get_latest_block, this does not read the block
+        body, and is usually served from the in-process caches.
+        :return: A dictionary, containing a key for each column in BLOCK_HEADER_COLS
+        """
+        return cls.get_block_header(number=cls.get_latest_block_number())
+
+    @classmethod
+    def get_block_header(cls, number: int=0, hash: str='') -> dict or None:
+        """
+        Retrieves a block's header by its hash or number. A block header is a dictionary containing the columns
+        specified in BLOCK_HEADER_COLS (ie. all columns except 'merkle_leaves' and 'block_contender'). Headers are
+        served from an in-process LRU cache when possible. Returns None if no such block could be found.
+        :param number: The number of the block to fetch
+        :param hash: The hash of the block to fetch. Must be valid 64 char hex string
+        :return: A dictionary, containing a key for each column in BLOCK_HEADER_COLS
+        """
+        assert bool(number > 0) ^ bool(hash), "Either 'number' XOR 'hash' arg must be given"
+
+        with cls._cache_lock:
+            cls._check_cache_pid()
+            header = cls._headers.get(number=number, hash=hash)
+            if header:
+                return header
+
+        if hash:
+            assert is_valid_hex(hash, length=64), "Invalid block hash {}".format(hash)
+
+        # Only the header columns are fetched, so the (large) block body is not read
+        header = cls._get_backend().get_block(number=number, hash=hash, cols=BLOCK_HEADER_COLS)
+        if not header:
+            return None
+
+        with cls._cache_lock:
+            cls._headers.put(header)
+
+        return dict(header)
+
+    @classmethod
+    def invalidate_cache(cls):
+        """
+        Drops all cached chain state (the cached tip and block headers). This must be called if the blocks table is
+        modified by anything other than BlockStorageDriver in this process, for example if the database is reset.
+        """
+        with cls._cache_lock:
+            cls._tip = None
+            cls._headers.clear()
+            cls._tx_filter_verified = False
+
+    @classmethod
+    def reset_backend(cls):
+        """
+        Deletes all blocks and transactions held by the storage backend (other than the genesis block), along with the
+        transaction archive, and drops all cached chain state. This is called whenever the database is reset.
+        """
+        # A backend created just to be reset must not replay its write-ahead log into the database being dropped
+        cls._get_backend(recover=False).reset()
+
+        archive = cls._get_archive()
+        if archive:
+            archive.destroy()
+            with cls._cache_lock:
+                cls._archive = None
+
+        with cls._tx_filter_lock:
+            cls._tx_filter = None
+            TransactionFilter.destroy(TX_FILTER_PATH)
+
+        cls.invalidate_cache()
+
+    @classmethod
+    def flush(cls, timeout: float=None) -> bool:
+        """
+        Waits until every block stored by this process has been committed to the storage backend. Blocks are only
+        committed asynchronously if BLOCK_WAL is set. Otherwise, this returns immediately.
+        :param timeout: The max number of seconds to wait, or None to wait indefinitely
+        :return: True if all blocks were committed, or False if the timeout expired first
+        """
+        backend = cls._get_backend()
+        if hasattr(backend, 'flush'):
+            return backend.flush(timeout=timeout)
+        return True
+
+    @classmethod
+    def archive_transactions(cls, depth: int=TX_ARCHIVE_DEPTH, min_blocks: int=1) -> int:
+        """
+        Moves the raw transactions of every block more than 'depth' blocks behind the latest block out of the storage
+        backend, and into the transaction archive in TX_ARCHIVE_DIR (see storage/archive.py). Archived transactions are
+        still returned by get_raw_transactions and get_raw_transactions_from_block.
+
+        Blocks are archived in ascending order, in batches of TX_ARCHIVE_BATCH_SIZE. Each batch is synced to disk before
+        its transactions are deleted from the backend, so if this is interrupted, transactions may be left in both
+        places, but never in neither. Only the MySQL backend is archived, as the segment store backend does not keep
+        transactions in the database to begin with. The archive must only be written to by a single process, but it is
+        safe to call this from several threads of that process.
+        :param depth: The number of most recent blocks whose transactions are left in the backend
+        :param min_blocks: Nothing is archived unless at least this many blocks are due to be archived. This lets the
+        caller try archiving after every new block, while still archiving in batches
+        :return: The number of blocks archived
+        """
+        assert depth > 0, "Archive depth must be > 0 (not {})".format(depth)
+
+        if BLOCK_STORAGE_BACKEND != 'mysql':
+            log.debug("Not archiving transactions, as they are stored in the '{}' backend".format(BLOCK_STORAGE_BACKEND))
+            return 0
+
+        # Runs may overlap when called from a thread pool (see AsyncBlockStorage), but must not archive the same blocks
+        with cls._archive_lock:
+            archive, backend = cls._get_archive(create=True), cls._get_backend()
+            last_num = archive.last_block_number()
+            end_num = cls.get_latest_block_number() - depth
+            if end_num - last_num < max(min_blocks, 1):
+                return 0
+
+            num_archived = 0
+            while last_num < end_num:
+                limit = min(TX_ARCHIVE_BATCH_SIZE, end_num - last_num)
+                blocks = backend.get_blocks(after_number=last_num, limit=limit,
+                                            cols=('number', 'hash', 'merkle_leaves'))
+                if not blocks:
+                    break
+
+                block_hashes = [block['hash'] for block in blocks]
+                txs_for_block = {}
+                for block_hash, raw_tx in backend.iter_raw_transactions(block_hashes, is_block_hashes=True):
+                    txs_for_block.setdefault(block_hash, {})[Hasher.hash(raw_tx)] = raw_tx
+
+                # Transactions are archived in the order of the block's Merkle leaves, ie. the transaction hashes
+                for block in blocks:
+                    txs = txs_for_block.get(block['hash'], {})
+                    archive.archive_block(block['number'], block['hash'],
+                                          [(h, txs[h]) for h in _split_leaves(block['merkle_leaves']) if h in txs])
+
+                archive.sync()
+                backend.delete_transactions(block_hashes)
+
+                num_archived += len(blocks)
+                last_num = blocks[-1]['number']
+
+            log.info("Archived transactions of {} blocks, up to block number {}".format(num_archived, last_num))
+            return num_archived
 
     @classmethod
     def get_raw_transactions(cls, tx_hashes: str or list) -> bytes or None:
@@ -331,30 +916,167 @@ class BlockStorageDriver:
         return cls._get_raw_transactions(hashes=block_hashes, is_block_hashes=True)
 
     @classmethod
-    def validate_blockchain(cls, async=False):
+    def get_tx_location(cls, tx_hash: str) -> dict or None:
+        """
+        Looks up which block a transaction was stored in, without fetching the transaction or block. Transactions stored
+        along with their block (ie. through store_block) are indexed. With the MySQL backend, the transactions of blocks
+        stored from meta data are indexed as well.
+        :param tx_hash: The hash of the transaction, as a 64 char hex str
+        :return: A dictionary with keys 'block_number', 'block_hash', and 'position' (the index of the transaction in
+        the block's Merkle leaves), or None if no transaction with this hash has been stored
+        """
+        return cls.get_tx_locations([tx_hash]).get(tx_hash)
+
+    @classmethod
+    def get_tx_locations(cls, tx_hashes: List[str]) -> dict:
+        """
+        Looks up the locations of a list of transactions (see get_tx_location)
+        :param tx_hashes: A list of transaction hashes, each a 64 char hex str
+        :return: A dictionary mapping each hash that was found to its location dictionary. Hashes that could not be
+        found are left out.
+        """
+        for h in tx_hashes:
+            assert is_valid_hex(h, length=64), "Expected hashes to be 64 char hex str, not {}".format(h)
+
+        locations = cls._get_backend().get_tx_locations(list(OrderedDict.fromkeys(tx_hashes)))
+        return {h: {'block_number': number, 'block_hash': block_hash, 'position': position}
+                for h, (number, block_hash, position) in locations.items()}
+
+    @classmethod
+    def has_transaction(cls, tx_hash: str) -> bool:
+        """
+        Returns True if a transaction with this hash is in a stored block (see get_committed_transactions)
+        """
+        return tx_hash in cls.get_committed_transactions([tx_hash])
+
+    @classmethod
+    def get_committed_transactions(cls, tx_hashes: List[str], refresh=False) -> set:
+        """
+        Finds which of a list of transactions are already in stored blocks, for rejecting replays and duplicates. The
+        hashes are first checked against the tx filter (see storage/tx_filter.py), so hashes of new transactions are
+        rejected without a DB query. Only the hashes the filter reports as probably committed are confirmed against the
+        tx index, with a single lookup (see get_tx_locations). Committed transactions which are not indexed (with the
+        segments backend, those of blocks stored from meta data) can not be confirmed, and are reported as not committed.
+        :param tx_hashes: A list of transaction hashes, each a 64 char hex str
+        :param refresh: If True, the latest block is fetched from the backend rather than the cache, so blocks stored
+        by other processes are covered as well
+        :return: A set of the hashes which are committed
+        """
+        for h in tx_hashes:
+            assert is_valid_hex(h, length=64), "Expected hashes to be 64 char hex str, not {}".format(h)
+
+        if refresh:
+            cls._set_tip(*cls._get_backend().get_tip())
+
+        tx_filter = cls._get_tx_filter()
+        candidates = [h for h in OrderedDict.fromkeys(tx_hashes) if tx_filter.might_contain(h)]
+        if not candidates:
+            return set()
+
+        return set(cls._get_backend().get_tx_locations(candidates))
+
+    @classmethod
+    def save_tx_filter(cls):
+        """
+        Saves this process's tx filter to TX_FILTER_PATH, if any blocks were added to it since it was last saved. This is
+        called when the process exits. Only a process which stores blocks saves the filter, so processes which only
+        read it (such as the masternode's TransactionBatcher) never overwrite the block writer's copy.
+        """
+        with cls._tx_filter_lock:
+            if cls._cache_pid == os.getpid() and cls._tx_filter and cls._tx_filter.unsaved_blocks:
+                cls._save_tx_filter(cls._tx_filter)
+
+    @classmethod
+    def iter_blocks(cls, start_number: int=1, end_number: int=0, page_size: int=BLOCK_PAGE_SIZE,
+                    headers_only=False):
+        """
+        A generator which streams blocks in ascending order, fetching them from the DB in pages of 'page_size' blocks.
+        Only one page is held in memory at a time, so this can be used to scan the entire chain in constant memory.
+        Each page is fetched with a separate query that picks up after the last block number seen (rather than an
+        OFFSET), so every page costs one indexed range scan. The DB lock is not held between pages, so the caller is
+        free to use the DB while iterating.
+        :param start_number: The number of the first block to yield. The genesis block is number 1
+        :param end_number: The number of the last block to yield. If 0, iteration continues until the latest block
+        :param page_size: The number of blocks fetched per query
+        :param headers_only: If True, only the columns in BLOCK_HEADER_COLS are fetched for each block
+        :return: A generator yielding a dictionary for each block (see get_blocks)
+        """
+        assert start_number >= 1, "start_number must be >= 1 (not {})".format(start_number)
+        assert page_size > 0, "page_size must be > 0 (not {})".format(page_size)
+
+        last_number = start_number - 1
+
+        while not end_number or last_number < end_number:
+            limit = min(page_size, end_number - last_number) if end_number else page_size
+            page = cls.get_blocks(after_number=last_number, limit=limit, headers_only=headers_only)
+
+            for block in page:
+                yield block
+
+            if len(page) < limit:
+                return
+            last_number = page[-1]['number']
+
+    @classmethod
+    def validate_blockchain(cls, async=False, num_workers: int=0):
         """
         Validates the cryptographic integrity of the blockchain. See spec in docs folder for details on what defines a
-        valid blockchain structure.
-        # TODO docstring
-        :param async: If true, run this in a separate process
+        valid blockchain structure. Blocks are streamed from the DB (see iter_blocks), so memory use does not grow
+        with the length of the chain.
+
+        If the chain was bootstrapped from a snapshot, validation starts again at the snapshot block (see
+        get_chain_start_number). The snapshot block is validated on its own, but its link to its parent can not be, as
+        its parent is not stored.
+
+        If async is True, the chain is split into block ranges which are validated in parallel across a pool of
+        processes. Each worker checks the contents, signatures, hashes, and links of the blocks inside its range, and
+        reports the hashes at the range boundaries. The links between adjacent ranges are then checked sequentially
+        here, which is cheap.
+        :param async: If true, validate block ranges in parallel across a process pool
+        :param num_workers: The number of worker processes to use if async is True. Defaults to the number of CPUs
         :raises: An exception if validation fails
         """
         start = time.time()
+        chain_start = cls.get_chain_start_number()
+        if chain_start != 2:
+            log.info("Chain was bootstrapped from a snapshot at block number {}".format(chain_start))
 
-        if async:
-            raise NotImplementedError()
-
-        with DB() as db:
-            blocks = db.tables.blocks.select().order_by('number', desc=False).run(db.ex)
-            assert blocks, "No blocks found! There should be a genesis. Was the database properly seeded?"
-
-            for i in range(len(blocks) - 1):
-                cls._validate_block_link(cls._decode_block(blocks[i]), cls._decode_block(blocks[i+1]))
+        if not async:
+            if chain_start == 2:
+                cls._validate_block_range(1)
+            else:
+                cls._validate_block_range(1, 1)
+                cls._validate_block_range(chain_start)
+            log.info("Blockchain validation completed successfully in {} seconds.".format(round(time.time() - start, 2)))
+            return
+
+        num_workers = num_workers or os.cpu_count() or 1
+        latest_num = cls.get_latest_block_number()
+        first_num = 1 if chain_start == 2 else chain_start
+
+        # We use a few ranges per worker so that one slow range does not leave the other workers idle at the end
+        range_size = max(VALIDATION_MIN_RANGE_SIZE, math.ceil((latest_num - first_num + 1) / (num_workers * 4)))
+        ranges = [(i, min(i + range_size - 1, latest_num)) for i in range(first_num, latest_num + 1, range_size)]
+        if first_num != 1:
+            ranges.insert(0, (1, 1))
+
+        log.info("Validating {} blocks in {} ranges across {} processes".format(latest_num - first_num + 1, len(ranges),
+                                                                               num_workers))
+        with multiprocessing.Pool(num_workers) as pool:
+            boundaries = pool.map(_validate_block_range, ranges)
+
+        # Stitch together adjacent ranges. Each boundary is a tuple of (first block's prev hash, last block's hash)
+        for (start_num, _), (_, prev_last_hash), (next_prev_hash, _) in zip(ranges[1:], boundaries, boundaries[1:]):
+            if start_num == chain_start != 2:
+                continue  # The snapshot block's parent is not stored
+            if next_prev_hash != prev_last_hash:
+                raise InvalidBlockLinkException("Block number {} previous hash {} does not point to its parent block "
+                                                "with hash {}".format(start_num, next_prev_hash, prev_last_hash))
 
         log.info("Blockchain validation completed successfully in {} seconds.".format(round(time.time() - start, 2)))
 
     @classmethod
-    def validate_block_data(cls, block_data: dict):
+    def validate_block_data(cls, block_data: dict, tree: MerkleTree=None):
         """
         Validates the block_data dictionary. 'block_data' should be a strict subset of the 'block' dictionary, keys for all
         columns in the block table EXCEPT 'number' and 'hash'. If any validation fails, an exception is raised.
@@ -368,6 +1090,8 @@ class BlockStorageDriver:
 
         :param block_data: The dictionary containing a key for each column in BLOCK_DATA_COLS
         (ie 'merkle_root', 'prev_block_hash', .. ect)
+        :param tree: An optional MerkleTree built from the block's raw transactions. If given, it is used instead of
+        rebuilding a tree from the Merkle leaves in block_data (its leaves must still match them)
         :raises: An BlockStorageValidationException (or subclass) if any validation fails
         """
         # Check block_data has all the necessary keys
@@ -384,7 +1108,10 @@ class BlockStorageDriver:
             raise BlockStorageValidationException("block_data keys {} has unrecognized keys {}".format(actual_keys, extra_keys))
 
         # Validate Merkle Tree
-        tree = MerkleTree.from_leaves_hex_str(block_data['merkle_leaves'])
+        if tree is None:
+            tree = MerkleTree.from_leaves_hex_str(block_data['merkle_leaves'])
+        elif tree.leaves_as_concat_hex_str != block_data['merkle_leaves']:
+            raise InvalidMerkleTreeException("Merkle Tree leaves do not match leaves of block_data {}".format(block_data))
         if tree.root_as_hex != block_data['merkle_root']:
             raise InvalidMerkleTreeException("Merkle Tree could not be validated for block_data {}".format(block_data))
 
@@ -441,7 +1168,8 @@ class BlockStorageDriver:
         :param hashes: A single hash (as a string), or a list of hashes
         :param is_block_hashes: If true, 'hashes' is assumed to refer to block hashes, and all transactions belonging
         to the specified block hash(es) will be returned. If False, 'hashes' are assumed to be transaction hashes.
-        :return: A list of raw transactions, each as bytes, or None if no block with the given hash can be found
+        :return: A list of raw transactions, each as bytes, in the order of the requested hashes (hashes that could not
+        be found are skipped). Returns None if no transactions could be found at all.
         """
         assert isinstance(hashes, str) or isinstance(hashes, list), "Expected hashes to be a str or list"
 
@@ -451,16 +1179,50 @@ class BlockStorageDriver:
         for h in hashes:
             assert is_valid_hex(h, length=64), "Expected hashes to be 64 char hex str, not {}".format(h)
 
-        with DB() as db:
-            transactions = db.tables.transactions
-            comparison_col = transactions.block_hash if is_block_hashes else transactions.hash
-            where_clause = or_(*[(comparison_col == h) for h in hashes])
+        unique_hashes = list(OrderedDict.fromkeys(hashes))
+        txs_for_hash = {}
+        for h, raw_tx in cls._get_backend().iter_raw_transactions(unique_hashes, is_block_hashes=is_block_hashes):
+            txs_for_hash.setdefault(h, []).append(raw_tx)
+
+        # Anything not found in the backend may have been moved to the transaction archive
+        missing = [h for h in unique_hashes if h not in txs_for_hash]
+        archive = cls._get_archive() if missing else None
+        if archive:
+            for h in missing:
+                if is_block_hashes:
+                    txs = archive.get_block_transactions(h)
+                else:
+                    tx = archive.get_transaction(h)
+                    txs = [tx] if tx is not None else None
 
-            rows = transactions.select().where(where_clause).run(db.ex)
-            if not rows:
-                return None
-            else:
-                return [decode_tx(row['data']) for row in rows]
+                if txs:
+                    txs_for_hash[h] = txs
+
+        txs = [raw_tx for h in hashes for raw_tx in txs_for_hash.get(h, ())]
+        return txs or None
+
+    @classmethod
+    def _validate_block_range(cls, start_number: int, end_number: int=0) -> tuple:
+        """
+        Validates each block between start_number and end_number (inclusive), as well as the links between them.
+        :param start_number: The number of the first block to validate
+        :param end_number: The number of the last block to validate. If 0, validation continues until the latest block
+        :return: A tuple of (the first block's prev_block_hash, the last block's hash), so the caller can validate the
+        links to the neighbouring ranges
+        :raises: An exception if validation fails
+        """
+        first, parent = None, None
+        for block in cls.iter_blocks(start_number=start_number, end_number=end_number):
+            if parent:
+                cls._check_block_link(parent, block)
+            cls._validate_block(block)
+            first = first or block
+            parent = block
+
+        assert parent, "No blocks found between numbers {} and {}! There should be a genesis. Was the database " \
+                       "properly seeded?".format(start_number, end_number)
+
+        return first['prev_block_hash'], parent['hash']
 
     @classmethod
     def _validate_block_link(cls, parent: dict, child: dict):
@@ -471,6 +1233,18 @@ class BlockStorageDriver:
         :param child: The child's previous_block_hash should point to the parent's hash
         :raises: An exception if validation fails
         """
+        cls._check_block_link(parent, child)
+
+        for block in (parent, child):
+            cls._validate_block(block)
+
+    @classmethod
+    def _check_block_link(cls, parent: dict, child: dict):
+        """
+        Ensures the child block's previous hash points to the parent block. This only looks at the 'number', 'hash', and
+        'prev_block_hash' keys, so it works on block headers as well as full blocks.
+        :raises: An InvalidBlockLinkException if the child does not link to the parent
+        """
         assert parent['number'] + 1 == child['number'], "Attempted to validate non-adjacent blocks\nparent={}\nchild={}" \
             .format(parent, child)
 
@@ -479,19 +1253,208 @@ class BlockStorageDriver:
             raise InvalidBlockLinkException("Child block's previous hash does not point to parent!\nparent={}\nchild={}"
                                             .format(parent, child))
 
-        for block in (parent, child):
-            # We remove the 'hash'/'number' cols so we can reuse validate_block_data, which doesnt expect header cols
-            block_hash = block.pop('hash')
-            block_num = block.pop('number')
+    @classmethod
+    def _validate_block(cls, block: dict):
+        """
+        Validates the integrity of an individual block, ie. its block data is valid and hashes to its block hash.
+        :param block: A dictionary containing a key for each column in the blocks table. It is not modified.
+        :raises: An exception if validation fails
+        """
+        # We remove the 'hash'/'number' cols so we can reuse validate_block_data, which doesnt expect header cols
+        block = dict(block)
+        block_hash = block.pop('hash')
+        block_num = block.pop('number')
+
+        # Only validate block data if it is not the genesis block
+        if block_num != 1:
+            cls.validate_block_data(block)
+
+        # Ensure block data hashes to block hash
+        expected_hash = cls.compute_block_hash(block)
+        if expected_hash != block_hash:
+            raise InvalidBlockHashException("hash(block_data) != block_hash for block number {}!".format(block_num))
+
+    @classmethod
+    def _check_cache_pid(cls):
+        """
+        Caches are per process (just like the DB singleton). If this process was forked from a process that already
+        populated the caches, we discard them, as the parent may have stored blocks since. The parent's storage
+        backend is discarded as well, so this process opens its own.
+        """
+        pid = os.getpid()
+        if cls._cache_pid != pid:
+            cls._backend = None
+            cls._archive = None
+            cls._tx_filter = None
+            cls._stores_blocks = False
+            cls._tip = None
+            cls._headers = BlockHeaderCache()
+            cls._cache_pid = pid
+
+    @classmethod
+    def _get_backend(cls, recover=True):
+        """
+        Returns this process's storage backend, creating it if necessary
+        :param recover: If False and the backend is created, blocks left in its write-ahead log are discarded
+        """
+        with cls._cache_lock:
+            cls._check_cache_pid()
+            if cls._backend is None:
+                cls._backend = _create_backend(recover=recover)
+            return cls._backend
+
+    @classmethod
+    def _get_archive(cls, create=False) -> TransactionArchive or None:
+        """
+        Returns this process's transaction archive, opening it if necessary. Returns None if no transactions have been
+        archived yet, unless create is True.
+        """
+        with cls._cache_lock:
+            cls._check_cache_pid()
+            if cls._archive is None and (create or os.path.exists(TX_ARCHIVE_DIR)):
+                cls._archive = TransactionArchive(TX_ARCHIVE_DIR)
+            return cls._archive
+
+    @classmethod
+    def _get_tx_filter(cls) -> TransactionFilter:
+        """
+        Returns this process's tx filter, caught up to the latest block. The first time it is needed, the filter saved at
+        TX_FILTER_PATH is loaded, unless it does not cover this chain, in which case the filter is rebuilt from scratch.
+        It is also rebuilt, at double the capacity, once it holds more tx hashes than it was sized for.
+        """
+        tip_num, _ = cls._get_tip()
+
+        with cls._tx_filter_lock:
+            tx_filter, verified = cls._tx_filter, cls._tx_filter_verified
+            if tx_filter is None:
+                tx_filter, verified = TransactionFilter.load(TX_FILTER_PATH), False
+
+            if tx_filter and not verified and not cls._tx_filter_covers_chain(tx_filter):
+                log.warning("Saved tx filter does not match block number {} with hash {}. Rebuilding it."
+                            .format(tx_filter.block_number, tx_filter.block_hash))
+                tx_filter = None
+
+            capacity = TX_FILTER_CAPACITY
+            while True:
+                if tx_filter is None:
+                    log.info("Building tx filter with capacity {}".format(capacity))
+                    tx_filter = TransactionFilter(capacity, TX_FILTER_ERROR_RATE)
+
+                cls._catch_up_tx_filter(tx_filter, tip_num)
+                if not tx_filter.bloom.is_full():
+                    break
+                capacity, tx_filter = tx_filter.bloom.capacity * 2, None
+
+            if tx_filter.unsaved_blocks >= TX_FILTER_SAVE_INTERVAL:
+                cls._save_tx_filter(tx_filter)
+
+            cls._tx_filter, cls._tx_filter_verified = tx_filter, True
+            return tx_filter
+
+    @classmethod
+    def _add_to_tx_filter(cls, number: int, block_hash: str, tx_hashes: List[str]):
+        """
+        Adds a newly stored block to the tx filter, if it is loaded and up to date. Otherwise, the block is picked up
+        the next time the filter is caught up.
+        """
+        with cls._tx_filter_lock:
+            tx_filter = cls._tx_filter
+            if not (tx_filter and cls._tx_filter_verified and tx_filter.block_number == number - 1):
+                return
+
+            tx_filter.add_block(number, block_hash, tx_hashes)
+            if tx_filter.unsaved_blocks >= TX_FILTER_SAVE_INTERVAL:
+                cls._save_tx_filter(tx_filter)
+
+    @classmethod
+    def _save_tx_filter(cls, tx_filter: TransactionFilter):
+        # Called with _tx_filter_lock held
+        if cls._stores_blocks:
+            tx_filter.save(TX_FILTER_PATH)
+
+    @classmethod
+    def _catch_up_tx_filter(cls, tx_filter: TransactionFilter, end_number: int):
+        backend = cls._get_backend()
+        while tx_filter.block_number < end_number:
+            blocks = backend.get_blocks(after_number=tx_filter.block_number, limit=BLOCK_PAGE_SIZE,
+                                        cols=('number', 'hash', 'merkle_leaves'))
+            if not blocks:
+                break
+
+            for block in blocks:
+                tx_filter.add_block(block['number'], block['hash'], _split_leaves(block['merkle_leaves']))
+
+    @classmethod
+    def _tx_filter_covers_chain(cls, tx_filter: TransactionFilter) -> bool:
+        """
+        Returns True if the last block covered by the filter is still part of the stored chain
+        """
+        if not tx_filter.block_number:
+            return True
 
-            # Only validate block data if it is not the genesis block
-            if block_num != 1:
-                cls.validate_block_data(block)
+        header = cls.get_block_header(number=tx_filter.block_number)
+        return header is not None and header['hash'] == tx_filter.block_hash
 
-            # Ensure block data hashes to block hash
-            expected_hash = cls.compute_block_hash(block)
-            if expected_hash != block_hash:
-                raise InvalidBlockHashException("hash(block_data) != block_hash for block number {}!".format(block_num))
+    @classmethod
+    def _get_tip(cls) -> tuple:
+        """
+        Returns a tuple of (number, hash) for the latest block, querying the backend only if the tip is not cached
+        """
+        with cls._cache_lock:
+            cls._check_cache_pid()
+            if cls._tip:
+                return cls._tip
+
+        # The cache lock is not held while querying the backend, as the backend may need to wait on the DB lock
+        last_num, last_hash = cls._get_backend().get_tip()
+        assert is_valid_hex(last_hash, length=64), "Latest block hash is invalid 64 char hex! Got {}".format(last_hash)
+
+        return cls._set_tip(last_num, last_hash)
+
+    @classmethod
+    def _insert_blocks(cls, blocks: List[tuple], first_num: int) -> List[int]:
+        """
+        Inserts blocks into the backend as numbers first_num onwards, where first_num follows the cached tip the blocks
+        were linked to. If the backend's tip has moved on (ie. another process stored a block), nothing is inserted, and
+        the cached tip is dropped, so the next block is linked to the real tip.
+        :return: A list of the numbers of the inserted blocks
+        :raises: A BlockStorageDatabaseException if the blocks could not be inserted
+        """
+        try:
+            return cls._get_backend().insert_blocks(blocks, first_num=first_num)
+        except Exception as e:
+            with cls._cache_lock:
+                cls._tip = None
+
+            if isinstance(e, BlockStorageException):
+                raise
+            raise BlockStorageDatabaseException("Could not insert {} blocks as number {} onwards. Error: {}"
+                                                .format(len(blocks), first_num, e)) from e
+
+    @classmethod
+    def _update_tip(cls, number: int, block_data: dict):
+        """
+        Sets the cached tip to the newly stored block, and adds the block's header to the header cache
+        :param number: The number of the newly stored block
+        :param block_data: A dictionary containing (at least) a key for each column in BLOCK_HEADER_COLS except 'number'
+        """
+        with cls._cache_lock:
+            cls._set_tip(number, block_data['hash'])
+            header = {col: block_data[col] for col in BLOCK_HEADER_COLS if col != 'number'}
+            header['number'] = number
+            cls._headers.put(header)
+
+    @classmethod
+    def _set_tip(cls, number: int, hash: str) -> tuple:
+        """
+        Caches the tip, unless a later block is already cached. Since the tip only ever moves forward, this keeps the
+        cache correct when a reader that fetched the tip from the backend races with a writer storing a new block.
+        """
+        with cls._cache_lock:
+            cls._check_cache_pid()
+            if not cls._tip or number > cls._tip[0]:
+                cls._tip = (number, hash)
+            return cls._tip
 
     @classmethod
     def _decode_block(cls, block_data: dict) -> dict:
@@ -522,6 +1485,18 @@ class BlockStorageDriver:
         return block_data
 
 
+def _split_leaves(merkle_leaves: str) -> List[str]:
+    # Merkle leaves are stored as the concatenation of the 64 char hex tx hashes
+    return [merkle_leaves[i:i + 64] for i in range(0, len(merkle_leaves), 64)]
+
+
+def _validate_block_range(bounds: tuple) -> tuple:
+    # Process pools can only run module level functions, so this wraps BlockStorageDriver._validate_block_range
+    return BlockStorageDriver._validate_block_range(*bounds)
+
+
 # This needs to be declared below BlockStorageDriver class definition, as it uses a class function on BlockStorageDriver
 # TODO put this in another file so hes not just chillin down here
 GENESIS_HASH = BlockStorageDriver.compute_block_hash(GENESIS_BLOCK_DATA)
+
+atexit.register(BlockStorageDriver.save_tx_filter)
@@ -3,6 +3,8 @@ from cilantro.utils import Hasher
 from cilantro.storage.tables import create_table
 import seneca.engine.storage.easy_db as t
 from seneca.execute import execute_contract, get_read_only_contract_obj as get_exports
+from collections import OrderedDict
+import threading
 import datetime
 import os
 from functools import lru_cache
@@ -17,18 +19,89 @@ CONTRACTS_DIR = "{}/../contracts/lib".format(dir_path)
 GENESIS_AUTHOR = 'default_cilantro_contract'
 GENESIS_DATE = datetime.datetime(datetime.MINYEAR, 1, 1)
 
+CONTRACT_CACHE_SIZE = 256  # Max number of contracts kept in the process-wide contract cache
 
-def build_contracts_table(ex, should_drop=True):
-    contracts = t.Table('smart_contracts',
-                        t.Column('contract_id', t.str_len(64), True),
-                        [
-                            t.Column('code_str', str),
-                            t.Column('author', t.str_len(64)),
-                            t.Column('execution_datetime', datetime.datetime),
-                            t.Column('execution_status', t.str_len(30)),
-                        ])
 
-    return create_table(ex, contracts, should_drop)
+class ContractCache:
+    """
+    A bounded, process-wide LRU cache of contract info (author, execution datetime, and code string), keyed by contract
+    id, used to load contracts and the modules they import without querying the smart_contracts table every time.
+
+    The cache can not tell by itself whether a contract's row has changed, so invalidate() (or clear()) is the only thing
+    keeping it consistent with the table. Whatever writes contract rows must call it. In this tree contract code is only
+    written when contracts are seeded, which invalidates each seeded contract, or by a database reset or snapshot
+    import, which clear the whole cache.
+    """
+
+    def __init__(self, max_size=CONTRACT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits, self.misses, self.invalidations = 0, 0, 0
+        self.lock = threading.Lock()
+        self._infos = OrderedDict()  # Contract id -> contract info. Least recently used first
+
+    def get(self, contract_id: str) -> tuple or None:
+        """
+        Returns the cached (author, execution datetime, code string) tuple for a contract, or None on a miss
+        """
+        with self.lock:
+            info = self._infos.get(contract_id)
+            if info is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._infos.move_to_end(contract_id)
+            return info
+
+    def put(self, contract_id: str, info: tuple):
+        """
+        Caches a tuple of (author, execution datetime, code string) for a contract, replacing any cached info for it
+        """
+        with self.lock:
+            if contract_id not in self._infos and len(self._infos) >= self.max_size:
+                self._infos.popitem(last=False)
+
+            self._infos[contract_id] = info
+            self._infos.move_to_end(contract_id)
+
+    def invalidate(self, contract_id: str):
+        """
+        Drops the cached info for a contract. This must be called whenever a contract's row is (re)written.
+        """
+        with self.lock:
+            if self._infos.pop(contract_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self._infos)
+            self._infos.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'size': len(self._infos), 'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations}
+
+    def __len__(self):
+        return len(self._infos)
+
+
+contract_cache = ContractCache()
+
+
+def contracts_table():
+    return t.Table('smart_contracts',
+                   t.Column('contract_id', t.str_len(64), True),
+                   [
+                       t.Column('code_str', str),
+                       t.Column('author', t.str_len(64)),
+                       t.Column('execution_datetime', datetime.datetime),
+                       t.Column('execution_status', t.str_len(30)),
+                   ])
+
+
+def build_contracts_table(ex, should_drop=True):
+    return create_table(ex, contracts_table(), should_drop)
 
 
 def seed_contracts(ex, contracts_table):
@@ -37,6 +110,7 @@ def seed_contracts(ex, contracts_table):
     """
     # Insert contract code from files in file system into database table
     for contract_id, code_str in _read_contract_files():
+        contract_cache.invalidate(contract_id)
         contracts_table.insert([{
             'contract_id': contract_id,
             'code_str': code_str,
@@ -52,10 +126,10 @@ def seed_contracts(ex, contracts_table):
 
 def module_loader_fn(ex, contract_table):
     """
-    Returns a module loader function used for executing contracts
+    Returns a module loader function used for executing contracts. Contracts are loaded through the process-wide
+    contract_cache, so loaders can be created for every contract run without losing cached modules.
     :return: A function which takes a single parameter, a contract_id, and returns a tuple of (contract_data, code_str)
     """
-    @lru_cache(maxsize=32)
     def _module_loader_fn(contract_id: str) -> tuple:
         author, exec_dt, code_str = _lookup_contract_info(ex, contract_table, contract_id)
         runtime_data = {'author': author, 'contract_id': contract_id, 'execution_datetime': exec_dt}
@@ -94,15 +168,18 @@ def run_contract(*args, **kwargs):
     return _ex_contract(*args, **kwargs, get_contract=False)
 
 
-@lru_cache(maxsize=32)
 def _lookup_contract_info(executor, contract_table, contract_id: str) -> tuple:
     """
     Looks up the contract info for the specified contract id. This includes the author, execution datetime, and code
-    string. These values a returned in a tuple of that order.
+    string. These values a returned in a tuple of that order. The info is served from contract_cache when possible.
     :param contract_id: The id of the contract to lookup
     :return: A tuple, containing 3 elements (author: str, execution_datetime: datetime.datetime, code_str: str)
     :raises: An exception if the contract_id cannot be found
     """
+    info = contract_cache.get(contract_id)
+    if info is not None:
+        return info
+
     query = contract_table.select().where(contract_table.contract_id == contract_id).run(executor)
 
     assert len(query.rows) > 0, "No rows found for contract_id {}".format(contract_id)
@@ -114,7 +191,10 @@ def _lookup_contract_info(executor, contract_table, contract_id: str) -> tuple:
 
     assert len(code_str) > 0, 'Contract id {} with author {} has empty code string'.format(contract_id, author)
 
-    return author, exec_dt, code_str
+    info = (author, exec_dt, code_str)
+    contract_cache.put(contract_id, info)
+
+    return info
 
 
 @lru_cache(maxsize=32)
@@ -13,6 +13,10 @@ Classes include:
 from seneca.engine.storage.mysql_executer import Executer
 
 from multiprocessing import Lock
+from contextlib import contextmanager
+import threading
+import queue
+import time
 import os
 import math
 from cilantro.logger import get_logger
@@ -28,11 +32,14 @@ from sqlalchemy import select, insert, update, delete, and_
 
 
 from cilantro.storage.tables import build_tables, _reset_db
-from cilantro.constants.db import DB_SETTINGS
+from cilantro.storage.metrics import storage_metrics, call_site
+from cilantro.constants.db import DB_SETTINGS, DB_READ_POOL_SIZE
 
 DB_NAME = 'cilantro'
 SCRATCH_PREFIX = 'scratch_'
 
+LOCK_WAIT_WARN_SECONDS = 0.5  # Waiting longer than this to acquire the DB lock (or a pooled connection) logs a warning
+
 
 log = get_logger("DB")
 
@@ -262,8 +269,7 @@ def reset_db():
     def clear_instances():
         log.info("Clearing {} db instances...".format(len(DBSingletonMeta._instances)))
         for instance in DBSingletonMeta._instances.values():
-            instance.ex.cur.close()
-            instance.ex.conn.close()
+            instance.close()
         DBSingletonMeta._instances.clear()
         log.info("DB instances cleared.")
 
@@ -296,27 +302,249 @@ class DBSingletonMeta(type):
         return cls._instances[pid]
 
 
+class LockWaitStats:
+    """
+    Tracks how long callers waited to acquire a lock
+    """
+
+    def __init__(self):
+        self.count, self.total_wait, self.max_wait = 0, 0.0, 0.0
+
+    def record(self, wait: float):
+        self.count += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def as_dict(self) -> dict:
+        return {'count': self.count, 'total_wait': self.total_wait, 'max_wait': self.max_wait,
+                'avg_wait': self.total_wait / self.count if self.count else 0.0}
+
+
+class RWLock:
+    """
+    A reader/writer lock for the threads of a single process. Any number of threads may hold the lock for reading at
+    once, while a writer holds it exclusively. Waiting writers block new readers, so a steady stream of reads can not
+    starve writes.
+
+    A thread holding the lock may acquire it again (in either mode) without blocking, except that a read lock can not
+    be upgraded to a write lock, as two readers attempting this at once would deadlock. Each acquire must be matched
+    with a call to release().
+    """
+
+    def __init__(self):
+        self.stats = {'read': LockWaitStats(), 'write': LockWaitStats()}
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None  # Thread ident of the thread holding the write lock
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def acquire_read(self) -> float:
+        """
+        Acquires the lock for reading, and returns the number of seconds spent waiting for it
+        """
+        held = self._held()
+        if held:
+            held.append(None)
+            return 0.0
+
+        start = time.time()
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+        held.append('read')
+        return self._record('read', time.time() - start)
+
+    def acquire_write(self) -> float:
+        """
+        Acquires the lock for writing, and returns the number of seconds spent waiting for it
+        """
+        held = self._held()
+        if held:
+            assert self.is_writer(), "Can not acquire a write lock while holding a read lock"
+            held.append(None)
+            return 0.0
+
+        start = time.time()
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = threading.get_ident()
+
+        held.append('write')
+        return self._record('write', time.time() - start)
+
+    def release(self):
+        mode = self._held().pop()
+        if mode is None:
+            return
+
+        with self._cond:
+            if mode == 'write':
+                self._writer = None
+            else:
+                self._readers -= 1
+            self._cond.notify_all()
+
+    def is_writer(self) -> bool:
+        """
+        Returns True if the calling thread holds the write lock
+        """
+        return self._writer == threading.get_ident()
+
+    def _held(self) -> list:
+        # A stack of the modes this thread acquired the lock in, with None for nested acquires
+        if not hasattr(self._local, 'held'):
+            self._local.held = []
+        return self._local.held
+
+    def _record(self, mode: str, wait: float) -> float:
+        with self._cond:
+            self.stats[mode].record(wait)
+        return wait
+
+
+class ExecuterPool:
+    """
+    A pool of up to 'size' Executers, which are connected lazily as they are needed. If all of them are in use,
+    checkout() blocks until one is checked back in.
+    """
+
+    def __init__(self, size: int):
+        assert size > 0, "Pool size must be > 0 (not {})".format(size)
+        self.size = size
+        self.wait_stats = LockWaitStats()
+        self._idle = queue.LifoQueue()
+        self._executers = []
+        self._lock = threading.Lock()
+
+    def checkout(self) -> Executer:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._executers) < self.size:
+                ex = Executer(**DB_SETTINGS)
+                ex.raw('USE {};'.format(DB_SETTINGS['db']))
+                self._executers.append(ex)
+                return ex
+
+        start = time.time()
+        ex = self._idle.get()
+        with self._lock:
+            self.wait_stats.record(time.time() - start)
+        return ex
+
+    def checkin(self, ex: Executer):
+        self._idle.put(ex)
+
+    def close(self):
+        with self._lock:
+            for ex in self._executers:
+                ex.cur.close()
+                ex.conn.close()
+            self._executers.clear()
+
+
 class DB(metaclass=DBSingletonMeta):
+    """
+    The process-specific database handle. 'with DB() as db' acquires the DB lock exclusively, and gives access to the
+    writer Executer as db.ex. Code that only reads should use 'with DB().reader() as db' instead, which can run
+    concurrently with other readers. Each reading thread gets its own Executer from a pool of DB_READ_POOL_SIZE
+    connections, so db.ex inside a reader block refers to that thread's connection.
+    """
+
     def __init__(self, should_reset):
         self.log = get_logger("DB")
         self.log.info("Creating DB instance with should_reset={}".format(should_reset))
 
-        self.lock = Lock()
+        self.lock = RWLock()
+        self.read_pool = ExecuterPool(DB_READ_POOL_SIZE)
+        self._local = threading.local()
 
-        self.ex = Executer(**DB_SETTINGS)
-        self.tables = build_tables(self.ex, should_drop=should_reset)
+        self._writer_ex = Executer(**DB_SETTINGS)
+        self.tables = build_tables(self._writer_ex, should_drop=should_reset)
+
+    @property
+    def ex(self) -> Executer:
+        return getattr(self._local, 'ex', None) or self._writer_ex
 
     def __enter__(self):
-        self.log.debug("Acquiring lock {}".format(self.lock))
-        self.lock.acquire()
+        self._check_wait('write lock', self.lock.acquire_write())
+
+        # A stack of (start time, call site) for this thread's write blocks. Only the outermost one's hold time counts
+        if not hasattr(self._local, 'writes'):
+            self._local.writes = []
+        self._local.writes.append((time.time(), call_site()))
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.log.debug("Releasing lock {}".format(self.lock))
+        start, site = self._local.writes.pop()
+        if not self._local.writes:
+            storage_metrics.record_lock_hold(site, time.time() - start)
         self.lock.release()
 
+    @contextmanager
+    def reader(self):
+        """
+        A context manager which acquires the DB lock for reading, and checks out an Executer from the read pool for this
+        thread. Nested blocks reuse the Executer of the outer block (or the writer Executer, if this thread holds the
+        write lock).
+        """
+        self._check_wait('read lock', self.lock.acquire_read())
+        checked_out = None
+
+        try:
+            if getattr(self._local, 'ex', None) is None and not self.lock.is_writer():
+                start = time.time()
+                checked_out = self._local.ex = self.read_pool.checkout()
+                self._check_wait('pooled connection', time.time() - start)
+
+            yield self
+        finally:
+            if checked_out:
+                # End the read's transaction, so the next reader on this connection sees a fresh snapshot
+                checked_out.conn.rollback()
+                self._local.ex = None
+                self.read_pool.checkin(checked_out)
+            self.lock.release()
+
+    def lock_stats(self) -> dict:
+        """
+        Returns a dictionary of wait time statistics for the 'read' and 'write' lock, and for pooled connections ('pool')
+        """
+        stats = {mode: s.as_dict() for mode, s in self.lock.stats.items()}
+        stats['pool'] = self.read_pool.wait_stats.as_dict()
+        return stats
+
+    def close(self):
+        self.read_pool.close()
+        self._writer_ex.cur.close()
+        self._writer_ex.conn.close()
+
+    def _check_wait(self, name: str, wait: float):
+        storage_metrics.record_lock_wait(name, wait)
+        if wait > LOCK_WAIT_WARN_SECONDS:
+            self.log.warning("Waited {} seconds to acquire DB {}".format(round(wait, 3), name))
+
 
 class VKBook:
+    """
+    A registry of the verifying keys of all masternodes, delegates, and witnesses.
+
+    Membership checks (is_masternode, is_delegate, is_witness, and is_member) are done against frozensets, so they take
+    constant time however many nodes there are. These checks run for every incoming message, so callers should use them
+    rather than testing 'vk in VKBook.get_delegates()', which scans a list.
+
+    The sets are built once, from the lists below. The get_* methods return tuples, which are built along with the
+    sets rather than on every call, and which callers can not modify.
+    """
 
     MASTERNODES = ['82540bb5a9c84162214c5540d6e43be49bbfe19cf49685660cab608998a65144']
     DELEGATES = [
@@ -332,6 +560,9 @@ class VKBook:
       # "c9da4d9862bc9ef140989456c36f83af4c3e218b6a0d2c56f97128d3db0db9d3"
     ]
 
+    _lists = None  # Dict of role ('masternodes', 'delegates', 'witnesses', or 'all') -> tuple of vks
+    _sets = None  # Dict of role -> frozenset of vks
+
     @staticmethod
     def _destu_ify(data: str):
         assert len(data) % 64 == 0, "Length of data should be divisible by 64, but len={}! Logic error!".format(len(data))
@@ -340,7 +571,6 @@ class VKBook:
     @staticmethod
     def _get_vks(policy=None):
         condition = "where policy='{}'".format(policy) if policy else ''
-        print("select value from constants {}".format(condition))
         with DB() as db:
             q = db.execute("select value from constants {}".format(condition))
             rows = q.fetchall()
@@ -349,26 +579,54 @@ class VKBook:
 
             return VKBook._destu_ify(val)
 
-    @staticmethod
-    def get_all():
-        return VKBook.MASTERNODES + VKBook.DELEGATES + VKBook.WITNESSES
-        return VKBook._get_vks()
+    @classmethod
+    def is_masternode(cls, vk: str) -> bool:
+        return vk in cls._sets['masternodes']
 
-    @staticmethod
-    def get_masternodes():
-        return VKBook.MASTERNODES
-        return VKBook._get_vks('TESTNET_MASTERNODES')
+    @classmethod
+    def is_delegate(cls, vk: str) -> bool:
+        return vk in cls._sets['delegates']
 
-    @staticmethod
-    def get_delegates():
-        return VKBook.DELEGATES
-        return VKBook._get_vks('TESTNET_DELEGATES')
+    @classmethod
+    def is_witness(cls, vk: str) -> bool:
+        return vk in cls._sets['witnesses']
 
-    @staticmethod
-    def get_witnesses():
-        return VKBook.WITNESSES
-        return VKBook._get_vks('TESTNET_WITNESSES')
+    @classmethod
+    def is_member(cls, vk: str) -> bool:
+        return vk in cls._sets['all']
 
-    @staticmethod
-    def get_delegate_majority():
-        return math.ceil(len(VKBook.get_delegates()) * 2/3)
+    @classmethod
+    def get_all(cls):
+        return cls._lists['all']
+
+    @classmethod
+    def get_masternodes(cls):
+        return cls._lists['masternodes']
+
+    @classmethod
+    def get_delegates(cls):
+        return cls._lists['delegates']
+
+    @classmethod
+    def get_witnesses(cls):
+        return cls._lists['witnesses']
+
+    @classmethod
+    def get_delegate_majority(cls):
+        return math.ceil(len(cls.get_delegates()) * 2/3)
+
+    @classmethod
+    def _build(cls, masternodes: list, delegates: list, witnesses: list):
+        """
+        Builds the tuples and sets of verifying keys. They are built off to the side, and then swapped in with a single
+        assignment each, so lock free readers never see a partially built set.
+        """
+        lists = {'masternodes': tuple(masternodes), 'delegates': tuple(delegates), 'witnesses': tuple(witnesses)}
+        lists['all'] = lists['masternodes'] + lists['delegates'] + lists['witnesses']
+        sets = {role: frozenset(vks) for role, vks in lists.items()}
+
+        cls._sets, cls._lists = sets, lists
+
+
+# This needs to be declared below the VKBook class definition, as it uses a class function on VKBook
+VKBook._build(VKBook.MASTERNODES, VKBook.DELEGATES, VKBook.WITNESSES)
@@ -0,0 +1,175 @@
+"""
+Latency instrumentation for the storage layer.
+
+storage_metrics collects, per process:
+ - Query latency histograms, and the number of rows read and written, per call site. Every query run through
+   execute_raw (see tables.py) is recorded, under the module and function that issued it
+ - Wait time histograms for the DB lock (for reading and writing) and for pooled reader connections (see db.py)
+ - Write lock hold time histograms, per call site, which also covers queries run through EasyDB
+ - The most recent slow queries, ie. those taking at least SLOW_QUERY_SECONDS
+
+The metrics are available programmatically through storage_metrics.snapshot(), and are written to the log when the
+process exits.
+"""
+
+from cilantro.logger import get_logger
+from collections import deque
+import threading
+import atexit
+import time
+import sys
+import os
+
+log = get_logger("StorageMetrics")
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # Upper bounds of the histogram buckets
+SLOW_QUERY_SECONDS = 0.25  # Queries taking at least this long are captured in the slow query log
+SLOW_QUERY_LOG_SIZE = 100  # Max number of slow queries kept. Older ones are dropped first
+SLOW_QUERY_MAX_CHARS = 500  # Captured queries are truncated to this length
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Frames in these files are skipped when looking for the call site of a query or lock
+_INTERNAL_FILES = ('storage/tables.py', 'storage/db.py', 'storage/metrics.py', 'contextlib.py')
+
+
+class LatencyHistogram:
+    """
+    Counts durations into the buckets of LATENCY_BUCKETS_MS (plus one for anything slower), and keeps their total and max
+    """
+
+    def __init__(self):
+        self.count, self.total, self.max = 0, 0.0, 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+        ms = seconds * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def as_dict(self) -> dict:
+        labels = ['<={}ms'.format(b) for b in LATENCY_BUCKETS_MS] + ['>{}ms'.format(LATENCY_BUCKETS_MS[-1])]
+        return {'count': self.count, 'total': round(self.total, 6), 'max': round(self.max, 6),
+                'mean': round(self.total / self.count, 6) if self.count else 0.0,
+                'buckets': {label: n for label, n in zip(labels, self.buckets) if n}}
+
+
+class StorageMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def record_query(self, query: str, seconds: float, rows_read: int=0, rows_written: int=0):
+        site = call_site()
+        with self.lock:
+            self._check_pid()
+            stats = self.queries.get(site)
+            if stats is None:
+                stats = self.queries[site] = {'latency': LatencyHistogram(), 'rows_read': 0, 'rows_written': 0}
+
+            stats['latency'].record(seconds)
+            stats['rows_read'] += rows_read
+            stats['rows_written'] += rows_written
+
+            if seconds >= SLOW_QUERY_SECONDS:
+                self.slow_queries.append({'site': site, 'seconds': round(seconds, 6), 'time': time.time(),
+                                          'query': query[:SLOW_QUERY_MAX_CHARS]})
+
+        if seconds >= SLOW_QUERY_SECONDS:
+            log.warning("Slow query from {} took {} seconds: {}".format(site, round(seconds, 3),
+                                                                        query[:SLOW_QUERY_MAX_CHARS]))
+
+    def record_lock_wait(self, name: str, seconds: float):
+        """
+        Records the time spent waiting to acquire a lock (or pooled connection) called 'name'
+        """
+        with self.lock:
+            self._check_pid()
+            self.lock_waits.setdefault(name, LatencyHistogram()).record(seconds)
+
+    def record_lock_hold(self, site: str, seconds: float):
+        with self.lock:
+            self._check_pid()
+            self.lock_holds.setdefault(site, LatencyHistogram()).record(seconds)
+
+    def snapshot(self) -> dict:
+        """
+        Returns all metrics as a dictionary with keys 'queries' (call site -> dict of 'latency', 'rows_read', and
+        'rows_written'), 'lock_waits' (lock name -> latency), 'lock_holds' (call site -> latency), and 'slow_queries'
+        (a list, oldest first). Each latency is a histogram dictionary (see LatencyHistogram.as_dict).
+        """
+        with self.lock:
+            self._check_pid()
+            return {
+                'queries': {site: {'latency': s['latency'].as_dict(), 'rows_read': s['rows_read'],
+                                   'rows_written': s['rows_written']} for site, s in self.queries.items()},
+                'lock_waits': {name: h.as_dict() for name, h in self.lock_waits.items()},
+                'lock_holds': {site: h.as_dict() for site, h in self.lock_holds.items()},
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def reset(self):
+        with self.lock:
+            self._reset()
+
+    def dump(self):
+        """
+        Writes a summary of all metrics to the log, slowest call sites first
+        """
+        snapshot = self.snapshot()
+        if not (snapshot['queries'] or snapshot['lock_waits']):
+            return
+
+        log.info("Storage metrics for process {}:".format(os.getpid()))
+        for site, s in sorted(snapshot['queries'].items(), key=lambda item: -item[1]['latency']['total']):
+            log.info("  query {}: {} (rows read={}, rows written={})".format(site, s['latency'], s['rows_read'],
+                                                                            s['rows_written']))
+        for name, h in sorted(snapshot['lock_waits'].items()):
+            log.info("  wait for {}: {}".format(name, h))
+        for site, h in sorted(snapshot['lock_holds'].items(), key=lambda item: -item[1]['total']):
+            log.info("  write lock held by {}: {}".format(site, h))
+        for q in snapshot['slow_queries']:
+            log.info("  slow query from {} took {} seconds: {}".format(q['site'], q['seconds'], q['query']))
+
+    def _reset(self):
+        self.queries = {}
+        self.lock_waits = {}
+        self.lock_holds = {}
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        # Metrics are per process. A forked child starts out with none, rather than with a copy of its parent's
+        if self._pid != os.getpid():
+            self._reset()
+
+
+def call_site() -> str:
+    """
+    Returns the 'module.function' of the innermost caller outside of the storage internals (see _INTERNAL_FILES)
+    """
+    frame = sys._getframe(1)
+    while frame and frame.f_code.co_filename.replace(os.sep, '/').endswith(_INTERNAL_FILES):
+        frame = frame.f_back
+
+    if frame is None:
+        return 'unknown'
+
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return '{}.{}'.format(module, frame.f_code.co_name)
+
+
+def is_write_query(query: str) -> bool:
+    return query.lstrip()[:7].upper().startswith(WRITE_STATEMENTS)
+
+
+storage_metrics = StorageMetrics()
+atexit.register(storage_metrics.dump)
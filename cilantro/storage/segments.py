@@ -0,0 +1,554 @@
+"""
+An append-only, file based store for blocks and their raw transactions. This is used by BlockStorageDriver instead of
+MySQL if BLOCK_STORAGE_BACKEND is set to 'segments' (see constants/db.py).
+
+Blocks are immutable once stored, and only ever appended to the tip of the chain, so they do not need a general purpose
+database. Each block is appended to the current segment file as two records, its transactions followed by the block
+itself. Segment files are rolled over once they reach SEGMENT_MAX_BYTES. Each record is framed with its length and a
+CRC32 checksum of its contents.
+
+Records are located using two fixed width, append-only index files, which are memory mapped for reads:
+ - blocks.idx has one entry per block, in block number order, so the entry for block number n is at offset
+   (n - 1) * BLOCK_ENTRY.size. Each entry holds the block hash, and the location of the block and transactions records
+ - txs.idx has one entry per transaction, holding its hash, the location of its data inside its transactions record,
+   and the number of its block and its position in that block
+Lookups by hash go through in-memory dicts that map hashes to positions in these index files. They are built when the
+store is opened, and topped up from the index files whenever a lookup misses.
+
+Writes are not fsync'd individually. The segment and index files are synced together after every SYNC_BATCH_SIZE
+blocks (or when sync() is called). A block only 'exists' once its blocks.idx entry has been written, and any partially
+written blocks left over from a crash are truncated away when the store is reopened.
+
+A store can be opened in compressed mode, in which each transactions record is zlib compressed as a whole. Transactions
+of the same block compress much better together than apart, at the cost of decompressing the whole record to read any
+one of them. In this mode a txs.idx entry holds the location of its whole transactions record
+instead of the location of its data. A store must always be opened with the mode it was created with.
+
+A store directory is only written to by a single store at a time. The first store to open a directory takes an
+exclusive lock on its LOCK_FILE, and is the only one that recovers (truncates) and appends to the files. Stores opened
+on the directory while the lock is held (ie. by other processes) are read only, and never modify the files. Within a
+store, all reads and writes are serialized by the store's lock, since they share the index memory maps.
+"""
+
+from cilantro.logger import get_logger
+from cilantro.storage.blocks import BlockStorageDatabaseException, NO_BLOCKS_ERROR
+from typing import List
+import threading
+import struct
+import pickle
+import shutil
+import fcntl
+import mmap
+import zlib
+import os
+
+log = get_logger("SegmentStore")
+
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # A new segment file is started once the current one reaches this size
+SYNC_BATCH_SIZE = 32  # Number of appended blocks between fsyncs
+COMPRESSION_LEVEL = 6  # zlib compression level for transactions records in compressed stores
+
+SEGMENT_FILE_FORMAT = '{:08d}.seg'
+BLOCK_INDEX_FILE = 'blocks.idx'
+TX_INDEX_FILE = 'txs.idx'
+LOCK_FILE = 'store.lock'  # Locked by the one store which may write to the directory
+
+RECORD_HEADER = struct.Struct('<II')  # Payload length, CRC32 of payload
+BLOCK_ENTRY = struct.Struct('<32sIQIQI')  # Block hash, segment, block record offset, block length, txs record offset, txs length
+TX_ENTRY = struct.Struct('<32sIQIII')  # Tx hash, segment, tx data offset, tx data length, block number, position in
+                                      # block. In compressed stores, the offset and length are of the txs record
+TX_COUNT = struct.Struct('<I')
+
+
+class SegmentStoreException(Exception): pass
+class SegmentCorruptionException(SegmentStoreException): pass
+
+
+class IndexFile:
+    """
+    An append-only file of fixed width entries, memory mapped for reads. Entries are read by their position in the file.
+    """
+
+    def __init__(self, path: str, entry: struct.Struct, read_only=False):
+        self.entry = entry
+        self._map = None
+
+        if read_only:
+            # A partially written entry at the end of the file is simply not counted (see __len__)
+            self.file = open(path, 'rb', buffering=0)
+            return
+
+        self.file = open(path, 'a+b', buffering=0)
+
+        # Drop any partially written entry at the end of the file
+        extra = self._file_size() % entry.size
+        if extra:
+            log.warning("Dropping {} trailing bytes of partially written entry from index {}".format(extra, path))
+            self.file.truncate(self._file_size() - extra)
+
+    def __len__(self):
+        return self._file_size() // self.entry.size
+
+    def get(self, position: int) -> tuple:
+        end = (position + 1) * self.entry.size
+        if self._map is None or len(self._map) < end:
+            self._remap()
+            assert self._map is not None and len(self._map) >= end, "Index position {} out of range".format(position)
+
+        return self.entry.unpack_from(self._map, position * self.entry.size)
+
+    def iter_from(self, position: int):
+        for i in range(position, len(self)):
+            yield i, self.get(i)
+
+    def append(self, *values):
+        self.file.write(self.entry.pack(*values))
+
+    def truncate(self, num_entries: int):
+        self._close_map()
+        self.file.truncate(num_entries * self.entry.size)
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self._close_map()
+        self.file.close()
+
+    def _file_size(self) -> int:
+        return os.fstat(self.file.fileno()).st_size
+
+    def _remap(self):
+        self._close_map()
+        size = self._file_size()
+        if size:
+            self._map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class SegmentStore:
+    """
+    Stores blocks (as opaque bytes), along with their raw transactions, in append-only segment files. Blocks are
+    numbered in the order they are appended, starting at 1. All hashes are passed in and returned as 64 char hex strings.
+    If compress is True, each block's transactions are stored compressed (see module docstring). If another store holds
+    the directory's lock, the store is opened read only (see module docstring), and read_only is True.
+    """
+
+    def __init__(self, path: str, sync_batch_size: int=SYNC_BATCH_SIZE, max_segment_bytes: int=SEGMENT_MAX_BYTES,
+                 compress=False):
+        self.path = path
+        self.sync_batch_size = sync_batch_size
+        self.max_segment_bytes = max_segment_bytes
+        self.compress = compress
+        self.lock = threading.RLock()
+
+        os.makedirs(path, exist_ok=True)
+        self.read_only = not self._lock(path)
+
+        # The writer may not have created the index files yet. Creating them empty is all a reader ever writes
+        for index_file in (BLOCK_INDEX_FILE, TX_INDEX_FILE):
+            open(os.path.join(path, index_file), 'ab').close()
+        self._blocks = IndexFile(os.path.join(path, BLOCK_INDEX_FILE), BLOCK_ENTRY, read_only=self.read_only)
+        self._txs = IndexFile(os.path.join(path, TX_INDEX_FILE), TX_ENTRY, read_only=self.read_only)
+        self._segments = {}  # Segment number -> open segment file
+        self._unsynced = 0
+
+        self._block_numbers = {}  # Block hash (as bytes) -> block number
+        self._tx_positions = {}  # Tx hash (as bytes) -> position in the tx index
+        self._num_blocks_loaded, self._num_txs_loaded = 0, 0
+
+        with self.lock:
+            if self.read_only:
+                log.debug("Store {} is locked by another store. Opening it read only.".format(path))
+            else:
+                self._recover()
+            self._load_indexes()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def append_block(self, block_hash: str, block: bytes, transactions: List[tuple]) -> int:
+        """
+        Appends a block, and its transactions, to the store.
+        :param block_hash: The hash of the block
+        :param block: The serialized block
+        :param transactions: A list of (tx hash, raw transaction) tuples, in the order they appear in the block
+        :return: The number of the newly stored block
+        :raises: A SegmentStoreException if a block with this hash is already stored, or the store is read only
+        """
+        block_key = bytes.fromhex(block_hash)
+
+        with self.lock:
+            if self.read_only:
+                raise SegmentStoreException("Can not append to store {}, as it is open read only".format(self.path))
+            if self.block_number(block_hash) is not None:
+                raise SegmentStoreException("Block with hash {} is already stored".format(block_hash))
+
+            seg_num, seg_file = self._active_segment()
+            txs_offset = self._segment_size(seg_num)
+
+            # The transactions record is a count, followed by the length of each tx, followed by the data of each tx
+            tx_lengths = [len(data) for _, data in transactions]
+            txs_payload = TX_COUNT.pack(len(transactions)) + b''.join(TX_COUNT.pack(l) for l in tx_lengths) + \
+                          b''.join(data for _, data in transactions)
+            if self.compress:
+                txs_payload = zlib.compress(txs_payload, COMPRESSION_LEVEL)
+            block_offset = txs_offset + RECORD_HEADER.size + len(txs_payload)
+
+            seg_file.write(self._frame(txs_payload) + self._frame(block))
+
+            # Write the tx entries first, as the block entry is what makes the block (and its transactions) visible
+            tx_offset = txs_offset + RECORD_HEADER.size + TX_COUNT.size * (len(transactions) + 1)
+            number = len(self._blocks) + 1
+            for i, ((tx_hash, _), length) in enumerate(zip(transactions, tx_lengths)):
+                if self.compress:
+                    self._txs.append(bytes.fromhex(tx_hash), seg_num, txs_offset, len(txs_payload), number, i)
+                else:
+                    self._txs.append(bytes.fromhex(tx_hash), seg_num, tx_offset, length, number, i)
+                tx_offset += length
+
+            self._blocks.append(block_key, seg_num, block_offset, len(block), txs_offset, len(txs_payload))
+            self._load_indexes()
+
+            self._unsynced += 1
+            if self._unsynced >= self.sync_batch_size:
+                self.sync()
+
+            return number
+
+    def latest(self) -> tuple or None:
+        """
+        Returns a tuple of (number, hash) for the latest block, or None if the store is empty
+        """
+        with self.lock:
+            num_blocks = len(self._blocks)
+            if not num_blocks:
+                return None
+
+            return num_blocks, self._blocks.get(num_blocks - 1)[0].hex()
+
+    def block_number(self, block_hash: str) -> int or None:
+        key = bytes.fromhex(block_hash)
+        with self.lock:
+            if key not in self._block_numbers:
+                self._load_indexes()
+
+            return self._block_numbers.get(key)
+
+    def get_block(self, number: int=0, hash: str='') -> bytes or None:
+        """
+        Returns the serialized block with the given number or hash, or None if no such block is stored
+        """
+        with self.lock:
+            if hash:
+                number = self.block_number(hash)
+                if number is None:
+                    return None
+
+            if not 0 < number <= len(self._blocks):
+                return None
+
+            _, seg_num, offset, length, _, _ = self._blocks.get(number - 1)
+            return self._read_record(seg_num, offset, length)
+
+    def get_transaction(self, tx_hash: str) -> bytes or None:
+        with self.lock:
+            entry = self._tx_entry(tx_hash)
+            if entry is None:
+                return None
+
+            _, seg_num, offset, length, _, position = entry
+            if not self.compress:
+                return self._read(seg_num, offset, length)
+
+            payload = self._read_record(seg_num, offset, length)
+
+        return self._unpack_transactions(payload)[position]
+
+    def get_transaction_location(self, tx_hash: str) -> tuple or None:
+        """
+        Returns a tuple of (block number, block hash, position in block) for a transaction, or None if no transaction
+        with this hash is stored
+        """
+        with self.lock:
+            entry = self._tx_entry(tx_hash)
+            if entry is None:
+                return None
+
+            number, position = entry[4:]
+            return number, self._blocks.get(number - 1)[0].hex(), position
+
+    def get_block_transactions(self, block_hash: str) -> List[bytes] or None:
+        """
+        Returns the raw transactions of the block with the given hash, in order, or None if no such block is stored
+        """
+        with self.lock:
+            number = self.block_number(block_hash)
+            if number is None:
+                return None
+
+            _, seg_num, _, _, offset, length = self._blocks.get(number - 1)
+            payload = self._read_record(seg_num, offset, length)
+
+        return self._unpack_transactions(payload)
+
+    def sync(self):
+        """
+        Flushes all appended blocks to disk. Segment files are synced before the index files, so the indexes never
+        point to data that has not been synced.
+        """
+        with self.lock:
+            if self.read_only:
+                return
+            for f in self._segments.values():
+                os.fsync(f.fileno())
+            self._txs.sync()
+            self._blocks.sync()
+            self._unsynced = 0
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            for f in self._segments.values():
+                f.close()
+            self._segments.clear()
+            self._txs.close()
+            self._blocks.close()
+            self._lock_file.close()  # Releases the lock, if this store holds it
+
+    def destroy(self):
+        """
+        Closes the store and deletes all of its files
+        """
+        with self.lock:
+            self.close()
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def _lock(self, path: str) -> bool:
+        """
+        Tries to take the exclusive lock on the store directory, and returns True if it was taken. flock is used (rather
+        than lockf) since its locks also conflict between two stores opened on the same directory by one process
+        """
+        self._lock_file = open(os.path.join(path, LOCK_FILE), 'a+b')
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _frame(self, payload: bytes) -> bytes:
+        return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def _read(self, seg_num: int, offset: int, length: int) -> bytes:
+        data = os.pread(self._segment(seg_num).fileno(), length, offset)
+        if len(data) != length:
+            raise SegmentCorruptionException("Short read of {} bytes at offset {} of segment {} (expected {})"
+                                             .format(len(data), offset, seg_num, length))
+        return data
+
+    def _read_record(self, seg_num: int, offset: int, length: int) -> bytes:
+        record = self._read(seg_num, offset, RECORD_HEADER.size + length)
+        size, crc = RECORD_HEADER.unpack_from(record)
+        payload = record[RECORD_HEADER.size:]
+
+        if size != length or zlib.crc32(payload) != crc:
+            raise SegmentCorruptionException("Record at offset {} of segment {} failed its checksum"
+                                             .format(offset, seg_num))
+        return payload
+
+    def _tx_entry(self, tx_hash: str) -> tuple or None:
+        key = bytes.fromhex(tx_hash)
+        if key not in self._tx_positions:
+            self._load_indexes()
+
+        position = self._tx_positions.get(key)
+        if position is None:
+            return None
+
+        # A reader may see a transaction's entry before the entry of its block, which is what makes it visible
+        entry = self._txs.get(position)
+        return entry if entry[4] <= len(self._blocks) else None
+
+    def _unpack_transactions(self, payload: bytes) -> List[bytes]:
+        if self.compress:
+            payload = zlib.decompress(payload)
+
+        count = TX_COUNT.unpack_from(payload)[0]
+        lengths = struct.unpack_from('<{}I'.format(count), payload, TX_COUNT.size)
+
+        txs, pos = [], TX_COUNT.size * (count + 1)
+        for l in lengths:
+            txs.append(payload[pos:pos + l])
+            pos += l
+        return txs
+
+    def _segment(self, seg_num: int):
+        if seg_num not in self._segments:
+            self._segments[seg_num] = open(os.path.join(self.path, SEGMENT_FILE_FORMAT.format(seg_num)),
+                                           'rb' if self.read_only else 'a+b', buffering=0)
+        return self._segments[seg_num]
+
+    def _segment_size(self, seg_num: int) -> int:
+        path = os.path.join(self.path, SEGMENT_FILE_FORMAT.format(seg_num))
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _segment_numbers(self) -> List[int]:
+        return sorted(int(f.split('.')[0]) for f in os.listdir(self.path) if f.endswith('.seg'))
+
+    def _active_segment(self) -> tuple:
+        """
+        Returns a tuple of (segment number, segment file) for the segment new blocks should be appended to, starting a
+        new segment if the current one is full
+        """
+        seg_nums = self._segment_numbers()
+        seg_num = seg_nums[-1] if seg_nums else 0
+
+        if self._segment_size(seg_num) >= self.max_segment_bytes:
+            self.sync()
+            seg_num += 1
+            log.info("Starting new segment {} in store {}".format(seg_num, self.path))
+
+        return seg_num, self._segment(seg_num)
+
+    def _load_indexes(self):
+        """
+        Adds any index entries written since the indexes were last loaded to the hash lookup dicts
+        """
+        for position, entry in self._txs.iter_from(self._num_txs_loaded):
+            self._tx_positions[entry[0]] = position
+            self._num_txs_loaded = position + 1
+
+        for position, entry in self._blocks.iter_from(self._num_blocks_loaded):
+            self._block_numbers[entry[0]] = position + 1
+            self._num_blocks_loaded = position + 1
+
+    def _recover(self):
+        """
+        Truncates anything written after the last complete block, ie. index entries that point past the end of their
+        segment, transaction entries that belong to no block, and trailing segment data.
+        """
+        num_blocks, end = len(self._blocks), (0, 0)
+        while num_blocks:
+            _, seg_num, offset, length, _, _ = self._blocks.get(num_blocks - 1)
+            end = (seg_num, offset + RECORD_HEADER.size + length)
+            if self._segment_size(seg_num) >= end[1]:
+                break
+            num_blocks, end = num_blocks - 1, (0, 0)
+
+        if num_blocks < len(self._blocks):
+            log.warning("Dropping {} incomplete blocks from store {}".format(len(self._blocks) - num_blocks, self.path))
+            self._blocks.truncate(num_blocks)
+
+        num_txs = len(self._txs)
+        while num_txs and self._txs.get(num_txs - 1)[1:3] >= end:
+            num_txs -= 1
+
+        if num_txs < len(self._txs):
+            log.warning("Dropping {} orphaned transactions from store {}".format(len(self._txs) - num_txs, self.path))
+            self._txs.truncate(num_txs)
+
+        for seg_num in self._segment_numbers():
+            if seg_num > end[0]:
+                os.remove(os.path.join(self.path, SEGMENT_FILE_FORMAT.format(seg_num)))
+            elif seg_num == end[0] and self._segment_size(seg_num) > end[1]:
+                self._segment(seg_num).truncate(end[1])
+
+
+class SegmentBlockBackend:
+    """
+    A block storage backend for BlockStorageDriver which keeps blocks in a SegmentStore. Blocks are passed in and
+    returned as the same (encoded) row dictionaries the MySQL backend uses, and are pickled into the store.
+    """
+
+    def __init__(self, path: str, genesis_block: dict):
+        self.path = path
+        self.genesis_block = genesis_block
+        self.store = SegmentStore(path)
+        self._seed()
+
+    def insert_blocks(self, blocks: List[tuple], first_num: int=0) -> List[int]:
+        """
+        Appends blocks, given as a list of (block row, raw transactions, tx hashes) tuples, and returns their numbers.
+        The blocks are appended under the store lock, so no other block can be interleaved between them.
+        :param first_num: If set, the number the caller expects the first block to get. Nothing is appended if it does
+        not follow the tip
+        """
+        with self.store.lock:
+            if first_num and first_num != len(self.store) + 1:
+                raise SegmentStoreException("Expected to append blocks as number {} onwards, but the tip is block {}"
+                                            .format(first_num, len(self.store)))
+            return [self.store.append_block(block['hash'], pickle.dumps(block, protocol=pickle.HIGHEST_PROTOCOL),
+                                            list(zip(tx_hashes, raw_transactions)))
+                    for block, raw_transactions, tx_hashes in blocks]
+
+    def get_block(self, number: int=0, hash: str='', cols: tuple=()) -> dict or None:
+        if hash:
+            number = self.store.block_number(hash)
+            if number is None:
+                return None
+
+        data = self.store.get_block(number=number)
+        if data is None:
+            return None
+
+        # Blocks are stored whole, so selecting only some columns saves nothing here
+        block = {'number': number, **pickle.loads(data)}
+        return {col: block[col] for col in cols} if cols else block
+
+    def get_latest_block(self) -> dict:
+        return self.get_block(number=len(self.store))
+
+    def get_blocks(self, after_hash: str='', after_number: int=0, limit: int=0, cols: tuple=()) -> List[dict]:
+        if after_hash:
+            after_number = self.store.block_number(after_hash)
+            if after_number is None:
+                return []
+
+        last_number = len(self.store)
+        if limit:
+            last_number = min(last_number, after_number + limit)
+
+        blocks = (self.get_block(number=n) for n in range(after_number + 1, last_number + 1))
+        return [{col: block[col] for col in cols} for block in blocks]
+
+    def get_tip(self) -> tuple:
+        tip = self.store.latest()
+        if tip is None:
+            # A read only store is not seeded, and is empty until the writer has seeded it
+            raise BlockStorageDatabaseException(NO_BLOCKS_ERROR)
+        return tip
+
+    def iter_raw_transactions(self, hashes: List[str], is_block_hashes=False):
+        for h in hashes:
+            if is_block_hashes:
+                for tx in self.store.get_block_transactions(h) or ():
+                    yield h, tx
+            else:
+                tx = self.store.get_transaction(h)
+                if tx is not None:
+                    yield h, tx
+
+    def get_tx_locations(self, tx_hashes: List[str]) -> dict:
+        locations = {}
+        for h in tx_hashes:
+            location = self.store.get_transaction_location(h)
+            if location is not None:
+                locations[h] = location
+        return locations
+
+    def reset(self):
+        log.info("Deleting segment store at {}".format(self.path))
+        self.store.destroy()
+        self.store = SegmentStore(self.path)
+        self._seed()
+
+    def _seed(self):
+        # Only the process writing to the store seeds it
+        if not len(self.store) and not self.store.read_only:
+            log.info("Seeding segment store at {} with genesis block".format(self.path))
+            self.insert_blocks([(self.genesis_block, [], [])])
+            self.store.sync()
@@ -0,0 +1,319 @@
+"""
+A block storage backend which spreads block bodies and raw transactions over several MySQL schemas (shards), so
+storage and query load can be spread over several masternodes' MySQL instances. This is used by BlockStorageDriver if
+BLOCK_STORAGE_BACKEND is set to 'sharded' (see constants/db.py).
+
+Blocks are assigned to shards in ranges of 'range_size' consecutive block numbers, round robin, and each range is also
+replicated to the 'replication - 1' shards after its primary (see shard_owners). So every shard holds about
+replication / len(shards) of the chain's bodies and transactions. Writes go to every shard holding the block, and reads
+go to the first of them that answers, so a range stays readable as long as one of its replicas is up.
+
+Block headers and the tx_index stay in the local database, as they are small, and are needed to route lookups: a
+lookup by block hash or tx hash first finds the block number locally, and then reads from that block's shards. Bodies
+and transactions stored before sharding was enabled (including the genesis block's) are still read from the local
+database.
+
+Each shard is named either 'schema' (a schema on the local MySQL server, which is handy for testing several shards
+locally) or 'host/schema'. Shards are connected to with the credentials in DB_SETTINGS, and their tables are created
+on first use.
+"""
+
+from cilantro.logger import get_logger
+from cilantro.storage.blocks import MySQLBlockBackend, BlockStorageDatabaseException, build_block_bodies_table, \
+    BLOCK_COLS, BLOCK_BODY_COLS, TX_FETCH_CHUNK_SIZE
+from cilantro.storage.transactions import build_transactions_table, encode_tx, decode_tx, compress_tx, decompress_tx
+from cilantro.storage.tables import execute_raw
+from cilantro.storage.db import DB
+from cilantro.constants.db import DB_SETTINGS
+from seneca.engine.storage.mysql_executer import Executer
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import List
+import threading
+
+log = get_logger("ShardedStorage")
+
+
+def shard_owners(number: int, num_shards: int, range_size: int, replication: int) -> List[int]:
+    """
+    Returns the indexes of the shards holding a block, primary first. Blocks are assigned to shards in ranges of
+    range_size consecutive block numbers, round robin, and each range is replicated to the shards after its primary.
+    """
+    first = ((number - 1) // range_size) % num_shards
+    return [(first + i) % num_shards for i in range(min(replication, num_shards))]
+
+
+class BlockShard:
+    """
+    A MySQL schema holding the block_bodies and transactions tables for the block ranges assigned to it. Connections
+    are not thread safe, so the shard's connection is only used by one thread at a time.
+    """
+
+    def __init__(self, spec: str):
+        host, _, self.name = spec.rpartition('/')
+        self.host = host or DB_SETTINGS['host']
+        self.lock = threading.Lock()
+        self._ex = None
+
+    def __repr__(self):
+        return '{}/{}'.format(self.host, self.name)
+
+    @contextmanager
+    def connection(self):
+        """
+        Yields this shard's Executer, connecting (and building the shard's tables) if necessary. If the block raises,
+        the connection is closed, so any open transaction is rolled back, and the next use reconnects.
+        """
+        with self.lock:
+            if self._ex is None:
+                self._ex = self._connect()
+            try:
+                yield self._ex
+            except Exception:
+                self._close()
+                raise
+
+    def drop(self):
+        """
+        Drops the shard's schema, along with everything stored in it. It is rebuilt on next use.
+        """
+        with self.connection() as ex:
+            ex.raw('DROP DATABASE IF EXISTS {};'.format(self.name))
+        with self.lock:
+            self._close()
+
+    def _connect(self):
+        log.debug("Connecting to block shard {}".format(self))
+        ex = Executer(**{**DB_SETTINGS, 'host': self.host, 'db': self.name})
+        ex.raw('CREATE DATABASE IF NOT EXISTS {};'.format(self.name))
+        ex.raw('USE {};'.format(self.name))
+        build_block_bodies_table(ex, should_drop=False)
+        build_transactions_table(ex, should_drop=False)
+        ex.conn.commit()
+        return ex
+
+    def _close(self):
+        if self._ex is not None:
+            try:
+                self._ex.cur.close()
+                self._ex.conn.close()
+            except Exception as e:
+                log.debug("Error closing connection to block shard {}: {}".format(self, e))
+            self._ex = None
+
+
+class ShardedBlockBackend:
+    """
+    Stores block headers and the tx_index in the local database, through a MySQLBlockBackend, and block bodies and raw
+    transactions in the shards that own each block.
+    """
+
+    def __init__(self, shards: List[str], range_size: int, replication: int):
+        assert shards, "Sharded block storage requires at least one shard (see BLOCK_SHARDS in constants/db.py)"
+        assert range_size > 0 and replication > 0, "Range size and replication factor must be > 0"
+
+        self.shards = [BlockShard(spec) for spec in shards]
+        self.range_size = range_size
+        self.replication = min(replication, len(self.shards))
+        self.local = MySQLBlockBackend()
+
+        log.info("Sharding blocks over {} shards in ranges of {}, with replication factor {}"
+                 .format(len(self.shards), range_size, self.replication))
+
+    def owners(self, number: int) -> List[BlockShard]:
+        return [self.shards[i] for i in shard_owners(number, len(self.shards), self.range_size, self.replication)]
+
+    def insert_blocks(self, blocks: List[tuple], first_num: int=0) -> List[int]:
+        """
+        Writes the bodies and raw transactions of the blocks to each of their shards (one transaction per shard), and
+        then inserts their headers locally. Shard writes replace existing rows, so if anything fails the insert can
+        simply be retried.
+        :raises: A BlockStorageDatabaseException if any shard holding one of the blocks can not be written to, or if
+        another writer moved the tip on while the bodies were being written
+        """
+        # Blocks are numbered consecutively after the tip, so bodies can be written before the headers are inserted.
+        # The local insert refuses to number them differently, and any rows left on the shards under these numbers are
+        # replaced when the numbers are next used
+        first_num = first_num or self.local.get_tip()[0] + 1
+        self._write_bodies(blocks, first_num)
+        return self.local.insert_blocks(blocks, store_bodies=False, first_num=first_num)
+
+    def get_block(self, number: int=0, hash: str='', cols: tuple=()) -> dict or None:
+        cols = cols or BLOCK_COLS
+        header = self.local.get_block(number=number, hash=hash, cols=self._header_cols(cols))
+        return self._add_bodies([header], cols)[0] if header else None
+
+    def get_latest_block(self) -> dict:
+        return self.get_block(number=self.get_tip()[0])
+
+    def get_blocks(self, after_hash: str='', after_number: int=0, limit: int=0, cols: tuple=()) -> List[dict]:
+        headers = self.local.get_blocks(after_hash=after_hash, after_number=after_number, limit=limit,
+                                        cols=self._header_cols(cols))
+        return self._add_bodies(headers, cols)
+
+    def get_tip(self) -> tuple:
+        return self.local.get_tip()
+
+    def iter_raw_transactions(self, hashes: List[str], is_block_hashes=False):
+        """
+        A generator which looks up the raw transactions for a list of (pre-validated) hashes, and yields them along with
+        the hash they were found by, in the order of 'hashes'. Hashes are looked up in chunks of TX_FETCH_CHUNK_SIZE,
+        with one query per block range (on one of its shards) in each chunk.
+        :param hashes: A list of transaction hashes, or block hashes if is_block_hashes is True
+        :param is_block_hashes: If True, all transactions belonging to each block hash are yielded
+        :return: A generator of (hash, raw transaction) tuples, with each raw transaction as bytes
+        """
+        key_col = 'block_hash' if is_block_hashes else 'hash'
+
+        for i in range(0, len(hashes), TX_FETCH_CHUNK_SIZE):
+            chunk = hashes[i:i + TX_FETCH_CHUNK_SIZE]
+
+            txs_for_key = defaultdict(list)
+            for keys_in_range in self._group_by_range(self._block_numbers(chunk, is_block_hashes).items()):
+                query = "SELECT `{0}`, `data`, `dict_version` FROM transactions WHERE `{0}` IN ({1})"\
+                        .format(key_col, ', '.join(['%s'] * len(keys_in_range)))
+                for key, data, dict_version in self._read(keys_in_range[0][1], query, [k for k, _ in keys_in_range]):
+                    txs_for_key[key].append(decompress_tx(decode_tx(data), dict_version))
+
+            # Transactions stored before sharding was enabled are still in the local database
+            missing = [h for h in set(chunk) if h not in txs_for_key]
+            for h, raw_tx in self.local.iter_raw_transactions(missing, is_block_hashes=is_block_hashes):
+                txs_for_key[h].append(raw_tx)
+
+            for h in chunk:
+                for raw_tx in txs_for_key.get(h, ()):
+                    yield h, raw_tx
+
+    def get_tx_locations(self, tx_hashes: List[str]) -> dict:
+        return self.local.get_tx_locations(tx_hashes)
+
+    def delete_transactions(self, block_hashes: List[str]):
+        """
+        Deletes all transactions belonging to the given blocks, from every shard holding them (and from the local
+        database, for blocks stored before sharding was enabled)
+        """
+        for keys_in_range in self._group_by_range(self._block_numbers(block_hashes, is_block_hashes=True).items()):
+            query = "DELETE FROM transactions WHERE block_hash IN ({})".format(', '.join(['%s'] * len(keys_in_range)))
+            for shard in self.owners(keys_in_range[0][1]):
+                try:
+                    with shard.connection() as ex:
+                        execute_raw(ex, query, [k for k, _ in keys_in_range])
+                        ex.conn.commit()
+                except Exception as e:
+                    raise BlockStorageDatabaseException("Could not delete transactions from block shard {}: {}"
+                                                        .format(shard, e)) from e
+
+        self.local.delete_transactions(block_hashes)
+
+    def reset(self):
+        for shard in self.shards:
+            shard.drop()
+        self.local.reset()
+
+    def _write_bodies(self, blocks: List[tuple], first_num: int):
+        writes = defaultdict(lambda: ([], []))  # Shard -> (body rows, transaction rows)
+        for i, (block, raw_transactions, tx_hashes) in enumerate(blocks):
+            body_row = (first_num + i,) + tuple(block[col] for col in BLOCK_BODY_COLS)
+            tx_rows = []
+            for tx_hash, raw_tx in zip(tx_hashes, raw_transactions):
+                payload, dict_version = compress_tx(raw_tx)
+                tx_rows.append((tx_hash, encode_tx(payload), block['hash'], dict_version))
+
+            for shard in self.owners(first_num + i):
+                writes[shard][0].append(body_row)
+                writes[shard][1].extend(tx_rows)
+
+        for shard, (body_rows, tx_rows) in writes.items():
+            self._write(shard, body_rows, tx_rows)
+
+    def _write(self, shard: BlockShard, body_rows: List[tuple], tx_rows: List[tuple]):
+        body_query = "REPLACE INTO block_bodies (`number`, {}) VALUES ({})"\
+                     .format(', '.join('`{}`'.format(c) for c in BLOCK_BODY_COLS),
+                             ', '.join(['%s'] * (len(BLOCK_BODY_COLS) + 1)))
+        try:
+            with shard.connection() as ex:
+                execute_raw(ex, body_query, body_rows, many=True)
+                if tx_rows:
+                    execute_raw(ex, "REPLACE INTO transactions (`hash`, `data`, `block_hash`, `dict_version`) "
+                                    "VALUES (%s, %s, %s, %s)", tx_rows, many=True)
+                ex.conn.commit()
+        except Exception as e:
+            raise BlockStorageDatabaseException("Could not write {} blocks to block shard {}: {}"
+                                                .format(len(body_rows), shard, e)) from e
+
+    def _read(self, number: int, query: str, args: list) -> tuple:
+        """
+        Runs a query on the first shard holding block 'number' which answers, and returns its rows
+        :raises: A BlockStorageDatabaseException if none of the block's shards answer
+        """
+        error = None
+        for shard in self.owners(number):
+            try:
+                with shard.connection() as ex:
+                    return execute_raw(ex, query, args)
+            except Exception as e:
+                log.warning("Block shard {} failed to serve block number {} ({}). Trying the next replica."
+                            .format(shard, number, e))
+                error = e
+
+        raise BlockStorageDatabaseException("No shard holding block number {} is available".format(number)) from error
+
+    def _add_bodies(self, headers: List[dict], cols: tuple) -> List[dict]:
+        """
+        Adds the body columns in 'cols' to a list of block headers (which must include the 'number' column, if any body
+        columns are requested), and returns the blocks with exactly the columns in 'cols'
+        """
+        body_cols = [c for c in cols if c in BLOCK_BODY_COLS]
+        if not body_cols or not headers:
+            return headers
+
+        bodies = {}
+        for numbers_in_range in self._group_by_range((h['number'], h['number']) for h in headers):
+            query = "SELECT `number`, {} FROM block_bodies WHERE `number` IN ({})"\
+                    .format(', '.join('`{}`'.format(c) for c in body_cols), ', '.join(['%s'] * len(numbers_in_range)))
+            rows = self._read(numbers_in_range[0][1], query, [n for n, _ in numbers_in_range])
+            bodies.update((row[0], dict(zip(body_cols, row[1:]))) for row in rows)
+
+        blocks = []
+        for header in headers:
+            body = bodies.get(header['number'])
+            if body is None:
+                # Blocks stored before sharding was enabled (such as the genesis block) have their bodies stored locally
+                body = self.local.get_block(number=header['number'], cols=tuple(body_cols))
+                if body is None:
+                    raise BlockStorageDatabaseException("Body of block number {} is missing from its shards"
+                                                        .format(header['number']))
+            blocks.append({c: body[c] if c in BLOCK_BODY_COLS else header[c] for c in cols})
+        return blocks
+
+    def _header_cols(self, cols: tuple) -> tuple:
+        header_cols = tuple(c for c in cols if c not in BLOCK_BODY_COLS)
+        if 'number' not in header_cols and len(header_cols) < len(cols):
+            header_cols = ('number',) + header_cols
+        return header_cols
+
+    def _block_numbers(self, hashes: List[str], is_block_hashes: bool) -> dict:
+        """
+        Looks up the number of the block holding each hash (a block hash if is_block_hashes, or else a tx hash)
+        :return: A dictionary of hash -> block number, for each hash that was found
+        """
+        if not is_block_hashes:
+            return {h: location[0] for h, location in self.local.get_tx_locations(hashes).items()}
+
+        numbers = {}
+        for i in range(0, len(hashes), TX_FETCH_CHUNK_SIZE):
+            chunk = hashes[i:i + TX_FETCH_CHUNK_SIZE]
+            with DB().reader() as db:
+                rows = execute_raw(db.ex, "SELECT `hash`, `number` FROM blocks WHERE `hash` IN ({})"
+                                          .format(', '.join(['%s'] * len(chunk))), chunk)
+            numbers.update(rows)
+        return numbers
+
+    def _group_by_range(self, items) -> List[list]:
+        """
+        Groups (key, block number) pairs by the block range they fall in. Every block in a range is on the same shards
+        """
+        ranges = defaultdict(list)
+        for key, number in items:
+            ranges[(number - 1) // self.range_size].append((key, number))
+        return list(ranges.values())
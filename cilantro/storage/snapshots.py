@@ -0,0 +1,208 @@
+"""
+State snapshots, for bootstrapping a node without replaying the entire chain.
+
+A snapshot holds the smart contract state (the smart_contracts table, and every table created by contracts) as of a
+particular block, along with that block's rows from the blocks and block_bodies tables. Importing a snapshot onto a freshly reset database
+restores this state, and makes the snapshot block the latest block. The node can then catch up by fetching and
+replaying only the blocks after it (see DelegateCatchupState).
+
+Snapshot file format:
+ - SNAPSHOT_MAGIC (8 bytes, the last of which is the format version)
+ - The SHA3-256 digest of the compressed payload (32 bytes)
+ - The payload, a zlib compressed JSON document. Values JSON can not represent (bytes, datetimes, decimals) are encoded
+   as single key objects, see _encode_value
+
+The payload is not pickled, so importing a snapshot from an untrusted source can not execute code. Snapshots are only
+as trustworthy as their source, however. The checksum detects corruption, not tampering, so the block hash in a
+snapshot should be checked against the chain before it is relied on.
+"""
+
+from cilantro.logger import get_logger
+from cilantro.storage.db import DB
+from cilantro.storage.tables import execute_raw
+from cilantro.storage.blocks import BlockStorageDriver, BLOCK_BODY_COLS
+from cilantro.storage.contracts import contract_cache
+from cilantro.storage.state import state_tables, build_state_tree, save_state_tree, record_state_root
+from cilantro.constants.db import BLOCK_STORAGE_BACKEND
+from cilantro.utils import Hasher
+from decimal import Decimal
+import datetime
+import json
+import zlib
+
+log = get_logger("Snapshots")
+
+SNAPSHOT_MAGIC = b'CILSNAP\x01'
+CHECKSUM_SIZE = 32
+COMPRESSION_LEVEL = 6
+IMPORT_BATCH_SIZE = 1000  # Number of rows inserted per statement when importing a table
+
+
+class SnapshotException(Exception): pass
+class SnapshotChecksumException(SnapshotException): pass
+
+
+def export_snapshot(path: str, block_hash: str='') -> dict:
+    """
+    Writes a snapshot of the current contract state to a file. The DB lock is held throughout, so no block can be
+    stored while the snapshot is taken.
+    :param path: The path of the snapshot file to write
+    :param block_hash: If specified, the snapshot is only taken if this is the hash of the latest block. Contract state
+    is only available as of the latest block
+    :return: A dictionary with the 'block_hash' and 'block_number' the snapshot was taken at, the 'tables' included,
+    the 'state_root' of their contents, and the 'size' of the file in bytes
+    :raises: A SnapshotException if block_hash is not the latest block hash
+    """
+    with DB() as db:
+        block = _fetch_latest_block(db.ex)
+        if block_hash and block_hash != block['hash']:
+            raise SnapshotException("Can not snapshot state at block {}, as it is not the latest block {}"
+                                    .format(block_hash, block['hash']))
+
+        tables = []
+        for table_name in state_tables(db.ex):
+            ddl = execute_raw(db.ex, "SHOW CREATE TABLE `{}`".format(table_name))[0][1]
+            rows = execute_raw(db.ex, "SELECT * FROM `{}`".format(table_name))
+            cols = [d[0] for d in db.ex.cur.description]
+            tables.append({'name': table_name, 'create': ddl, 'columns': cols, 'rows': [list(r) for r in rows]})
+
+        state_root = build_state_tree(db.ex).root.hex()
+
+    payload = json.dumps({'block': block, 'tables': tables, 'state_root': state_root}, default=_encode_value,
+                         separators=(',', ':'))
+    data = zlib.compress(payload.encode(), COMPRESSION_LEVEL)
+
+    with open(path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + Hasher.hash(data, return_bytes=True) + data)
+
+    size = len(SNAPSHOT_MAGIC) + CHECKSUM_SIZE + len(data)
+    log.info("Exported snapshot of {} tables at block number {} with hash {} to {} ({} bytes)"
+             .format(len(tables), block['number'], block['hash'], path, size))
+
+    return {'block_hash': block['hash'], 'block_number': block['number'], 'tables': [t['name'] for t in tables],
+            'state_root': state_root, 'size': size}
+
+
+def read_snapshot(path: str) -> dict:
+    """
+    Reads and verifies a snapshot file.
+    :return: The snapshot payload, a dictionary with keys 'block' (the snapshot block's row, as a dictionary) and
+    'tables' (a list of dictionaries with keys 'name', 'create', 'columns', and 'rows'), and 'state_root' (see
+    storage/state.py)
+    :raises: A SnapshotException if the file is not a snapshot, or SnapshotChecksumException if it is corrupt
+    """
+    with open(path, 'rb') as f:
+        magic, checksum, data = f.read(len(SNAPSHOT_MAGIC)), f.read(CHECKSUM_SIZE), f.read()
+
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotException("File {} is not a snapshot (or uses an unsupported format version)".format(path))
+    if Hasher.hash(data, return_bytes=True) != checksum:
+        raise SnapshotChecksumException("Checksum of snapshot {} does not match its contents".format(path))
+
+    return json.loads(zlib.decompress(data).decode(), object_hook=_decode_value)
+
+
+def import_snapshot(path: str) -> str:
+    """
+    Imports a snapshot onto an empty database (ie. one which has just been reset, and holds only the genesis block).
+    Every contract table in the snapshot replaces the table of the same name, and the snapshot block is stored as the
+    latest block, keeping its original block number. Blocks before it are not stored, so the chain stored on this node
+    starts at the snapshot block (see BlockStorageDriver.get_chain_start_number), and is validated from there.
+
+    Table creation can not be done in a transaction in MySQL, so if the import fails part way, the database should be
+    reset before trying again.
+    :param path: The path of the snapshot file
+    :return: The hash of the snapshot block
+    :raises: A SnapshotException if the snapshot is invalid, the database is not empty, or the imported state does not
+    match the snapshot's state root
+    """
+    if BLOCK_STORAGE_BACKEND != 'mysql':
+        raise SnapshotException("Snapshots can only be imported with the 'mysql' block storage backend")
+
+    snapshot = read_snapshot(path)
+    block = snapshot['block']
+
+    with DB() as db:
+        latest = _fetch_latest_block(db.ex)
+        if latest['number'] != 1:
+            raise SnapshotException("Snapshots can only be imported onto an empty database, but the latest block is "
+                                    "number {}".format(latest['number']))
+
+        for table in snapshot['tables']:
+            log.debug("Importing {} rows into table {}".format(len(table['rows']), table['name']))
+            execute_raw(db.ex, "DROP TABLE IF EXISTS `{}`".format(table['name']))
+            execute_raw(db.ex, table['create'])
+            _insert_all(db.ex, table['name'], table['columns'], table['rows'])
+
+        # The state tree is built from the imported rows, so this also checks that they round tripped intact
+        tree = build_state_tree(db.ex)
+        if snapshot.get('state_root', tree.root.hex()) != tree.root.hex():
+            raise SnapshotException("Imported state has root {}, but the snapshot's state root is {}"
+                                    .format(tree.root.hex(), snapshot['state_root']))
+        save_state_tree(db.ex, tree)
+        record_state_root(db.ex, block['hash'], tree.root.hex())
+
+        header_cols = [c for c in block if c not in BLOCK_BODY_COLS]
+        _insert_all(db.ex, 'blocks', header_cols, [[block[c] for c in header_cols]])
+        _insert_all(db.ex, 'block_bodies', ['number'] + list(BLOCK_BODY_COLS),
+                    [[block['number']] + [block[c] for c in BLOCK_BODY_COLS]])
+        db.ex.conn.commit()
+
+    # Any state cached in this process predates the import
+    BlockStorageDriver.invalidate_cache()
+    contract_cache.clear()
+
+    log.info("Imported snapshot of {} tables at block number {} with hash {}"
+             .format(len(snapshot['tables']), block['number'], block['hash']))
+
+    return block['hash']
+
+
+def _fetch_latest_block(ex) -> dict:
+    body_cols = ', '.join('b.`{}`'.format(c) for c in BLOCK_BODY_COLS)
+    rows = execute_raw(ex, "SELECT h.*, {} FROM blocks h JOIN block_bodies b ON b.number = h.number "
+                           "ORDER BY h.number DESC LIMIT 1".format(body_cols))
+    assert rows, "No blocks found! There should be a genesis. Was the database properly seeded?"
+    return dict(zip([d[0] for d in ex.cur.description], rows[0]))
+
+
+def _insert_all(ex, table_name: str, cols: list, rows: list):
+    for i in range(0, len(rows), IMPORT_BATCH_SIZE):
+        execute_raw(ex, "INSERT INTO `{}` ({}) VALUES ({})".format(table_name, ', '.join('`{}`'.format(c) for c in cols),
+                                                                   ', '.join(['%s'] * len(cols))),
+                    [tuple(r) for r in rows[i:i + IMPORT_BATCH_SIZE]], many=True)
+
+
+def _encode_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': bytes(value).hex()}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': [value.year, value.month, value.day, value.hour, value.minute, value.second,
+                                 value.microsecond]}
+    if isinstance(value, datetime.date):
+        return {'__date__': [value.year, value.month, value.day]}
+    if isinstance(value, datetime.timedelta):
+        return {'__timedelta__': value.total_seconds()}
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+
+    raise TypeError("Can not encode value {} of type {} in snapshot".format(value, type(value)))
+
+
+def _decode_value(obj: dict):
+    if len(obj) != 1:
+        return obj
+
+    key, value = next(iter(obj.items()))
+    if key == '__bytes__':
+        return bytes.fromhex(value)
+    if key == '__datetime__':
+        return datetime.datetime(*value)
+    if key == '__date__':
+        return datetime.date(*value)
+    if key == '__timedelta__':
+        return datetime.timedelta(seconds=value)
+    if key == '__decimal__':
+        return Decimal(value)
+
+    return obj
@@ -0,0 +1,307 @@
+"""
+State roots, which commit to the entire smart contract state in 32 bytes.
+
+The contract state (every row of every state table, see state_tables) is authenticated by a sparse Merkle tree (see
+protocol/structures/sparse_merkle_tree.py). Each row is a leaf, keyed by the hash of its table name and primary key,
+and valued by the hash of its contents. Tables without a primary key are a single leaf, valued by the hash of all their
+rows. Two nodes hold the same state if and only if they have the same state root, so comparing state (ie. to detect a
+diverged delegate, or verify a snapshot) does not require comparing the state itself.
+
+Contracts write state through Seneca, which does not report the keys it writes. Instead, every state table gets
+INSERT, UPDATE and DELETE triggers, which record the primary key of each written row in the state_changes table. The
+triggers run in the writing transaction, so changes that are rolled back are forgotten along with the writes. When
+SenecaInterpreter commits a block, StateCommitment.commit reads back the changed keys, looks up their new rows, and
+updates the tree, in the same transaction. So maintaining the tree costs O(k log n) for k keys written, not O(n).
+
+The tree's nodes are kept in the state_nodes table, so a restarted node does not need to rebuild it, and the root after
+each block is kept in the state_roots table, keyed by block hash. Tables created by contracts get their triggers the
+next time a block is committed, at which point all of their rows are treated as changed.
+
+Triggers require MySQL 5.7.8 or later (for JSON_ARRAY). If binary logging is enabled, the MySQL user also needs the
+SUPER privilege, or the server needs log_bin_trust_function_creators set.
+"""
+
+from cilantro.logger import get_logger
+from cilantro.storage.db import DB
+from cilantro.storage.tables import execute_raw
+from cilantro.protocol.structures import SparseMerkleTree
+from cilantro.protocol.structures.sparse_merkle_tree import EMPTY_HASH
+from collections import defaultdict
+from decimal import Decimal
+from hashlib import sha3_256
+import json
+
+log = get_logger("StateRoots")
+
+# Tables holding chain data (or database metadata) rather than contract state
+CHAIN_TABLES = ('blocks', 'block_bodies', 'transactions', 'tx_index', 'tx_dictionaries', 'schema_version',
+                'state_nodes', 'state_changes', 'state_roots')
+
+TRIGGER_EVENTS = ('INSERT', 'UPDATE', 'DELETE')
+MAX_TRIGGER_NAME_LEN = 64  # MySQL's limit on identifier length
+LOOKUP_BATCH_SIZE = 500  # Number of changed keys whose rows are looked up per query
+NODE_BATCH_SIZE = 1000  # Number of tree nodes written per statement
+ROOT_PATH = '0:0'  # Path of the tree's root node in the state_nodes table
+
+
+def build_state_tables(ex):
+    execute_raw(ex, "CREATE TABLE IF NOT EXISTS state_changes (id BIGINT AUTO_INCREMENT PRIMARY KEY, "
+                    "tbl VARCHAR(64) NOT NULL, pk TEXT)")
+    execute_raw(ex, "CREATE TABLE IF NOT EXISTS state_nodes (path VARCHAR(72) PRIMARY KEY, hash CHAR(64) NOT NULL, "
+                    "leaf_key CHAR(64), value_hash CHAR(64))")
+    execute_raw(ex, "CREATE TABLE IF NOT EXISTS state_roots (block_hash CHAR(64) PRIMARY KEY, root CHAR(64) NOT NULL)")
+
+
+def state_tables(ex) -> list:
+    """
+    Returns the names of all tables holding contract state (the smart_contracts table, and every table created by
+    contracts), in alphabetical order
+    """
+    rows = execute_raw(ex, "SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+                           "AND TABLE_TYPE = 'BASE TABLE' ORDER BY TABLE_NAME")
+    return [r[0] for r in rows if r[0] not in CHAIN_TABLES]
+
+
+def get_state_root(block_hash: str) -> str or None:
+    """
+    Returns the state root (as a hex string) after the block with the specified hash, or None if it is not known. Only
+    nodes which interpret blocks (ie. delegates) record state roots
+    """
+    with DB().reader() as db:
+        rows = execute_raw(db.ex, "SELECT root FROM state_roots WHERE block_hash = %s", (block_hash,))
+    return rows[0][0] if rows else None
+
+
+def record_state_root(ex, block_hash: str, root: str):
+    execute_raw(ex, "REPLACE INTO state_roots (block_hash, root) VALUES (%s, %s)", (block_hash, root))
+
+
+def build_state_tree(ex) -> SparseMerkleTree:
+    """
+    Builds the state tree from scratch, by reading every row of every state table. This is O(n), so it is only used
+    when there is no stored tree to update, and to verify imported snapshots.
+    """
+    tree = SparseMerkleTree()
+    for table in state_tables(ex):
+        tree.update(_table_leaves(ex, table, _primary_key(ex, table)))
+    return tree
+
+
+def compute_state_root(ex) -> str:
+    return build_state_tree(ex).root.hex()
+
+
+def load_state_tree(ex) -> SparseMerkleTree:
+    nodes = {}
+    for path, node_hash, leaf_key, value_hash in execute_raw(ex, "SELECT path, hash, leaf_key, value_hash "
+                                                                 "FROM state_nodes"):
+        depth, prefix = path.split(':')
+        nodes[(int(depth), int(prefix, 16))] = (bytes.fromhex(node_hash), _from_hex(leaf_key), _from_hex(value_hash))
+    return SparseMerkleTree(nodes)
+
+
+def save_state_tree(ex, tree: SparseMerkleTree):
+    """
+    Replaces the stored state tree with this one. The caller must commit the transaction.
+    """
+    execute_raw(ex, "DELETE FROM state_nodes")
+    _save_nodes(ex, tree.nodes)
+
+
+class StateCommitment:
+    """
+    Maintains the state tree for writes made through one connection (ie. a SenecaInterpreter's), keeping it in memory
+    between blocks. The stored tree is the source of truth, so if it changes underneath (ie. a snapshot is imported, or
+    the database is reset), the in memory tree is reloaded.
+    """
+
+    def __init__(self):
+        self.tree = None
+        self.primary_keys = {}  # Table name -> tuple of its primary key columns
+
+    def commit(self, ex, block_hash: str='') -> str:
+        """
+        Folds every state change recorded since the last commit into the state tree, writing the changed tree nodes
+        (and the new state root for block_hash, if specified) in ex's current transaction. The caller must then commit
+        the transaction.
+        :param ex: The Executer whose writes are being committed
+        :param block_hash: The hash of the block these writes belong to
+        :return: The new state root, as a hex string
+        """
+        tables = state_tables(ex)
+        self._load(ex)
+        self._install_triggers(ex, tables)
+
+        rows = execute_raw(ex, "SELECT id, tbl, pk FROM state_changes")
+        touched = defaultdict(set)
+        for _, table, pk in rows:
+            touched[table].add(pk)
+
+        if any(table not in tables for table in touched):
+            log.warning("A state table was dropped. Rebuilding the state tree from scratch.")
+            self.primary_keys.clear()
+            self.tree = build_state_tree(ex)
+            save_state_tree(ex, self.tree)
+        else:
+            changes = {}
+            for table, pks in touched.items():
+                changes.update(self._changed_leaves(ex, table, pks))
+            _save_nodes(ex, self.tree.update(changes))
+
+        if rows:
+            execute_raw(ex, "DELETE FROM state_changes WHERE id <= %s", (max(r[0] for r in rows),))
+
+        root = self.tree.root.hex()
+        if block_hash:
+            record_state_root(ex, block_hash, root)
+
+        log.debug("Folded {} state changes into the state tree. New state root {}".format(len(rows), root))
+        return root
+
+    def _load(self, ex):
+        rows = execute_raw(ex, "SELECT hash FROM state_nodes WHERE path = %s", (ROOT_PATH,))
+        stored_root = bytes.fromhex(rows[0][0]) if rows else EMPTY_HASH
+        if self.tree is not None and self.tree.root == stored_root:
+            return
+
+        self.primary_keys.clear()
+        if rows:
+            log.debug("Loading state tree with root {}".format(stored_root.hex()))
+            self.tree = load_state_tree(ex)
+        else:
+            log.info("No state tree stored. Building it from scratch.")
+            self.tree = build_state_tree(ex)
+            save_state_tree(ex, self.tree)
+
+    def _install_triggers(self, ex, tables: list):
+        rows = execute_raw(ex, "SELECT EVENT_OBJECT_TABLE FROM information_schema.TRIGGERS "
+                               "WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME LIKE 'state\\_%' "
+                               "GROUP BY EVENT_OBJECT_TABLE HAVING COUNT(*) = {}".format(len(TRIGGER_EVENTS)))
+        covered = {r[0] for r in rows}
+
+        for table in tables:
+            if table in covered:
+                continue
+
+            log.debug("Installing state triggers on table {}".format(table))
+            pk_cols = self._primary_key(ex, table)
+            # Note that MySQL implicitly commits the current transaction before creating a trigger. This is safe, as
+            # state changes are only deleted in the same transaction as the tree update that consumes them
+            for event in TRIGGER_EVENTS:
+                refs = ('OLD', 'NEW') if event == 'UPDATE' else ('OLD',) if event == 'DELETE' else ('NEW',)
+                values = ', '.join("('{}', {})".format(table, _pk_json(pk_cols, ref)) for ref in refs)
+                name = _trigger_name(table, event)
+                execute_raw(ex, "DROP TRIGGER IF EXISTS `{}`".format(name))
+                execute_raw(ex, "CREATE TRIGGER `{}` AFTER {} ON `{}` FOR EACH ROW INSERT INTO state_changes "
+                                "(tbl, pk) VALUES {}".format(name, event, table, values))
+
+            # Rows written before the triggers existed are not in the tree yet
+            execute_raw(ex, "INSERT INTO state_changes (tbl, pk) SELECT %s, {} FROM `{}` t"
+                            .format(_pk_json(pk_cols, 't'), table), (table,))
+
+    def _changed_leaves(self, ex, table: str, pks: set) -> dict:
+        pk_cols = self._primary_key(ex, table)
+        if not pk_cols:
+            return _table_leaves(ex, table, pk_cols)
+
+        # Keys whose rows are not found have been deleted
+        pks = {_canonical_pk(pk): pk for pk in pks if pk is not None}
+        leaves = {_leaf_key(table, pk): None for pk in pks}
+
+        raw_pks = list(pks.values())
+        for i in range(0, len(raw_pks), LOOKUP_BATCH_SIZE):
+            batch = [json.loads(pk, parse_float=Decimal) for pk in raw_pks[i:i + LOOKUP_BATCH_SIZE]]
+            if len(pk_cols) == 1:
+                where = "WHERE `{}` IN ({})".format(pk_cols[0], ', '.join(['%s'] * len(batch)))
+            else:
+                row = '({})'.format(', '.join(['%s'] * len(pk_cols)))
+                where = "WHERE ({}) IN ({})".format(', '.join('`{}`'.format(c) for c in pk_cols),
+                                                    ', '.join([row] * len(batch)))
+            leaves.update(_table_leaves(ex, table, pk_cols, where, [v for pk in batch for v in pk]))
+
+        return leaves
+
+    def _primary_key(self, ex, table: str) -> tuple:
+        if table not in self.primary_keys:
+            self.primary_keys[table] = _primary_key(ex, table)
+        return self.primary_keys[table]
+
+
+def _primary_key(ex, table: str) -> tuple:
+    rows = execute_raw(ex, "SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = DATABASE() "
+                           "AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY' ORDER BY ORDINAL_POSITION", (table,))
+    return tuple(r[0] for r in rows)
+
+
+def _table_leaves(ex, table: str, pk_cols: tuple, where: str='', args=None) -> dict:
+    """
+    Returns the tree leaves (leaf key -> value hash) for a table's rows. If the table has no primary key, the whole
+    table is a single leaf, which is None if the table is empty.
+    """
+    if not pk_cols:
+        rows = execute_raw(ex, "SELECT * FROM `{}`".format(table))
+        cols = [d[0] for d in ex.cur.description]
+        encoded = sorted(_encode_row(row) for row in rows)
+        return {_leaf_key(table, None): _value_hash(table, cols, encoded) if rows else None}
+
+    rows = execute_raw(ex, "SELECT {}, t.* FROM `{}` t {}".format(_pk_json(pk_cols, 't'), table, where), args)
+    cols = [d[0] for d in ex.cur.description[1:]]
+    return {_leaf_key(table, _canonical_pk(row[0])): _value_hash(table, cols, _encode_row(row[1:])) for row in rows}
+
+
+def _save_nodes(ex, nodes: dict):
+    deleted = [_node_path(pos) for pos, node in nodes.items() if node is None]
+    written = [(_node_path(pos), node[0].hex(), _to_hex(node[1]), _to_hex(node[2]))
+               for pos, node in nodes.items() if node is not None]
+
+    for i in range(0, len(deleted), NODE_BATCH_SIZE):
+        batch = deleted[i:i + NODE_BATCH_SIZE]
+        execute_raw(ex, "DELETE FROM state_nodes WHERE path IN ({})".format(', '.join(['%s'] * len(batch))), batch)
+    for i in range(0, len(written), NODE_BATCH_SIZE):
+        execute_raw(ex, "REPLACE INTO state_nodes (path, hash, leaf_key, value_hash) VALUES (%s, %s, %s, %s)",
+                    written[i:i + NODE_BATCH_SIZE], many=True)
+
+
+def _pk_json(pk_cols: tuple, row: str) -> str:
+    """
+    Returns the SQL expression for a row's primary key, as a JSON array. row is the alias (or NEW/OLD) of the row
+    """
+    if not pk_cols:
+        return 'NULL'
+    return 'JSON_ARRAY({})'.format(', '.join('{}.`{}`'.format(row, c) for c in pk_cols))
+
+
+def _canonical_pk(pk: str) -> str:
+    return json.dumps(json.loads(pk, parse_float=Decimal), default=str, separators=(',', ':'))
+
+
+def _leaf_key(table: str, pk: str or None) -> bytes:
+    return sha3_256(table.encode() + b'\x00' + (pk or '').encode()).digest()
+
+
+def _value_hash(table: str, cols: list, values) -> bytes:
+    return sha3_256(json.dumps([table, cols, values], separators=(',', ':')).encode()).digest()
+
+
+def _encode_row(row) -> str:
+    return json.dumps([v.hex() if isinstance(v, (bytes, bytearray)) else v if isinstance(v, (int, float, str))
+                       or v is None else str(v) for v in row], separators=(',', ':'))
+
+
+def _trigger_name(table: str, event: str) -> str:
+    name = 'state_{}_{}'.format(event[0].lower(), table)
+    if len(name) > MAX_TRIGGER_NAME_LEN:
+        name = 'state_{}_{}'.format(event[0].lower(), sha3_256(table.encode()).hexdigest()[:32])
+    return name
+
+
+def _node_path(pos: tuple) -> str:
+    return '{}:{:x}'.format(*pos)
+
+
+def _to_hex(value: bytes or None) -> str or None:
+    return value.hex() if value is not None else None
+
+
+def _from_hex(value: str or None) -> bytes or None:
+    return bytes.fromhex(value) if value is not None else None
@@ -1,7 +1,8 @@
 from cilantro.logger import get_logger
-import json, os, uuid
+from cilantro.storage.metrics import storage_metrics, is_write_query
+import json, os, time, uuid
 from seneca.engine.storage.mysql_executer import Executer
-from cilantro.constants.db import DB_SETTINGS
+from cilantro.constants.db import DB_SETTINGS, BINARY_STORAGE
 
 
 
@@ -10,13 +11,29 @@ log = get_logger("DB Creator")
 DB_NAME = DB_SETTINGS['db']
 NUM_SNIPES = 8  # Number of times to attempt to kill a single sleeping DB cursor when resetting db
 
+# Bump this whenever a table definition (or index, or seed data) changes. Existing databases stamped with an older
+# version are brought up to date the next time a node boots, and databases stamped with the current version are used
+# as is, without touching the schema (see build_tables)
+SCHEMA_VERSION = 4
+
+# Columns which hold binary payloads. These are LONGBLOBs in binary storage mode, and hex encoded TEXT otherwise
+BINARY_COLUMNS = (('transactions', 'data'), ('block_bodies', 'block_contender'), ('tx_dictionaries', 'data'))
+
 constitution_json = json.load(open(os.path.join(os.path.dirname(__file__), 'constitution.json')))
 
 
 def build_tables(ex, should_drop=True):
+    """
+    Builds (and if necessary, seeds) all tables, and returns a Tables object with an attribute for each table. If
+    should_drop is True, the database is dropped and rebuilt from scratch. Otherwise, the build is idempotent: if the
+    database is stamped with the current SCHEMA_VERSION (and storage settings), nothing is built at all, and if not,
+    missing tables and indexes are created, and the database is seeded if it is empty, before it is stamped.
+    """
     from cilantro.storage.contracts import build_contracts_table, seed_contracts
-    from cilantro.storage.blocks import build_blocks_table, seed_blocks
-    from cilantro.storage.transactions import build_transactions_table, seed_transactions
+    from cilantro.storage.blocks import build_blocks_table, build_block_bodies_table, seed_blocks
+    from cilantro.storage.transactions import build_transactions_table, build_tx_index_table, \
+        build_tx_dictionaries_table, seed_transactions
+    from cilantro.storage.state import build_state_tables
 
     log.debug("Building tables with should_drop={}".format(should_drop))
 
@@ -27,22 +44,69 @@ def build_tables(ex, should_drop=True):
         ex.raw('CREATE DATABASE IF NOT EXISTS {};'.format(DB_NAME))
         ex.raw('USE {};'.format(DB_NAME))
 
+        if _schema_is_current(ex):
+            log.info("Database {} is at schema version {}. Skipping table build.".format(DB_NAME, SCHEMA_VERSION))
+            return _define_tables()
+
     log.debug("Creating DB tables")
     contracts = build_contracts_table(ex, should_drop)
     blocks = build_blocks_table(ex, should_drop)
+    block_bodies = build_block_bodies_table(ex, should_drop)
     transactions = build_transactions_table(ex, should_drop)
+    tx_index = build_tx_index_table(ex, should_drop)
+    tx_dictionaries = build_tx_dictionaries_table(ex, should_drop)
+    build_state_tables(ex)
 
     # Only seed database if we just dropped it, or if storage is empty
     if should_drop or not blocks.select().run(ex):
         log.info("Seeding database...")
         seed_contracts(ex, contracts)
-        seed_blocks(ex, blocks)
+        seed_blocks(ex, blocks, block_bodies)
         seed_transactions(ex, blocks)
         log.info("Done seeding database.")
 
-    tables = type('Tables', (object,), {'contracts': contracts, 'blocks': blocks, 'transactions': transactions})
+    _stamp_schema_version(ex)
+
+    return _tables_type(contracts, blocks, block_bodies, transactions, tx_index, tx_dictionaries)
+
+
+def _tables_type(contracts, blocks, block_bodies, transactions, tx_index, tx_dictionaries):
+    return type('Tables', (object,), {'contracts': contracts, 'blocks': blocks, 'block_bodies': block_bodies,
+                                      'transactions': transactions, 'tx_index': tx_index,
+                                      'tx_dictionaries': tx_dictionaries})
+
+
+def _define_tables():
+    """
+    Returns a Tables object for a database whose tables are already built, without running any queries
+    """
+    from cilantro.storage.contracts import contracts_table
+    from cilantro.storage.blocks import blocks_table, block_bodies_table
+    from cilantro.storage.transactions import transactions_table, tx_index_table, tx_dictionaries_table
+
+    return _tables_type(contracts_table(), blocks_table(), block_bodies_table(), transactions_table(),
+                        tx_index_table(), tx_dictionaries_table())
+
+
+def _schema_is_current(ex) -> bool:
+    """
+    Returns True if the current database has been built with this SCHEMA_VERSION and binary storage setting
+    """
+    if not execute_raw(ex, "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+                           "AND TABLE_NAME = 'schema_version'"):
+        return False
+
+    rows = execute_raw(ex, "SELECT version, binary_storage FROM schema_version WHERE id = 1")
+    return bool(rows) and tuple(rows[0]) == (SCHEMA_VERSION, int(BINARY_STORAGE))
 
-    return tables
+
+def _stamp_schema_version(ex):
+    execute_raw(ex, "CREATE TABLE IF NOT EXISTS schema_version (id TINYINT PRIMARY KEY, version INT NOT NULL, "
+                    "binary_storage TINYINT NOT NULL)")
+    execute_raw(ex, "REPLACE INTO schema_version (id, version, binary_storage) VALUES (1, %s, %s)",
+                (SCHEMA_VERSION, int(BINARY_STORAGE)))
+    ex.conn.commit()
+    log.debug("Stamped database {} with schema version {}".format(DB_NAME, SCHEMA_VERSION))
 
 
 def create_table(ex, table, should_drop):
@@ -60,6 +124,120 @@ def create_table(ex, table, should_drop):
     return table
 
 
+def execute_raw(ex, query: str, args=None, many=False) -> tuple:
+    """
+    Executes a parameterized SQL query directly on the executer's cursor, and returns all fetched rows as tuples. This
+    is used for queries EasyDB cannot build yet, such as those involving binary values.
+    :param ex: The Executer to run the query with
+    :param query: The SQL query, using %s placeholders for each argument
+    :param args: A sequence of arguments for the placeholders, or if many=True, a sequence of such sequences
+    :param many: If True, the query is executed once for each set of arguments in args
+    :return: A tuple of the fetched rows (empty for queries which do not return rows)
+    """
+    start = time.time()
+    if many:
+        ex.cur.executemany(query, args)
+    else:
+        ex.cur.execute(query, args)
+
+    rows = ex.cur.fetchall()
+    storage_metrics.record_query(query, time.time() - start, rows_read=len(rows),
+                                 rows_written=max(ex.cur.rowcount, 0) if is_write_query(query) else 0)
+    return rows
+
+
+def insert_rows(ex, table_name: str, rows: list, commit=True) -> dict:
+    """
+    Inserts a list of row dictionaries into a table with executemany, which the driver rewrites into multi-row INSERT
+    statements (splitting them when they would exceed max_stmt_length). All rows must have the same keys. Unlike
+    inserts through EasyDB, the values may be bytes.
+    :param commit: If False, the insert is left uncommitted, so the caller can group several inserts into one
+    transaction. The caller is then responsible for calling ex.conn.commit() (or rollback())
+    :return: A dictionary with keys 'last_row_id' and 'row_count', mirroring the result of an EasyDB insert.
+    'last_row_id' is the cursor's lastrowid after the final statement, so it says nothing reliable about the ids of
+    the other rows. Callers which need to know the keys of the inserted rows should set them explicitly
+    """
+    assert rows, "Expected at least one row to insert into table {}".format(table_name)
+
+    cols = list(rows[0].keys())
+    query = "INSERT INTO {} ({}) VALUES ({})".format(table_name, ', '.join('`{}`'.format(c) for c in cols),
+                                                      ', '.join(['%s'] * len(cols)))
+    execute_raw(ex, query, [tuple(row[c] for c in cols) for row in rows], many=True)
+    if commit:
+        ex.conn.commit()
+
+    return {'last_row_id': ex.cur.lastrowid, 'row_count': ex.cur.rowcount}
+
+
+def column_type(ex, table_name: str, col_name: str) -> str or None:
+    """
+    Returns the MySQL data type (ie 'text', 'longblob') of a column in the current database, or None if the column
+    does not exist
+    """
+    rows = execute_raw(ex, "SELECT DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                           "AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table_name, col_name))
+    return rows[0][0].lower() if rows else None
+
+
+def ensure_column(ex, table_name: str, col_name: str, definition: str):
+    """
+    Adds a column to an existing table, unless it already has it. 'definition' is the column's MySQL type and options,
+    ie. 'INT NOT NULL DEFAULT 0'. This is safe to call every time the table is built.
+    """
+    if column_type(ex, table_name, col_name) is not None:
+        return
+
+    log.debug("Adding column {} to table {}".format(col_name, table_name))
+    ex.raw('ALTER TABLE {} ADD COLUMN `{}` {};'.format(table_name, col_name, definition))
+
+
+def ensure_index(ex, table_name: str, cols: tuple, unique=False):
+    """
+    Creates an index over the specified columns, unless the table already has an index whose leading column is cols[0].
+    This is safe to call every time the table is built.
+    """
+    rows = execute_raw(ex, "SELECT 1 FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() "
+                           "AND TABLE_NAME = %s AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1", (table_name, cols[0]))
+    if rows:
+        return
+
+    index_name = 'ix_{}_{}'.format(table_name, '_'.join(cols))
+    log.debug("Creating index {} on table {}".format(index_name, table_name))
+    ex.raw('CREATE {}INDEX {} ON {} ({});'.format('UNIQUE ' if unique else '', index_name, table_name,
+                                                  ', '.join('`{}`'.format(c) for c in cols)))
+
+
+def use_binary_column(ex, table_name: str, col_name: str):
+    """
+    Changes the type of a freshly created column to LONGBLOB. This is a no-op if the column is already binary, so it
+    is safe to call every time the table is built.
+    """
+    if column_type(ex, table_name, col_name) != 'longblob':
+        ex.raw('ALTER TABLE {} MODIFY `{}` LONGBLOB;'.format(table_name, col_name))
+
+
+def convert_binary_columns(ex, to_binary=True):
+    """
+    Rewrites the payload columns listed in BINARY_COLUMNS in place, from hex encoded text to binary blobs (or back if
+    to_binary is False). Columns already in the desired format are skipped. This should only be run while no node is
+    using the database.
+    """
+    for table_name, col_name in BINARY_COLUMNS:
+        is_binary = column_type(ex, table_name, col_name) == 'longblob'
+        if is_binary == to_binary:
+            log.info("Column {}.{} is already {}. Skipping.".format(table_name, col_name, 'binary' if is_binary else 'hex'))
+            continue
+
+        log.notice("Converting column {}.{} to {}...".format(table_name, col_name, 'binary' if to_binary else 'hex'))
+        if to_binary:
+            ex.raw('ALTER TABLE {} MODIFY `{}` LONGBLOB;'.format(table_name, col_name))
+            ex.raw('UPDATE {0} SET `{1}` = UNHEX(`{1}`);'.format(table_name, col_name))
+        else:
+            ex.raw('UPDATE {0} SET `{1}` = LOWER(HEX(`{1}`));'.format(table_name, col_name))
+            ex.raw('ALTER TABLE {} MODIFY `{}` LONGTEXT;'.format(table_name, col_name))
+        ex.conn.commit()
+
+
 def _assassinate_sleeping_db_cursors(ex):
     """
     Find sleeping DB cursors.
@@ -75,8 +253,18 @@ def _assassinate_sleeping_db_cursors(ex):
 
 
 def _reset_db(ex):
+    from cilantro.storage.blocks import BlockStorageDriver
+    from cilantro.storage.contracts import contract_cache
+    from cilantro.storage.transactions import tx_dictionaries
+
     log.info("Dropping database named {}".format(DB_NAME))
 
+    # Blocks kept outside of MySQL (and any chain state or contract code cached in this process) belong to the database we
+    # are about to drop
+    BlockStorageDriver.reset_backend()
+    contract_cache.clear()
+    tx_dictionaries.clear()
+
     _assassinate_sleeping_db_cursors(ex)
 
     ex.raw('DROP DATABASE IF EXISTS {};'.format(DB_NAME))
@@ -1,6 +1,17 @@
 from cilantro.logger import get_logger
 import seneca.engine.storage.easy_db as t
-from cilantro.storage.tables import create_table
+from cilantro.storage.tables import create_table, use_binary_column, ensure_index, ensure_column, execute_raw, \
+    insert_rows
+from cilantro.storage.templating import templates
+from cilantro.constants.db import BINARY_STORAGE, TX_COMPRESSION, BLOCK_STORAGE_BACKEND
+import threading
+import zlib
+import re
+
+log = get_logger("TxStorage")
+
+TX_COMPRESSION_LEVEL = 9
+TEMPLATE_PLACEHOLDER = re.compile(r'\{__\w+__\}')
 
 
 """
@@ -8,14 +19,109 @@ Methods to create and seed the transactions table
 """
 
 
+def transactions_table():
+    return t.Table('transactions',
+                   t.Column('hash', t.str_len(64), True),
+                   [
+                       t.Column('data', str),
+                       t.Column('block_hash', t.str_len(64)),
+                       t.Column('dict_version', int),
+                   ])
+
+
 def build_transactions_table(ex, should_drop=True):
-    transactions = t.Table('transactions',
-                           t.Column('hash', t.str_len(64), True),
-                           [
-                               t.Column('data', str),
-                               t.Column('block_hash', t.str_len(64)),  # TODO how to index this column?
-                           ])
-    return create_table(ex, transactions, should_drop)
+    transactions = create_table(ex, transactions_table(), should_drop)
+    ensure_index(ex, 'transactions', ('block_hash',))
+    ensure_column(ex, 'transactions', 'dict_version', 'INT NOT NULL DEFAULT 0')
+
+    if BINARY_STORAGE:
+        use_binary_column(ex, 'transactions', 'data')
+
+    return transactions
+
+
+def tx_index_table():
+    """
+    The tx_index table maps the hash of each stored transaction to the number and hash of its block, and its position
+    in the block (ie. its index in the block's Merkle leaves). Rows are written along with their block (see
+    MySQLBlockBackend.insert_blocks), and are kept when transactions are archived.
+    """
+    return t.Table('tx_index',
+                   t.Column('hash', t.str_len(64), True),
+                   [
+                       t.Column('block_number', int),
+                       t.Column('block_hash', t.str_len(64)),
+                       t.Column('position', int),
+                   ])
+
+
+def build_tx_index_table(ex, should_drop=True):
+    return create_table(ex, tx_index_table(), should_drop)
+
+
+def tx_dictionaries_table():
+    """
+    The tx_dictionaries table holds every compression dictionary that stored transactions were compressed with, keyed by
+    the version in their dict_version column (see compress_tx)
+    """
+    return t.Table('tx_dictionaries',
+                   t.Column('version', int, True),
+                   [
+                       t.Column('data', str),
+                   ])
+
+
+def build_tx_dictionaries_table(ex, should_drop=True):
+    tx_dictionaries = create_table(ex, tx_dictionaries_table(), should_drop)
+
+    if BINARY_STORAGE:
+        use_binary_column(ex, 'tx_dictionaries', 'data')
+
+    return tx_dictionaries
+
+
+def rebuild_tx_index(ex):
+    """
+    Rebuilds the tx_index table, for chains stored before the index existed.
+
+    With the 'mysql' backend, the index is rebuilt from the transactions, blocks, and block_bodies tables. A
+    transaction's position is found by locating its hash in its block's concatenated Merkle leaves (which are kept in
+    block_bodies). Transactions that have already been moved to the transaction archive are not indexed.
+
+    With the 'sharded' backend, block bodies and transactions are kept on the shards, so the Merkle leaves are read
+    through the backend, and every transaction hash in them is indexed, just as when the blocks were inserted. The
+    'segments' backend keeps its own index, so there is nothing to rebuild.
+    """
+    from cilantro.storage.blocks import BlockStorageDriver, BLOCK_PAGE_SIZE
+
+    if BLOCK_STORAGE_BACKEND == 'segments':
+        log.info("Not rebuilding tx_index, as the segment store indexes transactions itself")
+        return
+
+    ex.raw('DELETE FROM tx_index;')
+
+    if BLOCK_STORAGE_BACKEND == 'mysql':
+        ex.raw('INSERT INTO tx_index (`hash`, `block_number`, `block_hash`, `position`) '
+               'SELECT t.`hash`, b.`number`, b.`hash`, (LOCATE(t.`hash`, bb.`merkle_leaves`) - 1) DIV 64 '
+               'FROM transactions t JOIN blocks b ON b.`hash` = t.`block_hash` '
+               'JOIN block_bodies bb ON bb.`number` = b.`number`;')
+        ex.conn.commit()
+        return
+
+    backend, last_num = BlockStorageDriver._get_backend(), 0
+    while True:
+        blocks = backend.get_blocks(after_number=last_num, limit=BLOCK_PAGE_SIZE,
+                                    cols=('number', 'hash', 'merkle_leaves'))
+        if not blocks:
+            break
+
+        rows = [{'hash': block['merkle_leaves'][i:i + 64], 'block_number': block['number'], 'block_hash': block['hash'],
+                 'position': i // 64} for block in blocks for i in range(0, len(block['merkle_leaves']), 64)]
+        if rows:
+            insert_rows(ex, 'tx_index', rows, commit=False)
+        last_num = blocks[-1]['number']
+
+    ex.conn.commit()
 
 
 def seed_transactions(ex, transactions_table):
@@ -26,14 +132,144 @@ def seed_transactions(ex, transactions_table):
 """
 Utility Functions to encode/decode block data for serialization 
 
-TODO -- a lot of this encoding can be completely omitted or at least improved once we get blob types in EasyDB
+In binary storage mode (see BINARY_STORAGE in constants/db.py) raw transactions are stored as is in a blob column.
+Otherwise they are hex encoded into a text column.
 """
 
 
-def encode_tx(raw_transaction: bytes) -> str:
+def encode_tx(raw_transaction: bytes) -> str or bytes:
+    if BINARY_STORAGE:
+        return raw_transaction
+
     hex_str = raw_transaction.hex()
     return hex_str
 
 
-def decode_tx(encoded_tx: str) -> bytes:
+def decode_tx(encoded_tx: str or bytes) -> bytes:
+    if BINARY_STORAGE:
+        return bytes(encoded_tx)
+
     return bytes.fromhex(encoded_tx)
+
+
+"""
+Dictionary compression of raw transactions
+
+Most transactions run code generated from the templates in contracts/templates, so their payloads are nearly identical.
+If TX_COMPRESSION is set, each raw transaction is deflated with a preset dictionary built from the templates (see
+build_tx_dictionary) before it is stored, and only kept compressed if that makes it smaller. The dictionary is stored in
+the tx_dictionaries table, and each transaction row records the version of the dictionary it was compressed with in
+its dict_version column (0 if it is not compressed). Dictionaries are never modified or deleted, so if the templates
+change, the new dictionary is stored under a new version, and transactions compressed with older ones stay readable.
+"""
+
+
+class TxDictionaryException(Exception): pass
+
+
+def build_tx_dictionary() -> bytes:
+    """
+    Builds the compression dictionary from the contract templates. Placeholders are cut out, leaving the code around
+    them, which is what transactions built from a template have in common. Deflate encodes matches near the end of the
+    dictionary most cheaply, so the currency template, which most transactions use, goes last.
+    """
+    names = sorted(templates, key=lambda name: (name == 'currency', name))
+    return '\n'.join(TEMPLATE_PLACEHOLDER.sub('', templates[name]) for name in names).encode()
+
+
+class TxDictionaryCache:
+    """
+    A process-wide cache of the compression dictionaries in the tx_dictionaries table, by version. It must be cleared
+    whenever the database is reset, as versions are only unique within a database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._dicts = {}  # Version -> dictionary
+        self._current = None  # Version of the dictionary built from the current templates, once it has been stored
+
+    def current(self) -> tuple:
+        """
+        Returns a tuple of (version, dictionary) for the dictionary built from the current templates. The first time
+        this is called, the dictionary is looked up in the tx_dictionaries table, and stored under a new version if it
+        is not there yet.
+        """
+        from cilantro.storage.db import DB
+
+        with self.lock:
+            if self._current:
+                return self._current, self._dicts[self._current]
+
+        zdict = build_tx_dictionary()
+        with DB() as db:
+            rows = execute_raw(db.ex, "SELECT `version`, `data` FROM tx_dictionaries")
+            versions = {decode_tx(data): version for version, data in rows}
+
+            version = versions.get(zdict)
+            if version is None:
+                version = max(versions.values(), default=0) + 1
+                log.info("Storing new tx compression dictionary with version {}".format(version))
+                insert_rows(db.ex, 'tx_dictionaries', [{'version': version, 'data': encode_tx(zdict)}])
+
+        with self.lock:
+            self._dicts[version] = zdict
+            self._current = version
+            return version, zdict
+
+    def get(self, version: int) -> bytes:
+        """
+        Returns the dictionary with the given version
+        :raises: A TxDictionaryException if there is no such dictionary
+        """
+        from cilantro.storage.db import DB
+
+        with self.lock:
+            zdict = self._dicts.get(version)
+        if zdict is not None:
+            return zdict
+
+        with DB().reader() as db:
+            rows = execute_raw(db.ex, "SELECT `data` FROM tx_dictionaries WHERE `version` = %s", (version,))
+        if not rows:
+            raise TxDictionaryException("No tx compression dictionary with version {} found".format(version))
+
+        with self.lock:
+            zdict = self._dicts[version] = decode_tx(rows[0][0])
+            return zdict
+
+    def clear(self):
+        with self.lock:
+            self._dicts.clear()
+            self._current = None
+
+
+tx_dictionaries = TxDictionaryCache()
+
+
+def compress_tx(raw_transaction: bytes) -> tuple:
+    """
+    Compresses a raw transaction with the current dictionary, if TX_COMPRESSION is set
+    :return: A tuple of (payload, dictionary version). The version is 0 if the payload is the raw transaction as is
+    """
+    if not TX_COMPRESSION:
+        return raw_transaction, 0
+
+    version, zdict = tx_dictionaries.current()
+    compressor = zlib.compressobj(TX_COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    payload = compressor.compress(raw_transaction) + compressor.flush()
+
+    if len(payload) >= len(raw_transaction):
+        return raw_transaction, 0
+
+    return payload, version
+
+
+def decompress_tx(payload: bytes, dict_version: int) -> bytes:
+    """
+    Reverses compress_tx. Rows stored before transactions were compressed have a dict_version of 0 (or NULL)
+    """
+    if not dict_version:
+        return payload
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=tx_dictionaries.get(dict_version))
+    return decompressor.decompress(payload) + decompressor.flush()
@@ -0,0 +1,110 @@
+"""
+A persistent Bloom filter over the hashes of all committed transactions, for rejecting replayed or duplicate
+transactions without a database query.
+
+The filter is built from the Merkle leaves (ie. the transaction hashes) of every stored block, so it covers blocks
+stored by either storage backend, whether or not their raw transactions were stored along with them (or have since been
+archived). It records the number and hash of the last block it covers, and BlockStorageDriver catches it up to the
+latest block before it is consulted (see BlockStorageDriver.get_committed_transactions).
+
+A TransactionFilter is saved to TX_FILTER_PATH every TX_FILTER_SAVE_INTERVAL blocks, and when the process exits, so a
+restarted node only has to catch up on the blocks stored since. If the saved filter is missing, corrupt, or covers a
+block that is no longer in the chain (for example after the database was reset), it is rebuilt from scratch by scanning
+the Merkle leaves of every block.
+
+File format:
+ - TX_FILTER_MAGIC (8 bytes, the last of which is the format version)
+ - The number (8 bytes) and hash (32 bytes) of the last block covered by the filter
+ - The CRC32 of the serialized Bloom filter (4 bytes)
+ - The serialized Bloom filter (see BloomFilter.to_bytes)
+"""
+
+from cilantro.logger import get_logger
+from cilantro.protocol.structures import BloomFilter
+from typing import List
+import struct
+import zlib
+import os
+
+log = get_logger("TxFilter")
+
+TX_FILTER_MAGIC = b'CILTXBF\x01'
+TX_FILTER_HEADER = struct.Struct('<Q32sI')  # last block number, last block hash, crc32 of the bloom filter
+
+
+class TransactionFilter:
+
+    def __init__(self, capacity: int, error_rate: float, bloom: BloomFilter=None, block_number: int=0,
+                 block_hash: str='0' * 64):
+        self.bloom = bloom if bloom is not None else BloomFilter(capacity, error_rate)
+        self.block_number, self.block_hash = block_number, block_hash
+        self.unsaved_blocks = 0  # Number of blocks added since the filter was last saved (or loaded)
+
+    def add_block(self, number: int, block_hash: str, tx_hashes: List[str]):
+        """
+        Adds the transaction hashes of a block to the filter. Blocks must be added in ascending order. There may be gaps
+        in the block numbers, as a chain bootstrapped from a snapshot has no blocks before the snapshot block.
+        """
+        assert number > self.block_number, "Block number {} added to the tx filter out of order (last added block is " \
+                                           "{})".format(number, self.block_number)
+        self.bloom.update(tx_hashes)
+        self.block_number, self.block_hash = number, block_hash
+        self.unsaved_blocks += 1
+
+    def might_contain(self, tx_hash: str) -> bool:
+        """
+        Returns False if no transaction with this hash is in any block covered by the filter. Returns True if it
+        probably is (see BloomFilter)
+        """
+        return tx_hash in self.bloom
+
+    def save(self, path: str):
+        """
+        Writes the filter to a file. The file is replaced atomically, so a crash while saving leaves the last saved
+        filter intact.
+        """
+        bloom = self.bloom.to_bytes()
+        tmp_path = '{}.tmp.{}'.format(path, os.getpid())
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(TX_FILTER_MAGIC + TX_FILTER_HEADER.pack(self.block_number, bytes.fromhex(self.block_hash),
+                                                            zlib.crc32(bloom)) + bloom)
+        os.replace(tmp_path, path)
+
+        self.unsaved_blocks = 0
+        log.debug("Saved tx filter covering {} transactions up to block number {} to {}"
+                  .format(len(self.bloom), self.block_number, path))
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Reads a filter saved with save()
+        :return: A TransactionFilter, or None if there is no valid filter at 'path'
+        """
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        header_end = len(TX_FILTER_MAGIC) + TX_FILTER_HEADER.size
+        if len(data) < header_end or not data.startswith(TX_FILTER_MAGIC):
+            log.warning("Ignoring tx filter at {}, as it is not a tx filter (or uses an unsupported format version)"
+                        .format(path))
+            return None
+
+        number, block_hash, crc = TX_FILTER_HEADER.unpack_from(data, len(TX_FILTER_MAGIC))
+        bloom = data[header_end:]
+        if zlib.crc32(bloom) != crc:
+            log.warning("Ignoring tx filter at {}, as its checksum does not match its contents".format(path))
+            return None
+
+        bloom = BloomFilter.from_bytes(bloom)
+        return cls(bloom.capacity, bloom.error_rate, bloom=bloom, block_number=number, block_hash=block_hash.hex())
+
+    @staticmethod
+    def destroy(path: str):
+        if os.path.exists(path):
+            log.info("Deleting tx filter at {}".format(path))
+            os.remove(path)
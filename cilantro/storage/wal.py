@@ -0,0 +1,389 @@
+"""
+A write-ahead log for blocks, which decouples storing a block from committing it to the storage backend. This is used
+by BlockStorageDriver if BLOCK_WAL is set (see constants/db.py).
+
+WALBlockBackend wraps another backend. Inserted blocks are appended to the log file at BLOCK_WAL_PATH and fsync'd,
+at which point they are durable and insert_blocks returns. A background committer thread then applies them to the
+wrapped backend, in order, committing all blocks that are waiting in a single insert. Until a block is committed, it is
+held in memory and served from there, so every read through the WALBlockBackend sees it as stored.
+
+Blocks are committed under the numbers they were logged with, which are the numbers insert_blocks returned. If the
+wrapped backend can not number them that way (ie. because something else wrote to it), the committer stops, and every
+later insert fails, rather than letting the chain diverge from what was served.
+
+Once every logged block has been committed, the log is truncated. If the process dies before that, the blocks still in
+the log are replayed into the wrapped backend the next time it is opened. Blocks that were committed before the crash
+are recognized by their hash, and skipped. When the block storage is being reset, the log is opened without replaying
+it, since its blocks belong to the chain being deleted.
+
+Each log record holds a (block number, block row, raw transactions, tx hashes) tuple, pickled, and framed with its
+length and a CRC32 checksum. A record left partially written by a crash is discarded on recovery. Its block can not
+have been acknowledged, since insert_blocks only returns once the log is synced.
+
+Only a single process may write to a log. The first process to open a WALBlockBackend takes an exclusive lock on the
+log file, recovers it, and becomes the writer, for as long as it runs. In other processes the WALBlockBackend is read
+only, and only sees blocks once they are committed. A node should open its block storage (ie. make any
+BlockStorageDriver call) in its main process before it starts any worker processes.
+"""
+
+from cilantro.logger import get_logger
+from collections import OrderedDict
+from typing import List
+import threading
+import atexit
+import struct
+import pickle
+import fcntl
+import zlib
+import time
+import os
+
+log = get_logger("BlockWAL")
+
+WAL_COMMIT_BATCH_SIZE = 64  # Max number of blocks committed to the wrapped backend per insert
+WAL_RETRY_SECONDS = 1.0  # Time to wait before retrying a failed commit
+WAL_CLOSE_TIMEOUT = 10.0  # Max number of seconds to wait on exit for logged blocks to be committed
+
+RECORD_HEADER = struct.Struct('<II')  # Payload length, CRC32 of payload
+
+
+class WALException(Exception): pass
+
+
+class WriteAheadLog:
+    """
+    An append-only file of checksummed records. Opening the log locks it, and raises a WALException if another process
+    holds the lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a+b')
+
+        try:
+            # POSIX record locks are per process, and are not inherited by forked children
+            fcntl.lockf(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.file.close()
+            raise WALException("Write-ahead log {} is locked by another process".format(path))
+
+    def append(self, payloads: List[bytes]):
+        """
+        Appends records to the log, and syncs them to disk before returning
+        """
+        self.file.write(b''.join(RECORD_HEADER.pack(len(p), zlib.crc32(p)) + p for p in payloads))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def read(self) -> List[bytes]:
+        """
+        Returns the payloads of all intact records in the log, in order. Reading stops at the first torn or corrupt
+        record.
+        """
+        self.file.seek(0)
+        data = self.file.read()
+
+        payloads, offset = [], 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                log.warning("Discarding torn or corrupt record at offset {} of write-ahead log {}"
+                            .format(offset, self.path))
+                break
+
+            payloads.append(payload)
+            offset += RECORD_HEADER.size + length
+
+        return payloads
+
+    def truncate(self):
+        self.file.truncate(0)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class WALBlockBackend:
+    """
+    Wraps a block storage backend (see blocks.py) with a write-ahead log, exposing the same methods
+    """
+
+    def __init__(self, backend, path: str, recover=True):
+        """
+        :param backend: The block storage backend to commit logged blocks to
+        :param path: The path of the log file
+        :param recover: If False, blocks left in the log by a previous process are discarded rather than committed
+        """
+        self.backend = backend
+        self.path = path
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()  # Block number -> (block row including 'number', raw transactions, tx hashes)
+        self.closed = False
+        self._commit_lock = threading.Lock()  # Held while a batch of blocks is being committed
+        self._last_number = None  # Number of the last logged block, once known
+        self._failure = None  # The error which stopped the committer, if any
+
+        try:
+            self.wal = WriteAheadLog(path)
+        except WALException:
+            log.info("Opening write-ahead log {} read only, as another process is writing to it".format(path))
+            self.wal = None
+            return
+
+        if recover:
+            self._recover()
+        else:
+            log.info("Discarding any blocks left in write-ahead log {}".format(path))
+            self.wal.truncate()
+        self._committer = threading.Thread(target=self._commit_loop, name='BlockWALCommitter', daemon=True)
+        self._committer.start()
+        atexit.register(self.close)
+
+    def insert_blocks(self, blocks: List[tuple], first_num: int=0) -> List[int]:
+        """
+        Logs blocks, given as a list of (block row, raw transactions, tx hashes) tuples, and returns the numbers they
+        will be committed under. The blocks are durable once this returns, but are committed to the wrapped backend
+        asynchronously.
+        :param first_num: If set, the number the caller expects the first block to get. Nothing is logged if it does
+        not follow the last logged block
+        """
+        if self.wal is None:
+            raise WALException("Can not store blocks in this process, as the write-ahead log {} is locked by another "
+                               "process".format(self.path))
+
+        with self.cond:
+            assert not self.closed, "Write-ahead log {} is closed".format(self.path)
+            if self._failure:
+                raise WALException("Can not store blocks, as committing logged blocks failed with: {}"
+                                   .format(self._failure))
+
+            if first_num and first_num != self._get_last_number() + 1:
+                raise WALException("Expected to log blocks as number {} onwards, but the last logged block is {}"
+                                   .format(first_num, self._get_last_number()))
+
+            first_num = self._get_last_number() + 1
+            records = [(first_num + i, block, list(raw_transactions), list(tx_hashes))
+                       for i, (block, raw_transactions, tx_hashes) in enumerate(blocks)]
+            self.wal.append([pickle.dumps(r, protocol=pickle.HIGHEST_PROTOCOL) for r in records])
+
+            for number, block, raw_transactions, tx_hashes in records:
+                self.pending[number] = ({**block, 'number': number}, raw_transactions, tx_hashes)
+            self._last_number = records[-1][0]
+            self.cond.notify_all()
+
+        return [r[0] for r in records]
+
+    def get_block(self, number: int=0, hash: str='', cols: tuple=()) -> dict or None:
+        block = self._find_pending(number=number, hash=hash)
+        if block:
+            return {col: block[col] for col in cols} if cols else dict(block)
+        return self.backend.get_block(number=number, hash=hash, cols=cols)
+
+    def get_latest_block(self) -> dict:
+        pending = self._pending_blocks()
+        if pending:
+            return dict(pending[-1][0])
+        return self.backend.get_latest_block()
+
+    def get_blocks(self, after_hash: str='', after_number: int=0, limit: int=0, cols: tuple=()) -> List[dict]:
+        # Pending blocks are read first, so a block committed in the meantime is seen in one place or the other
+        pending = self._pending_blocks()
+
+        if after_hash:
+            block = self.get_block(hash=after_hash, cols=('number',))
+            if block is None:
+                return []
+            after_number = block['number']
+
+        blocks = OrderedDict((b['number'], b) for b in self.backend.get_blocks(after_number=after_number, limit=limit,
+                                                                                cols=('number',) + tuple(cols)))
+        for block, _, _ in pending:
+            if block['number'] > after_number:
+                blocks.setdefault(block['number'], block)
+
+        blocks = [blocks[n] for n in sorted(blocks)]
+        if limit:
+            blocks = blocks[:limit]
+        return [{col: block[col] for col in cols} for block in blocks]
+
+    def get_tip(self) -> tuple:
+        pending = self._pending_blocks()
+        if pending:
+            return pending[-1][0]['number'], pending[-1][0]['hash']
+        return self.backend.get_tip()
+
+    def iter_raw_transactions(self, hashes: List[str], is_block_hashes=False):
+        pending = self._pending_blocks()
+        if not pending:
+            yield from self.backend.iter_raw_transactions(hashes, is_block_hashes=is_block_hashes)
+            return
+
+        txs_for_key = {}
+        for block, raw_transactions, tx_hashes in pending:
+            for tx_hash, raw_tx in zip(tx_hashes, raw_transactions):
+                txs_for_key.setdefault(block['hash'] if is_block_hashes else tx_hash, []).append(raw_tx)
+
+        committed = [h for h in OrderedDict.fromkeys(hashes) if h not in txs_for_key]
+        for h, raw_tx in self.backend.iter_raw_transactions(committed, is_block_hashes=is_block_hashes):
+            txs_for_key.setdefault(h, []).append(raw_tx)
+
+        for h in hashes:
+            for raw_tx in txs_for_key.get(h, ()):
+                yield h, raw_tx
+
+    def get_tx_locations(self, tx_hashes: List[str]) -> dict:
+        locations = {}
+        for block, _, block_tx_hashes in self._pending_blocks():
+            for position, tx_hash in enumerate(block_tx_hashes):
+                locations[tx_hash] = (block['number'], block['hash'], position)
+
+        locations = {h: locations[h] for h in tx_hashes if h in locations}
+        locations.update(self.backend.get_tx_locations([h for h in tx_hashes if h not in locations]))
+        return locations
+
+    def delete_transactions(self, block_hashes: List[str]):
+        # Only called for blocks deep in the chain, which have long been committed
+        self.backend.delete_transactions(block_hashes)
+
+    def reset(self):
+        with self._commit_lock, self.cond:
+            self.pending.clear()
+            self._last_number = None
+            if self.wal:
+                self.wal.truncate()
+            self.backend.reset()
+
+    def flush(self, timeout: float=None) -> bool:
+        """
+        Waits until every logged block has been committed to the wrapped backend
+        :param timeout: The max number of seconds to wait, or None to wait indefinitely
+        :return: True if all blocks were committed, or False if the timeout expired first (or the committer stopped)
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending or self._failure, timeout=timeout) and not self.pending
+
+    def close(self):
+        """
+        Stops the committer once all logged blocks are committed (or WAL_CLOSE_TIMEOUT expires, in which case the rest
+        are committed when the log is next opened)
+        """
+        if self.wal is None or self.closed:
+            return
+
+        if not self.flush(timeout=WAL_CLOSE_TIMEOUT):
+            log.warning("Closing write-ahead log {} with {} uncommitted blocks. They will be committed when it is next "
+                        "opened.".format(self.path, len(self.pending)))
+
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self._committer.join(timeout=WAL_CLOSE_TIMEOUT)
+
+        with self._commit_lock:
+            self.wal.close()
+
+    def _recover(self):
+        """
+        Commits any blocks left in the log by a previous process, skipping those that were already committed
+        """
+        records = [pickle.loads(payload) for payload in self.wal.read()]
+        if not records:
+            return
+
+        log.notice("Recovering {} blocks from write-ahead log {}".format(len(records), self.path))
+        blocks = [(block, raw_transactions, tx_hashes) for _, block, raw_transactions, tx_hashes in records
+                  if self.backend.get_block(hash=block['hash'], cols=('number',)) is None]
+
+        if blocks:
+            expected = [r[0] for r in records[-len(blocks):]]
+            self._check_numbers(expected, self.backend.insert_blocks(blocks, first_num=expected[0]))
+
+        self.wal.truncate()
+        log.notice("Recovered {} uncommitted blocks from write-ahead log {}".format(len(blocks), self.path))
+
+    def _commit_loop(self):
+        verify = False  # True after a failed commit, which may have applied some of its blocks
+
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or self.closed)
+                if self.closed:
+                    return
+
+            with self._commit_lock:
+                with self.cond:
+                    batch = list(self.pending.values())[:WAL_COMMIT_BATCH_SIZE]
+                if not batch:
+                    continue
+
+                try:
+                    if verify:
+                        batch = [b for b in batch
+                                 if self.backend.get_block(hash=b[0]['hash'], cols=('number',)) is None]
+                    self._commit(batch)
+                    verify = False
+                except WALException as e:
+                    log.fatal("Stopping the write-ahead log committer. No more blocks can be stored. Error: {}"
+                              .format(e))
+                    with self.cond:
+                        self._failure = e
+                        self.cond.notify_all()
+                    return
+                except Exception as e:
+                    log.error("Error committing {} blocks from write-ahead log. Retrying in {} seconds. Error: {}"
+                              .format(len(batch), WAL_RETRY_SECONDS, e))
+                    verify = True
+                    time.sleep(WAL_RETRY_SECONDS)
+                    continue
+
+                with self.cond:
+                    for block, _, _ in batch:
+                        self.pending.pop(block['number'], None)
+
+                    # Everything logged so far is committed, so the log can start over
+                    if not self.pending:
+                        self.wal.truncate()
+                    self.cond.notify_all()
+
+    def _commit(self, batch: List[tuple]):
+        if not batch:
+            return
+
+        # Pending blocks are numbered consecutively, and any blocks of the batch already committed (after a failed
+        # commit) come before the others, so the rest of the batch is consecutive too
+        rows = [({k: v for k, v in block.items() if k != 'number'}, raw_transactions, tx_hashes)
+                for block, raw_transactions, tx_hashes in batch]
+        expected = [block['number'] for block, _, _ in batch]
+        if self.backend.get_tip()[0] + 1 != expected[0]:
+            raise WALException("Blocks logged as number {} onwards do not follow the tip of the storage backend, block "
+                               "{}".format(expected[0], self.backend.get_tip()[0]))
+        self._check_numbers(expected, self.backend.insert_blocks(rows, first_num=expected[0]))
+
+    def _check_numbers(self, expected: List[int], numbers: List[int]):
+        if list(numbers) != list(expected):
+            raise WALException("Blocks logged as numbers {} were committed as numbers {}".format(expected, numbers))
+
+    def _get_last_number(self) -> int:
+        # Called with self.cond held
+        if self._last_number is None:
+            self._last_number = self.backend.get_tip()[0]
+        return self._last_number
+
+    def _pending_blocks(self) -> List[tuple]:
+        with self.cond:
+            return list(self.pending.values())
+
+    def _find_pending(self, number: int=0, hash: str='') -> dict or None:
+        with self.cond:
+            if number:
+                entry = self.pending.get(number)
+                return entry[0] if entry else None
+
+            for block, _, _ in self.pending.values():
+                if block['hash'] == hash:
+                    return block
+        return None
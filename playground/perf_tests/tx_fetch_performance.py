@@ -0,0 +1,84 @@
+"""
+Benchmarks BlockStorageDriver.get_raw_transactions for lookups of 10 up to 100k transaction hashes, and compares it
+against the old approach of building one big or_ clause with an equality check per hash.
+
+Requires a running test DB (see 'make start-db'). Note that this resets the database.
+"""
+from cilantro.logger.base import get_logger, overwrite_logger_level
+from cilantro.storage.db import DB, reset_db
+from cilantro.storage.blocks import BlockStorageDriver, GENESIS_HASH
+from cilantro.storage.tables import insert_rows
+from cilantro.storage.transactions import encode_tx
+from cilantro.utils import Hasher
+from seneca.engine.storage.easy_db import or_
+import secrets
+import random
+import time
+
+
+log = get_logger("TxFetchTester")
+
+LOOKUP_SIZES = (10, 100, 1000, 10000, 100000)
+MAX_LEGACY_LOOKUP = 10000  # The or_ query gets unreasonably slow (and large) past this
+NUM_TXS = 120000
+TX_SIZE = 256
+INSERT_BATCH = 5000
+NUM_TRIALS = 3
+
+
+def seed_transactions(num_txs=NUM_TXS) -> list:
+    log.notice("Seeding {} transactions...".format(num_txs))
+    hashes = []
+
+    with DB() as db:
+        for i in range(0, num_txs, INSERT_BATCH):
+            rows = []
+            for _ in range(min(INSERT_BATCH, num_txs - i)):
+                raw_tx = secrets.token_bytes(TX_SIZE)
+                tx_hash = Hasher.hash(raw_tx)
+                hashes.append(tx_hash)
+                rows.append({'hash': tx_hash, 'data': encode_tx(raw_tx), 'block_hash': GENESIS_HASH})
+            insert_rows(db.ex, 'transactions', rows)
+
+    log.notice("Done seeding transactions.")
+    return hashes
+
+
+def legacy_fetch(hashes: list) -> list:
+    with DB() as db:
+        transactions = db.tables.transactions
+        rows = transactions.select().where(or_(*[(transactions.hash == h) for h in hashes])).run(db.ex)
+        return list(rows)
+
+
+def time_lookup(fn, hashes: list) -> float:
+    best = None
+    for _ in range(NUM_TRIALS):
+        start = time.time()
+        fn(hashes)
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def run_benchmark():
+    reset_db()
+    all_hashes = seed_transactions()
+
+    log.important("{:>10} | {:>12} | {:>12}".format('# hashes', 'chunked (ms)', 'or_ (ms)'))
+    for size in LOOKUP_SIZES:
+        hashes = random.sample(all_hashes, size)
+
+        txs = BlockStorageDriver.get_raw_transactions(hashes)
+        assert [Hasher.hash(tx) for tx in txs] == hashes, "Transactions not returned in request order!"
+
+        chunked = time_lookup(BlockStorageDriver.get_raw_transactions, hashes)
+        legacy = time_lookup(legacy_fetch, hashes) if size <= MAX_LEGACY_LOOKUP else None
+
+        log.important("{:>10} | {:>12} | {:>12}".format(size, round(chunked * 1000, 2),
+                                                         round(legacy * 1000, 2) if legacy is not None else '-'))
+
+
+if __name__ == "__main__":
+    overwrite_logger_level(20)
+    run_benchmark()
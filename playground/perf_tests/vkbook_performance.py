@@ -0,0 +1,56 @@
+"""
+Benchmarks VKBook membership checks, which run for every incoming message, against the old approach of testing
+membership in a list of verifying keys. For scale, both are compared against verifying one signature, which is also
+done for every message.
+
+This does not need a DB. The VKBook is restored to its original sets when the benchmark is done.
+"""
+from cilantro.logger.base import get_logger, overwrite_logger_level
+from cilantro.storage.db import VKBook
+from cilantro.protocol import wallet
+import secrets
+import timeit
+
+
+log = get_logger("VKBookTester")
+
+NUM_NODES = (3, 64, 1024, 10000)
+NUM_CHECKS = 100000
+NUM_VERIFIES = 1000
+
+
+def ns_per_call(fn, number) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 10**9
+
+
+def run_benchmark():
+    sk, vk = wallet.new()
+    msg = secrets.token_bytes(64)
+    sig = wallet.sign(sk, msg)
+    verify_ns = ns_per_call(lambda: wallet.verify(vk, msg, sig), NUM_VERIFIES)
+
+    original = (VKBook.get_masternodes(), VKBook.get_delegates(), VKBook.get_witnesses())
+
+    log.important("{:>8} | {:>14} | {:>14} | {:>14} | {:>14}".format('# nodes', 'set hit (ns)', 'set miss (ns)',
+                                                                     'list miss (ns)', 'verify sig (ns)'))
+    try:
+        for num_nodes in NUM_NODES:
+            delegates = [secrets.token_hex(32) for _ in range(num_nodes)]
+            VKBook._build(original[0], delegates, original[2])
+
+            hit_vk, miss_vk = delegates[-1], secrets.token_hex(32)
+            assert VKBook.is_delegate(hit_vk) and not VKBook.is_delegate(miss_vk)
+
+            hit = ns_per_call(lambda: VKBook.is_delegate(hit_vk), NUM_CHECKS)
+            miss = ns_per_call(lambda: VKBook.is_delegate(miss_vk), NUM_CHECKS)
+            legacy = ns_per_call(lambda: miss_vk in delegates, max(NUM_CHECKS // num_nodes, 10))
+
+            log.important("{:>8} | {:>14} | {:>14} | {:>14} | {:>14}".format(num_nodes, round(hit), round(miss),
+                                                                             round(legacy), round(verify_ns)))
+    finally:
+        VKBook._build(*original)
+
+
+if __name__ == "__main__":
+    overwrite_logger_level(20)
+    run_benchmark()
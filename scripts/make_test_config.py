@@ -12,6 +12,14 @@ if __name__ == '__main__':
     parser.add_argument('--password', default=random_pw)
     parser.add_argument('--database', default='cilantro_dev')
     parser.add_argument('--hostname', default='127.0.0.1')
+    parser.add_argument('--binary-storage', default='false')
+    parser.add_argument('--tx-compression', default='true')
+    parser.add_argument('--block-storage-backend', default='mysql', choices=('mysql', 'segments', 'sharded'))
+    parser.add_argument('--block-shards', default='')
+    parser.add_argument('--block-replication-factor', default='2')
+    parser.add_argument('--tx-archive-depth', default='0')
+    parser.add_argument('--block-wal', default='false')
+    parser.add_argument('--state-roots', default='true')
     parser.add_argument('--output-file', default='./db_conf.ini')
     args = parser.parse_args()
 
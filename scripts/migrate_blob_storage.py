@@ -0,0 +1,31 @@
+#!/usr/bin/env python3.6
+"""
+Offline migration tool which rewrites an existing chain between hex encoded storage and binary blob storage in place.
+
+Stop all nodes using the database before running this. Once the migration is done, set 'binary_storage' in the [DB]
+section of db_conf.ini to match, ie:
+
+    ./scripts/migrate_blob_storage.py --to binary
+    (then set binary_storage = true in db_conf.ini)
+"""
+import argparse
+from seneca.engine.storage.mysql_executer import Executer
+from cilantro.constants.db import DB_SETTINGS
+from cilantro.storage.tables import convert_binary_columns, DB_NAME
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert stored transactions and block contenders between hex and '
+                                                 'binary blob storage.')
+    parser.add_argument('--to', choices=('binary', 'hex'), default='binary')
+    args = parser.parse_args()
+
+    ex = Executer(**DB_SETTINGS)
+    ex.raw('USE {};'.format(DB_NAME))
+
+    convert_binary_columns(ex, to_binary=args.to == 'binary')
+
+    ex.cur.close()
+    ex.conn.close()
+
+    print("Done. Set binary_storage = {} in the [DB] section of db_conf.ini".format(str(args.to == 'binary').lower()))
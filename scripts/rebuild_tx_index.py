@@ -0,0 +1,24 @@
+#!/usr/bin/env python3.6
+"""
+Offline tool which rebuilds the tx_index table (which maps transaction hashes to their block and position) from the
+stored blocks and transactions. Run this once on a chain stored before the tx_index table existed, while no node is
+using the database.
+"""
+from seneca.engine.storage.mysql_executer import Executer
+from cilantro.constants.db import DB_SETTINGS
+from cilantro.storage.tables import build_tables, execute_raw
+from cilantro.storage.transactions import rebuild_tx_index
+
+
+if __name__ == '__main__':
+    ex = Executer(**DB_SETTINGS)
+
+    # Creates the tx_index table if it does not exist yet, leaving all other tables as they are
+    build_tables(ex, should_drop=False)
+    rebuild_tx_index(ex)
+
+    num_rows = execute_raw(ex, 'SELECT COUNT(*) FROM tx_index')[0][0]
+    ex.cur.close()
+    ex.conn.close()
+
+    print("Done. Indexed {} transactions".format(num_rows))
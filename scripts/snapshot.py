@@ -0,0 +1,33 @@
+#!/usr/bin/env python3.6
+"""
+Exports the contract state of this node's database to a snapshot file, or bootstraps a fresh database from one.
+
+To bootstrap a new node from a snapshot taken on another node, ie:
+
+    ./scripts/snapshot.py export state.snap    (on the node with the state)
+    ./scripts/snapshot.py import state.snap    (on the new node, before starting it without resetting its DB)
+
+The new node will then catch up by replaying only the blocks stored after the snapshot was taken.
+"""
+import argparse
+from cilantro.storage.db import reset_db
+from cilantro.storage.snapshots import export_snapshot, import_snapshot
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export or import a snapshot of contract state.')
+    parser.add_argument('action', choices=('export', 'import'))
+    parser.add_argument('path')
+    parser.add_argument('--block-hash', default='', help='When exporting, fail unless this is the latest block hash')
+    parser.add_argument('--no-reset', action='store_true', help='When importing, do not reset the database first')
+    args = parser.parse_args()
+
+    if args.action == 'export':
+        info = export_snapshot(args.path, block_hash=args.block_hash)
+        print("Exported {} tables at block {} (number {}) to {} ({} bytes)"
+              .format(len(info['tables']), info['block_hash'], info['block_number'], args.path, info['size']))
+    else:
+        if not args.no_reset:
+            reset_db()
+        block_hash = import_snapshot(args.path)
+        print("Imported snapshot. Latest block hash is now {}".format(block_hash))
@@ -0,0 +1,77 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from cilantro.nodes.masternode.response_cache import ResponseCache
+import asyncio
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.builds = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _build(self, delay=0):
+        async def build():
+            reply = MagicMock()
+            self.builds.append(reply)
+            await asyncio.sleep(delay)
+            return reply
+        return build
+
+    def _get(self, cache, key, tip, build):
+        return self.loop.run_until_complete(cache.get(key, tip, build))
+
+    def test_hit_same_tip(self):
+        cache = ResponseCache()
+
+        first = self._get(cache, ('tx', 'A'), 'tip1', self._build())
+        second = self._get(cache, ('tx', 'A'), 'tip1', self._build())
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.builds), 1)
+        first.serialize.assert_called_once_with()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_new_tip_invalidates(self):
+        cache = ResponseCache()
+
+        first = self._get(cache, ('tx', 'A'), 'tip1', self._build())
+        second = self._get(cache, ('tx', 'A'), 'tip2', self._build())
+
+        self.assertIsNot(first, second)
+        self.assertEqual(len(self.builds), 2)
+
+    def test_concurrent_requests_share_build(self):
+        cache = ResponseCache()
+
+        async def burst():
+            return await asyncio.gather(*[cache.get(('blockmeta', 'B'), 'tip1', self._build(delay=0.01))
+                                          for _ in range(10)])
+
+        replies = self.loop.run_until_complete(burst())
+
+        self.assertEqual(len(self.builds), 1)
+        self.assertTrue(all(r is replies[0] for r in replies))
+
+    def test_failed_build_not_cached(self):
+        cache = ResponseCache()
+
+        async def fail():
+            raise ValueError("boom")
+
+        self.assertRaises(ValueError, self._get, cache, ('tx', 'A'), 'tip1', fail)
+        self._get(cache, ('tx', 'A'), 'tip1', self._build())
+
+        self.assertEqual(len(self.builds), 1)
+
+    def test_max_size(self):
+        cache = ResponseCache(max_size=2)
+
+        for key in ('A', 'B', 'C'):
+            self._get(cache, ('tx', key), 'tip1', self._build())
+
+        self.assertEqual(list(cache.replies), [('tx', 'B'), ('tx', 'C')])
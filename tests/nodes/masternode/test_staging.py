@@ -1,13 +1,20 @@
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
-from cilantro.nodes.masternode.masternode import MNBootState, MNRunState, MNStagingState
+from cilantro.nodes.masternode.masternode import MNBaseState, MNBootState, MNRunState, MNStagingState
 from cilantro.protocol.states.statemachine import StateTransition
 from cilantro.protocol.states.state import EmptyState
 from cilantro.messages.transaction.base import TransactionBase
+from cilantro.storage.db import VKBook
 from collections import deque
 import asyncio
 
 
+def build_envelope(vk):
+    envelope = MagicMock()
+    envelope.seal.verifying_key = vk
+    return envelope
+
+
 class TestMasterNodeStagingState(TestCase):
 
     @classmethod
@@ -42,3 +49,58 @@ class TestMasterNodeStagingState(TestCase):
         """
         # TODO implement
         pass
+
+
+class TestMasterNodeStagingStateConcurrentReplies(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sm = MagicMock()
+        self.state = MNStagingState(state_machine=self.sm)
+        self.state.call_transition_handler(trans_type=StateTransition.ENTER, state=EmptyState)
+        self.sm.state = self.state
+
+        # Replies are held until the test releases them, so several requests can be in flight at once
+        self.release = asyncio.Event(loop=self.loop)
+
+        async def build_reply(state, request, envelope):
+            await self.release.wait()
+            return MagicMock(block_metas=[])
+
+        patcher = patch.object(MNBaseState, 'handle_blockmeta_request', build_reply)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _handle_requests(self, delegates, before_release=None):
+        handlers = [asyncio.ensure_future(self.state.handle_blockmeta_request(MagicMock(), build_envelope(vk)),
+                                          loop=self.loop) for vk in delegates]
+
+        async def run():
+            await asyncio.sleep(0, loop=self.loop)
+            if before_release:
+                before_release()
+            self.release.set()
+            await asyncio.gather(*handlers, loop=self.loop)
+
+        self.loop.run_until_complete(run())
+
+    def test_transitions_once_when_replies_finish_together(self):
+        delegates = list(VKBook.get_delegates())
+
+        # Every delegate replies twice, so the majority is reached again after the state transitioned
+        self._handle_requests(delegates + delegates)
+
+        self.sm.transition.assert_called_once_with(MNRunState)
+        self.assertEqual(self.sm.composer.send_reply.call_count, 2 * len(delegates))
+
+    def test_reply_after_leaving_state_does_not_transition(self):
+        def leave_state():
+            self.sm.state = MagicMock()
+
+        self._handle_requests(list(VKBook.get_delegates()), before_release=leave_state)
+
+        self.sm.transition.assert_not_called()
+        self.assertEqual(self.state.ready_delegates, set())
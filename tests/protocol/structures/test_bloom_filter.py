@@ -0,0 +1,50 @@
+from unittest import TestCase
+from cilantro.protocol.structures import BloomFilter
+import os
+
+
+class TestBloomFilter(TestCase):
+
+    def test_no_false_negatives(self):
+        bf = BloomFilter(capacity=1000)
+        elements = [os.urandom(32).hex() for _ in range(1000)]
+        bf.update(elements)
+
+        for e in elements:
+            self.assertTrue(e in bf)
+        self.assertEqual(len(bf), 1000)
+
+    def test_false_positive_rate(self):
+        bf = BloomFilter(capacity=2000, error_rate=0.01)
+        bf.update(os.urandom(32) for _ in range(2000))
+
+        false_positives = sum(os.urandom(32) in bf for _ in range(10000))
+
+        # Expected around 100. Allow generous slack so this is not flaky
+        self.assertLess(false_positives, 250)
+
+    def test_str_and_bytes(self):
+        bf = BloomFilter(capacity=10)
+        bf.add('abc')
+
+        self.assertTrue(b'abc' in bf)
+        self.assertFalse('abd' in bf)
+
+    def test_is_full(self):
+        bf = BloomFilter(capacity=2)
+        bf.update([b'a', b'b'])
+        self.assertFalse(bf.is_full())
+
+        bf.add(b'c')
+        self.assertTrue(bf.is_full())
+
+    def test_serialize(self):
+        bf = BloomFilter(capacity=100, error_rate=0.05)
+        bf.update([b'a', b'b', b'c'])
+
+        clone = BloomFilter.from_bytes(bf.to_bytes())
+
+        self.assertEqual(clone.bits, bf.bits)
+        self.assertEqual((clone.capacity, clone.error_rate, clone.num_hashes, len(clone)),
+                         (bf.capacity, bf.error_rate, bf.num_hashes, len(bf)))
+        self.assertTrue(b'b' in clone)
@@ -0,0 +1,90 @@
+from unittest import TestCase
+from cilantro.protocol.structures import SparseMerkleTree
+from cilantro.protocol.structures.sparse_merkle_tree import EMPTY_HASH, leaf_hash
+import random
+import os
+
+
+def random_entries(n):
+    return {os.urandom(32): os.urandom(32) for _ in range(n)}
+
+
+class TestSparseMerkleTree(TestCase):
+
+    def test_empty(self):
+        self.assertEqual(SparseMerkleTree().root, EMPTY_HASH)
+
+    def test_single_key(self):
+        key, value = os.urandom(32), os.urandom(32)
+        tree = SparseMerkleTree()
+        tree.update({key: value})
+
+        self.assertEqual(tree.root, leaf_hash(key, value))
+        self.assertEqual(tree.get(key), value)
+        self.assertEqual(len(tree.nodes), 1)
+
+    def test_root_independent_of_write_order(self):
+        entries = random_entries(200)
+        items = list(entries.items())
+
+        batched = SparseMerkleTree()
+        batched.update(entries)
+
+        one_by_one = SparseMerkleTree()
+        random.shuffle(items)
+        for key, value in items:
+            one_by_one.update({key: value})
+
+        self.assertEqual(batched.root, one_by_one.root)
+        self.assertEqual(batched.nodes, one_by_one.nodes)
+        for key, value in entries.items():
+            self.assertEqual(one_by_one.get(key), value)
+
+    def test_updates_and_deletes(self):
+        entries = random_entries(100)
+        tree = SparseMerkleTree()
+        tree.update(entries)
+
+        keys = list(entries)
+        changes = {k: None for k in keys[:30]}
+        changes.update({k: os.urandom(32) for k in keys[30:50]})
+        tree.update(changes)
+
+        final = {k: v for k, v in {**entries, **changes}.items() if v is not None}
+        expected = SparseMerkleTree()
+        expected.update(final)
+
+        self.assertEqual(tree.root, expected.root)
+        self.assertEqual(tree.nodes, expected.nodes)
+        self.assertIsNone(tree.get(keys[0]))
+
+        tree.update({k: None for k in final})
+        self.assertEqual(tree.root, EMPTY_HASH)
+        self.assertEqual(tree.nodes, {})
+
+    def test_diff_replays(self):
+        tree = SparseMerkleTree()
+        copy = SparseMerkleTree()
+
+        first = random_entries(50)
+        second = random_entries(5)
+        second.update({k: None for k in list(first)[:10]})
+
+        for changes in (first, second):
+            for pos, node in tree.update(changes).items():
+                if node is None:
+                    del copy.nodes[pos]
+                else:
+                    copy.nodes[pos] = node
+
+        self.assertEqual(copy.nodes, tree.nodes)
+        self.assertEqual(copy.root, tree.root)
+
+    def test_update_touches_few_nodes(self):
+        tree = SparseMerkleTree()
+        tree.update(random_entries(1000))
+
+        diff = tree.update({next(iter(random_entries(1))): os.urandom(32)})
+
+        # The path to one new key in a tree of about 2000 nodes
+        self.assertLess(len(diff), 40)
@@ -0,0 +1,115 @@
+from unittest import TestCase
+from unittest.mock import patch
+from cilantro.storage.archive import *
+from cilantro.storage.blocks import BlockStorageDriver
+from cilantro.storage.db import reset_db, DB
+from cilantro.storage.tables import execute_raw
+from cilantro.messages.consensus.block_contender import build_test_contender
+from cilantro.messages.transaction.base import build_test_transaction
+from cilantro.protocol.structures.merkle_tree import MerkleTree
+from cilantro.constants.testnet import TESTNET_MASTERNODES
+from cilantro.utils import Hasher
+import tempfile
+import shutil
+import os
+
+
+class TestTransactionArchive(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_archive_block(self):
+        archive = TransactionArchive(self.path)
+        txs = [os.urandom(64) for _ in range(5)]
+        block_hash = Hasher.hash(b'block')
+
+        self.assertEqual(archive.last_block_number(), 0)
+
+        archive.archive_block(7, block_hash, [(Hasher.hash(tx), tx) for tx in txs])
+        archive.close()
+
+        archive = TransactionArchive(self.path)
+        self.assertEqual(archive.last_block_number(), 7)
+        self.assertEqual(archive.get_block_transactions(block_hash), txs)
+        self.assertEqual(archive.get_transaction(Hasher.hash(txs[3])), txs[3])
+        self.assertTrue(archive.get_transaction(Hasher.hash(b'nope')) is None)
+
+    def test_archive_block_out_of_order(self):
+        archive = TransactionArchive(self.path)
+        archive.archive_block(7, Hasher.hash(b'block7'), [])
+
+        self.assertRaises(AssertionError, archive.archive_block, 6, Hasher.hash(b'block6'), [])
+
+
+class TestArchiveTransactions(TestCase):
+    """
+    Archives transactions through BlockStorageDriver, using the MySQL backend
+    """
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'archive')
+        self.patcher = patch('cilantro.storage.blocks.TX_ARCHIVE_DIR', self.path)
+        self.patcher.start()
+        reset_db()
+
+    def tearDown(self):
+        reset_db()
+        self.patcher.stop()
+        shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+
+    def _store_block(self) -> tuple:
+        raw_transactions = [build_test_transaction().serialize() for _ in range(4)]
+        bc = build_test_contender(tree=MerkleTree(raw_transactions))
+        block_hash = BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_transactions,
+                                                    publisher_sk=TESTNET_MASTERNODES[0]['sk'], timestamp=9000)
+        return block_hash, raw_transactions
+
+    @staticmethod
+    def _num_hot_transactions() -> int:
+        with DB() as db:
+            return execute_raw(db.ex, "SELECT COUNT(*) FROM transactions")[0][0]
+
+    def test_archive_transactions(self):
+        blocks = [self._store_block() for _ in range(4)]
+
+        # Blocks 1 (genesis), 2, and 3 are more than 2 blocks behind the latest block (number 5)
+        self.assertEqual(BlockStorageDriver.archive_transactions(depth=2), 3)
+        self.assertEqual(self._num_hot_transactions(), 8)
+
+        # Archived transactions are still returned, in block order
+        for block_hash, raw_transactions in blocks:
+            self.assertEqual(BlockStorageDriver.get_raw_transactions_from_block(block_hash), raw_transactions)
+
+        hashes = [Hasher.hash(blocks[3][1][0]), Hasher.hash(blocks[0][1][2]), Hasher.hash(blocks[1][1][1])]
+        self.assertEqual(BlockStorageDriver.get_raw_transactions(hashes),
+                         [blocks[3][1][0], blocks[0][1][2], blocks[1][1][1]])
+
+    def test_archive_transactions_is_incremental(self):
+        self._store_block()
+        self.assertEqual(BlockStorageDriver.archive_transactions(depth=1), 1)
+        self.assertEqual(BlockStorageDriver.archive_transactions(depth=1), 0)
+
+        self._store_block()
+        self.assertEqual(BlockStorageDriver.archive_transactions(depth=1), 1)
+        self.assertEqual(self._num_hot_transactions(), 4)
+
+    def test_archive_transactions_min_blocks(self):
+        for _ in range(3):
+            self._store_block()
+
+        self.assertEqual(BlockStorageDriver.archive_transactions(depth=1, min_blocks=4), 0)
+        self.assertEqual(BlockStorageDriver.archive_transactions(depth=1, min_blocks=3), 3)
+
+    def test_reset_deletes_archive(self):
+        block_hash, _ = self._store_block()
+        self._store_block()
+        BlockStorageDriver.archive_transactions(depth=1)
+
+        reset_db()
+
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(BlockStorageDriver.get_raw_transactions_from_block(block_hash) is None)
@@ -0,0 +1,55 @@
+from unittest import TestCase
+from unittest.mock import patch
+from cilantro.storage.async_storage import AsyncBlockStorage
+from cilantro.storage.blocks import BlockStorageDriver
+from cilantro.storage.db import reset_db
+import threading
+import asyncio
+
+
+class TestAsyncBlockStorage(TestCase):
+
+    def setUp(self):
+        reset_db()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_latest_block(self):
+        block_hash = self.loop.run_until_complete(AsyncBlockStorage.get_latest_block_hash())
+
+        self.assertEqual(block_hash, BlockStorageDriver.get_latest_block_hash())
+
+    def test_runs_off_event_loop(self):
+        threads = []
+
+        def get_raw_transactions(tx_hashes):
+            threads.append(threading.get_ident())
+            return [b'tx']
+
+        with patch.object(BlockStorageDriver, 'get_raw_transactions', side_effect=get_raw_transactions):
+            result = self.loop.run_until_complete(AsyncBlockStorage.get_raw_transactions(['AB' * 32]))
+
+        self.assertEqual(result, [b'tx'])
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_concurrent_calls(self):
+        # Both calls must be in flight at once for either to get past the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get_block(**kwargs):
+            barrier.wait()
+            return kwargs['number']
+
+        async def get_both():
+            return await asyncio.gather(AsyncBlockStorage.get_block(number=1), AsyncBlockStorage.get_block(number=2))
+
+        with patch.object(BlockStorageDriver, 'get_block', side_effect=get_block):
+            self.assertEqual(self.loop.run_until_complete(get_both()), [1, 2])
+
+    def test_exception_propagates(self):
+        with patch.object(BlockStorageDriver, 'get_latest_block', side_effect=ValueError("boom")):
+            self.assertRaises(ValueError, self.loop.run_until_complete, AsyncBlockStorage.get_latest_block())
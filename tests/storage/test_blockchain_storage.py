@@ -1,6 +1,7 @@
 from unittest import TestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from cilantro.constants.testnet import TESTNET_MASTERNODES
+from cilantro.storage.transactions import decompress_tx, rebuild_tx_index
 from cilantro.storage.blocks import * # Generally, * imports are bad, but this test imports pretty much every class from it
 from cilantro.storage.db import reset_db, DB
 from cilantro.messages.consensus.block_contender import build_test_contender
@@ -10,11 +11,22 @@ from cilantro.utils import Hasher, int_to_bytes
 from cilantro.protocol.structures.merkle_tree import MerkleTree
 from cilantro.protocol import wallet
 from cilantro.constants.testnet import TESTNET_MASTERNODES
+import tempfile
 import secrets
 import random
+import shutil
 
 
 class TestBlockStorageDriver(TestCase):
+    """
+    Runs BlockStorageDriver against the block storage backend set in BACKEND. Subclasses run the same tests against the
+    other backends
+    """
+    BACKEND = 'mysql'
+
+    def _require_mysql_backend(self):
+        if self.BACKEND != 'mysql':
+            self.skipTest("Reads the MySQL tables directly")
 
     def _build_block_data(self, num_transactions=4, ref_prev_block=False) -> dict:
         """
@@ -103,6 +115,39 @@ class TestBlockStorageDriver(TestCase):
         # We reset the DB, so the latest hash we pull should be the genesis hash
         self.assertEqual(first_hash, GENESIS_HASH)
 
+    def test_latest_block_hash_cached_after_store(self):
+        mn_sk = TESTNET_MASTERNODES[0]['sk']
+        raw_transactions = [build_test_transaction().serialize() for _ in range(4)]
+        bc = build_test_contender(tree=MerkleTree(raw_transactions))
+
+        block_hash = BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_transactions,
+                                                    publisher_sk=mn_sk, timestamp=9000)
+
+        # The tip should be served from the cache, and agree with what is actually in the DB
+        self.assertEqual(BlockStorageDriver._tip[1], block_hash)
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), block_hash)
+        self.assertEqual(BlockStorageDriver.get_latest_block()['hash'], block_hash)
+        self.assertEqual(BlockStorageDriver.get_latest_block_number(), BlockStorageDriver.get_latest_block()['number'])
+
+    def test_latest_block_hash_after_invalidate(self):
+        expected_hash = BlockStorageDriver.get_latest_block_hash()
+
+        BlockStorageDriver.invalidate_cache()
+
+        self.assertTrue(BlockStorageDriver._tip is None)
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), expected_hash)
+
+    def test_get_block_header(self):
+        header = BlockStorageDriver.get_block_header(hash=GENESIS_HASH)
+
+        self.assertEqual(set(header.keys()), set(BLOCK_HEADER_COLS))
+        self.assertEqual(header['number'], 1)
+        self.assertEqual(header['prev_block_hash'], GENESIS_EMPTY_HASH)
+        self.assertEqual(BlockStorageDriver.get_block_header(number=1), header)
+
+    def test_get_block_header_doesnt_exist(self):
+        self.assertTrue(BlockStorageDriver.get_block_header(hash='A' * 64) is None)
+
     def test_validate_block_data_valid(self):
         block_data = self._build_block_data()
         BlockStorageDriver.validate_block_data(block_data)  # This should not raise any Exceptions
@@ -156,6 +201,19 @@ class TestBlockStorageDriver(TestCase):
         }
         self.assertRaises(InvalidMerkleTreeException, BlockStorageDriver.validate_block_data, block_data)
 
+    def test_validate_block_data_with_tree(self):
+        block_data = self._build_block_data()
+        tree = MerkleTree.from_leaves_hex_str(block_data['merkle_leaves'])
+
+        BlockStorageDriver.validate_block_data(block_data, tree=tree)  # This should not raise any Exceptions
+
+    def test_validate_block_data_with_mismatched_tree(self):
+        block_data = self._build_block_data()
+        other_tree = MerkleTree([build_test_transaction().serialize() for _ in range(4)])
+
+        self.assertRaises(InvalidMerkleTreeException, BlockStorageDriver.validate_block_data, block_data,
+                          tree=other_tree)
+
     def test_validate_block_data_invalid_contender_signatures(self):
         block_data = self._build_block_data()
 
@@ -223,8 +281,7 @@ class TestBlockStorageDriver(TestCase):
         self.assertEqual(expected_hash, actual_hash)
 
     def test_store_block_inserts(self):
-        with DB() as db:
-            initial_num_blocks = len(db.tables.blocks.select().run(db.ex))
+        initial_num_blocks = BlockStorageDriver.get_latest_block_number()
 
         mn_sk = TESTNET_MASTERNODES[0]['sk']
         timestamp = random.randint(0, pow(2, 32))
@@ -235,10 +292,9 @@ class TestBlockStorageDriver(TestCase):
 
         BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_transactions, publisher_sk=mn_sk, timestamp=timestamp)
 
-        with DB() as db:
-            blocks = db.tables.blocks.select().run(db.ex)
-            self.assertEquals(len(blocks) - initial_num_blocks, 1)
-            self.assertEquals(blocks[-1]['timestamp'], timestamp)
+        BlockStorageDriver.invalidate_cache()
+        self.assertEquals(BlockStorageDriver.get_latest_block_number() - initial_num_blocks, 1)
+        self.assertEquals(BlockStorageDriver.get_latest_block()['timestamp'], timestamp)
 
     def test_store_block_contender_raw_tx_mismatch(self):
         mn_sk = TESTNET_MASTERNODES[0]['sk']
@@ -255,6 +311,7 @@ class TestBlockStorageDriver(TestCase):
                           raw_transactions=mismatched_transactions, publisher_sk=mn_sk, timestamp=timestamp)
 
     def test_store_block_inserts_transactions(self):
+        self._require_mysql_backend()
         num_txs = 4
 
         with DB() as db:
@@ -286,7 +343,8 @@ class TestBlockStorageDriver(TestCase):
 
                 tx_row = rows[0]
                 self.assertEquals(tx_row['hash'], tx_hash, "Expected fetched tx to have hash equal to its hashed data")
-                self.assertEquals(tx_row['data'], encode_tx(raw_tx), "Expected tx data col to equal encoded raw tx")
+                self.assertEquals(decompress_tx(decode_tx(tx_row['data']), tx_row['dict_version']), raw_tx,
+                                  "Expected tx data col to decode to the raw tx")
                 self.assertEquals(tx_row['block_hash'], block_hash, "Expected inserted tx to reference last block")
 
     def test_get_block_invalid_args(self):
@@ -420,11 +478,59 @@ class TestBlockStorageDriver(TestCase):
         # Stuff a sketch block in that doesn't link to the last
         sketch_block = self._build_block_data()  # by default this has prev_block_hash = 'AAAAA...'
         sketch_block['hash'] = BlockStorageDriver.compute_block_hash(sketch_block)
-        with DB() as db:
-            db.tables.blocks.insert([BlockStorageDriver._encode_block(sketch_block)]).run(db.ex)
+        BlockStorageDriver._get_backend().insert_blocks([(BlockStorageDriver._encode_block(sketch_block), [], [])])
+        BlockStorageDriver.invalidate_cache()  # We wrote to the backend directly, so cached chain state is stale
 
         self.assertRaises(InvalidBlockLinkException, BlockStorageDriver.validate_blockchain)
 
+    def test_store_block_with_stale_tip(self):
+        reset_db()
+        self._store_random_blocks(1)
+
+        # Another writer stores a block behind this process's back, so the cached tip is stale
+        other_block = self._build_block_data(ref_prev_block=True)
+        other_block['hash'] = BlockStorageDriver.compute_block_hash(other_block)
+        BlockStorageDriver._get_backend().insert_blocks([(BlockStorageDriver._encode_block(other_block), [], [])])
+        self.assertEqual(BlockStorageDriver.get_latest_block_number(), 2)
+
+        self.assertRaises(BlockStorageDatabaseException, self._store_random_blocks, 1)
+        self.assertEqual(BlockStorageDriver.get_block(number=3)['hash'], other_block['hash'])
+        self.assertTrue(BlockStorageDriver.get_block(number=4) is None)
+
+        # The cached tip was dropped, so the next block links to the other writer's block
+        self._store_random_blocks(1)
+        self.assertEqual(BlockStorageDriver.get_block(number=4)['prev_block_hash'], other_block['hash'])
+        BlockStorageDriver.validate_blockchain()
+
+    def _store_random_blocks(self, num_blocks):
+        mn_sk = TESTNET_MASTERNODES[0]['sk']
+        for _ in range(num_blocks):
+            raw_transactions = [build_test_transaction().serialize() for _ in range(4)]
+            bc = build_test_contender(tree=MerkleTree(raw_transactions))
+            BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_transactions, publisher_sk=mn_sk,
+                                           timestamp=random.randint(0, pow(2, 32)))
+
+    @patch('cilantro.storage.blocks.VALIDATION_MIN_RANGE_SIZE', 2)
+    def test_validate_blockchain_async(self):
+        reset_db()
+        self._store_random_blocks(6)
+
+        # This should not blow up. With a min range size of 2, the 7 blocks are split across several ranges
+        BlockStorageDriver.validate_blockchain(async=True, num_workers=2)
+
+    @patch('cilantro.storage.blocks.VALIDATION_MIN_RANGE_SIZE', 2)
+    def test_validate_blockchain_async_invalid_link_between_ranges(self):
+        reset_db()
+        self._store_random_blocks(3)
+
+        # Stuff a sketch block in that doesn't link to the last. As block number 5, this is the first in its range
+        sketch_block = self._build_block_data()
+        sketch_block['hash'] = BlockStorageDriver.compute_block_hash(sketch_block)
+        BlockStorageDriver._get_backend().insert_blocks([(BlockStorageDriver._encode_block(sketch_block), [], [])])
+        BlockStorageDriver.invalidate_cache()
+
+        self.assertRaises(InvalidBlockLinkException, BlockStorageDriver.validate_blockchain, async=True, num_workers=2)
+
     def test_get_raw_transaction(self):
         mn_sk = TESTNET_MASTERNODES[0]['sk']
         timestamp = random.randint(0, pow(2, 32))
@@ -457,6 +563,128 @@ class TestBlockStorageDriver(TestCase):
         for raw_tx in raw_transactions:
             self.assertTrue(raw_tx in retrieved_txs)
 
+    def _store_block_with_txs(self, num_txs) -> tuple:
+        mn_sk = TESTNET_MASTERNODES[0]['sk']
+        raw_transactions = [build_test_transaction().serialize() for _ in range(num_txs)]
+        bc = build_test_contender(tree=MerkleTree(raw_transactions))
+
+        block_hash = BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_transactions,
+                                                    publisher_sk=mn_sk, timestamp=9000)
+        return block_hash, raw_transactions
+
+    @patch('cilantro.storage.blocks.TX_FETCH_CHUNK_SIZE', 3)
+    def test_get_raw_transactions_chunked_in_request_order(self):
+        _, raw_transactions = self._store_block_with_txs(8)
+        random.shuffle(raw_transactions)
+        hashes = list(map(Hasher.hash, raw_transactions))
+
+        # Throw in a hash that does not exist, which should just be skipped
+        hashes.insert(4, 'DEADBEEF' * 8)
+
+        self.assertEquals(BlockStorageDriver.get_raw_transactions(hashes), raw_transactions)
+
+    @patch('cilantro.storage.blocks.TX_FETCH_TEMP_TABLE_MIN', 2)
+    def test_get_raw_transactions_with_key_table_in_request_order(self):
+        _, raw_transactions = self._store_block_with_txs(8)
+        random.shuffle(raw_transactions)
+        hashes = list(map(Hasher.hash, raw_transactions))
+
+        self.assertEquals(BlockStorageDriver.get_raw_transactions(hashes), raw_transactions)
+
+    @patch('cilantro.storage.blocks.TX_FETCH_CHUNK_SIZE', 1)
+    def test_get_raw_transactions_from_blocks_in_request_order(self):
+        block_hash1, raw_transactions1 = self._store_block_with_txs(4)
+        block_hash2, raw_transactions2 = self._store_block_with_txs(4)
+
+        txs = BlockStorageDriver.get_raw_transactions_from_block([block_hash2, block_hash1])
+
+        self.assertEquals(set(txs[:4]), set(raw_transactions2))
+        self.assertEquals(set(txs[4:]), set(raw_transactions1))
+
+    def test_get_tx_location(self):
+        block_hash, raw_transactions = self._store_block_with_txs(4)
+
+        location = BlockStorageDriver.get_tx_location(Hasher.hash(raw_transactions[2]))
+
+        self.assertEqual(location, {'block_number': BlockStorageDriver.get_latest_block_number(),
+                                    'block_hash': block_hash, 'position': 2})
+
+    def test_get_tx_locations(self):
+        block_hash1, raw_transactions1 = self._store_block_with_txs(2)
+        block_hash2, raw_transactions2 = self._store_block_with_txs(2)
+        hashes = [Hasher.hash(raw_transactions2[1]), Hasher.hash(raw_transactions1[0]), 'DEADBEEF' * 8]
+
+        locations = BlockStorageDriver.get_tx_locations(hashes)
+
+        self.assertEqual(len(locations), 2)
+        self.assertEqual((locations[hashes[0]]['block_hash'], locations[hashes[0]]['position']), (block_hash2, 1))
+        self.assertEqual((locations[hashes[1]]['block_hash'], locations[hashes[1]]['position']), (block_hash1, 0))
+
+    def test_rebuild_tx_index(self):
+        self._require_mysql_backend()
+        block_hash1, raw_transactions1 = self._store_block_with_txs(2)
+        block_hash2, raw_transactions2 = self._store_block_with_txs(3)
+        hashes = [Hasher.hash(tx) for tx in raw_transactions1 + raw_transactions2]
+        expected = BlockStorageDriver.get_tx_locations(hashes)
+
+        with DB() as db:
+            execute_raw(db.ex, "DELETE FROM tx_index")
+            db.ex.conn.commit()
+            rebuild_tx_index(db.ex)
+
+        self.assertEqual(BlockStorageDriver.get_tx_locations(hashes), expected)
+        self.assertEqual(expected[hashes[4]], {'block_number': BlockStorageDriver.get_latest_block_number(),
+                                               'block_hash': block_hash2, 'position': 2})
+
+    def test_get_tx_location_doesnt_exist(self):
+        self.assertTrue(BlockStorageDriver.get_tx_location('DEADBEEF' * 8) is None)
+
+    def test_has_transaction(self):
+        _, raw_transactions = self._store_block_with_txs(2)
+
+        self.assertTrue(BlockStorageDriver.has_transaction(Hasher.hash(raw_transactions[1])))
+        self.assertFalse(BlockStorageDriver.has_transaction('DEADBEEF' * 8))
+
+    def test_get_committed_transactions_new_hashes_skip_db(self):
+        _, raw_transactions = self._store_block_with_txs(2)
+        BlockStorageDriver.get_committed_transactions([])  # Loads the tx filter
+
+        with patch.object(BlockStorageDriver._get_backend(), 'get_tx_locations') as get_tx_locations:
+            committed = BlockStorageDriver.get_committed_transactions([secrets.token_hex(32) for _ in range(20)])
+
+        self.assertEqual(committed, set())
+        get_tx_locations.assert_not_called()
+
+    def test_tx_filter_follows_new_blocks(self):
+        BlockStorageDriver.get_committed_transactions([])  # Loads the tx filter
+        _, raw_transactions = self._store_block_with_txs(2)
+
+        hashes = [Hasher.hash(tx) for tx in raw_transactions]
+        self.assertEqual(BlockStorageDriver.get_committed_transactions(hashes + ['DEADBEEF' * 8]), set(hashes))
+
+    def test_tx_filter_only_saved_by_block_writer(self):
+        self._store_block_with_txs(2)
+
+        # A process which only reads the chain (like the TransactionBatcher) never saves its filter
+        BlockStorageDriver._stores_blocks = False
+        BlockStorageDriver.get_committed_transactions([], refresh=True)
+        with patch.object(TransactionFilter, 'save') as save:
+            BlockStorageDriver.save_tx_filter()
+        save.assert_not_called()
+
+        self._store_block_with_txs(2)
+        with patch.object(TransactionFilter, 'save') as save:
+            BlockStorageDriver.save_tx_filter()
+        save.assert_called_once_with(TX_FILTER_PATH)
+
+    def test_tx_filter_cleared_on_reset(self):
+        _, raw_transactions = self._store_block_with_txs(2)
+        self.assertTrue(BlockStorageDriver.has_transaction(Hasher.hash(raw_transactions[0])))
+
+        reset_db()
+
+        self.assertFalse(BlockStorageDriver.has_transaction(Hasher.hash(raw_transactions[0])))
+
     def test_get_raw_transaction_doesnt_exist(self):
         tx = BlockStorageDriver.get_raw_transactions('DEADBEEF' * 8)
         self.assertTrue(tx is None)
@@ -526,6 +754,75 @@ class TestBlockStorageDriver(TestCase):
         actual_new_hashes = BlockStorageDriver.get_child_block_hashes(starting_hash)
         self.assertEquals(actual_new_hashes, new_hashes)
 
+    def test_get_child_block_hashes_with_limit(self):
+        mn_sk = TESTNET_MASTERNODES[0]['sk']
+        starting_hash = BlockStorageDriver.get_latest_block_hash()
+        new_hashes = []
+
+        for _ in range(3):
+            raw_txs = [build_test_transaction().serialize() for _ in range(4)]
+            bc = build_test_contender(tree=MerkleTree(raw_txs))
+            new_hashes.append(BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_txs,
+                                                             publisher_sk=mn_sk, timestamp=9000))
+
+        self.assertEquals(BlockStorageDriver.get_child_block_hashes(starting_hash, limit=2), new_hashes[:2])
+        self.assertEquals(BlockStorageDriver.get_child_block_hashes(starting_hash, limit=10), new_hashes)
+
+    def test_get_blocks(self):
+        mn_sk = TESTNET_MASTERNODES[0]['sk']
+        starting_hash = BlockStorageDriver.get_latest_block_hash()
+        starting_num = BlockStorageDriver.get_latest_block_number()
+        new_hashes = []
+
+        for _ in range(3):
+            raw_txs = [build_test_transaction().serialize() for _ in range(4)]
+            bc = build_test_contender(tree=MerkleTree(raw_txs))
+            new_hashes.append(BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_txs,
+                                                             publisher_sk=mn_sk, timestamp=9000))
+
+        blocks = BlockStorageDriver.get_blocks(after_hash=starting_hash)
+        self.assertEquals([b['hash'] for b in blocks], new_hashes)
+        for b in blocks:
+            self.assertEquals(b, BlockStorageDriver.get_block(hash=b['hash']))
+
+        blocks = BlockStorageDriver.get_blocks(after_number=starting_num + 1, limit=1, include_number=False)
+        self.assertEquals(len(blocks), 1)
+        self.assertEquals(blocks[0]['hash'], new_hashes[1])
+        self.assertFalse('number' in blocks[0])
+
+    def test_get_blocks_headers_only(self):
+        headers = BlockStorageDriver.get_blocks(after_number=0, limit=1, headers_only=True)
+
+        self.assertEquals(len(headers), 1)
+        self.assertEquals(set(headers[0].keys()), set(BLOCK_HEADER_COLS))
+        self.assertEquals(headers[0]['hash'], GENESIS_HASH)
+
+    def test_get_blocks_nonexisting_hash(self):
+        self.assertEquals(BlockStorageDriver.get_blocks(after_hash='ABCD' * 16), [])
+
+    def test_get_blocks_after_latest(self):
+        self.assertEquals(BlockStorageDriver.get_blocks(after_hash=BlockStorageDriver.get_latest_block_hash()), [])
+
+    def test_iter_blocks(self):
+        reset_db()
+        mn_sk = TESTNET_MASTERNODES[0]['sk']
+        expected_hashes = [GENESIS_HASH]
+
+        for _ in range(4):
+            raw_txs = [build_test_transaction().serialize() for _ in range(4)]
+            bc = build_test_contender(tree=MerkleTree(raw_txs))
+            expected_hashes.append(BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_txs,
+                                                                  publisher_sk=mn_sk, timestamp=9000))
+
+        # Page sizes that do and do not evenly divide the number of blocks should yield the same blocks
+        for page_size in (1, 2, 3, 5, 100):
+            hashes = [b['hash'] for b in BlockStorageDriver.iter_blocks(page_size=page_size)]
+            self.assertEquals(hashes, expected_hashes)
+
+        blocks = list(BlockStorageDriver.iter_blocks(start_number=2, end_number=4, page_size=2, headers_only=True))
+        self.assertEquals([b['hash'] for b in blocks], expected_hashes[1:4])
+        self.assertEquals(set(blocks[0].keys()), set(BLOCK_HEADER_COLS))
+
     def test_store_block_from_meta(self):
         block_meta = self._build_block_meta(ref_prev_block=True)
 
@@ -551,9 +848,99 @@ class TestBlockStorageDriver(TestCase):
         block_meta = self._build_block_meta(ref_prev_block=False)
         self.assertRaises(InvalidBlockLinkException, BlockStorageDriver.store_block_from_meta, block_meta)
 
+    def _build_block_meta_chain(self, num_blocks) -> List[BlockMetaData]:
+        prev_hash, metas = BlockStorageDriver.get_latest_block_hash(), []
+        for _ in range(num_blocks):
+            b_data = self._build_block_data()
+            b_data['prev_block_hash'] = prev_hash
+            b_data['hash'] = prev_hash = BlockStorageDriver.compute_block_hash(b_data)
+            metas.append(BlockMetaData.create(**b_data))
+        return metas
+
+    def test_store_blocks_from_meta(self):
+        metas = self._build_block_meta_chain(3)
+        prev_num = BlockStorageDriver.get_latest_block_number()
+
+        hashes = BlockStorageDriver.store_blocks_from_meta(metas)
+
+        self.assertEqual(hashes, [m.block_hash for m in metas])
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), metas[-1].block_hash)
+        for i, meta in enumerate(metas):
+            self.assertEqual(BlockStorageDriver.get_block(number=prev_num + i + 1)['hash'], meta.block_hash)
+
+    def test_store_blocks_from_meta_invalid_link_stores_nothing(self):
+        metas = self._build_block_meta_chain(2) + [self._build_block_meta(ref_prev_block=False)]
+        latest_hash = BlockStorageDriver.get_latest_block_hash()
+
+        self.assertRaises(InvalidBlockLinkException, BlockStorageDriver.store_blocks_from_meta, metas)
+
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), latest_hash)
+        self.assertTrue(BlockStorageDriver.get_block(hash=metas[0].block_hash) is None)
+
     # TODO remove this
     # def test_blow_tf_up(self):
     #     b_data = self._build_block_data_with_hash(ref_prev_block=False)
     #     block_notif = NewBlockNotification.create(**b_data)
     #
     #     BlockStorageDriver.store_block_from_meta(block_notif)
+
+
+class TestSegmentBlockStorageDriver(TestBlockStorageDriver):
+    BACKEND = 'segments'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.patchers = [patch('cilantro.storage.blocks.BLOCK_STORAGE_BACKEND', self.BACKEND),
+                         patch('cilantro.storage.blocks.SEGMENT_STORE_DIR', self.path)]
+        for p in self.patchers:
+            p.start()
+
+        BlockStorageDriver._backend = None
+        BlockStorageDriver.invalidate_cache()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+        BlockStorageDriver._backend = None
+        BlockStorageDriver.invalidate_cache()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class TestBlockHeaderCache(TestCase):
+
+    @staticmethod
+    def _header(number) -> dict:
+        return {'number': number, 'hash': Hasher.hash(number)}
+
+    def test_get_by_hash_and_number(self):
+        cache = BlockHeaderCache(max_size=4)
+        header = self._header(1)
+        cache.put(header)
+
+        self.assertEqual(cache.get(hash=header['hash']), header)
+        self.assertEqual(cache.get(number=1), header)
+        self.assertTrue(cache.get(number=2) is None)
+
+    def test_evicts_least_recently_used(self):
+        cache = BlockHeaderCache(max_size=2)
+        h1, h2, h3 = self._header(1), self._header(2), self._header(3)
+
+        cache.put(h1)
+        cache.put(h2)
+        cache.get(number=1)  # h1 is now more recently used than h2
+        cache.put(h3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(number=1), h1)
+        self.assertTrue(cache.get(number=2) is None)
+        self.assertTrue(cache.get(hash=h2['hash']) is None)
+        self.assertEqual(cache.get(number=3), h3)
+
+    def test_clear(self):
+        cache = BlockHeaderCache()
+        cache.put(self._header(1))
+        cache.clear()
+
+        self.assertEqual(len(cache), 0)
+        self.assertTrue(cache.get(number=1) is None)
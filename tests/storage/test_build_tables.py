@@ -1,10 +1,11 @@
 from unittest import TestCase
+from unittest.mock import patch
 from seneca.engine.storage.mysql_executer import Executer
 from cilantro.storage.blocks import *
 from cilantro.storage.contracts import *
 from cilantro.storage.contracts import _read_contract_files, _contract_id_for_filename, _lookup_contract_info
 from cilantro.storage.db import DBSingletonMeta
-from cilantro.storage.tables import build_tables
+from cilantro.storage.tables import build_tables, convert_binary_columns, column_type, execute_raw, SCHEMA_VERSION
 import unittest
 import time
 from cilantro.constants.db import DB_SETTINGS
@@ -46,7 +47,6 @@ class TestBuildTables(TestCase):
             'number': 1,
             'hash': GENESIS_HASH,
             'merkle_root': GENESIS_EMPTY_STR,
-            'merkle_leaves': GENESIS_EMPTY_STR,
             'prev_block_hash': GENESIS_EMPTY_HASH,
             'timestamp': GENESIS_TIMESTAMP,
             'masternode_signature': GENESIS_EMPTY_STR
@@ -63,6 +63,9 @@ class TestBuildTables(TestCase):
             assert actual_val == expected_val, "Blocks table key {} seeded with value {} but expected {}"\
                                                .format(key, actual_val, expected_val)
 
+        bodies = execute_raw(self.ex, "SELECT number, merkle_leaves FROM block_bodies")
+        self.assertEqual(bodies, ((1, GENESIS_EMPTY_STR),))
+
     def test_seed_contracts(self):
         tables = build_tables(self.ex, should_drop=True)
 
@@ -113,6 +116,26 @@ class TestBuildTables(TestCase):
         self.assertEqual(expected_exec_dt , actual_exec_dt)
         self.assertTrue(expected_snippet in actual_code)
 
+    def test_lookup_contract_info_is_cached(self):
+        tables = build_tables(self.ex, should_drop=True)
+        contract_id = _contract_id_for_filename(CONTRACT_FILENAME)
+
+        info = _lookup_contract_info(self.ex, tables.contracts, contract_id)
+        hits = contract_cache.stats()['hits']
+
+        # A different executer should be served from the same cache
+        self.assertEqual(_lookup_contract_info(Executer(**DB_SETTINGS), tables.contracts, contract_id), info)
+        self.assertEqual(contract_cache.stats()['hits'], hits + 1)
+
+    def test_build_tables_invalidates_contract_cache(self):
+        tables = build_tables(self.ex, should_drop=True)
+        contract_id = _contract_id_for_filename(CONTRACT_FILENAME)
+        _lookup_contract_info(self.ex, tables.contracts, contract_id)
+
+        build_tables(self.ex, should_drop=True)
+
+        self.assertTrue(contract_cache.get(contract_id) is None)
+
     def test_module_loader_fn(self):
         tables = build_tables(self.ex, should_drop=True)
 
@@ -131,7 +154,107 @@ class TestBuildTables(TestCase):
         self.assertTrue(expected_snipped in actual_code)
         self.assertEquals(expected_run_data, actual_run_data)
 
+    def test_convert_binary_columns_roundtrip(self):
+        tables = build_tables(self.ex, should_drop=True)
+        raw_tx = b'\x00\x01some raw transaction\xff'
+        tx_hash = 'AB' * 32
+
+        tables.transactions.insert([{'hash': tx_hash, 'data': raw_tx.hex(), 'block_hash': GENESIS_HASH}]).run(self.ex)
+
+        convert_binary_columns(self.ex, to_binary=True)
+        self.assertEqual(column_type(self.ex, 'transactions', 'data'), 'longblob')
+        rows = execute_raw(self.ex, "SELECT data FROM transactions WHERE hash = %s", (tx_hash,))
+        self.assertEqual(bytes(rows[0][0]), raw_tx)
+
+        convert_binary_columns(self.ex, to_binary=False)
+        self.assertNotEqual(column_type(self.ex, 'transactions', 'data'), 'longblob')
+        rows = execute_raw(self.ex, "SELECT data FROM transactions WHERE hash = %s", (tx_hash,))
+        self.assertEqual(rows[0][0], raw_tx.hex())
+
+    def test_build_tables_stamps_schema_version(self):
+        build_tables(self.ex, should_drop=True)
+
+        rows = execute_raw(self.ex, "SELECT version FROM schema_version")
+        self.assertEqual(rows[0][0], SCHEMA_VERSION)
+
+    def test_build_tables_skips_current_schema(self):
+        build_tables(self.ex, should_drop=True)
+
+        with patch('cilantro.storage.blocks.build_blocks_table') as build_blocks_table:
+            tables = build_tables(self.ex, should_drop=False)
+
+        build_blocks_table.assert_not_called()
+        self.assertEqual(len(tables.blocks.select().run(self.ex).rows), 1)
+
+    def test_build_tables_upgrades_old_schema(self):
+        build_tables(self.ex, should_drop=True)
+        execute_raw(self.ex, "DROP TABLE tx_index")
+        execute_raw(self.ex, "UPDATE schema_version SET version = %s", (SCHEMA_VERSION - 1,))
+        self.ex.conn.commit()
+
+        build_tables(self.ex, should_drop=False)
+
+        self.assertTrue(column_type(self.ex, 'tx_index', 'hash') is not None)
+        self.assertEqual(execute_raw(self.ex, "SELECT version FROM schema_version")[0][0], SCHEMA_VERSION)
+        # The existing chain is kept, and not re-seeded
+        self.assertEqual(len(execute_raw(self.ex, "SELECT number FROM blocks")), 1)
+
+    def test_build_tables_splits_block_bodies(self):
+        build_tables(self.ex, should_drop=True)
+
+        # Rebuild the blocks table as it was before headers and bodies were split
+        execute_raw(self.ex, "DROP TABLE block_bodies")
+        execute_raw(self.ex, "ALTER TABLE blocks ADD COLUMN merkle_leaves TEXT, ADD COLUMN block_contender LONGBLOB")
+        execute_raw(self.ex, "UPDATE blocks SET merkle_leaves = %s WHERE number = 1", ('AB' * 32,))
+        execute_raw(self.ex, "UPDATE schema_version SET version = %s", (SCHEMA_VERSION - 1,))
+        self.ex.conn.commit()
+
+        build_tables(self.ex, should_drop=False)
+
+        self.assertTrue(column_type(self.ex, 'blocks', 'merkle_leaves') is None)
+        self.assertTrue(column_type(self.ex, 'blocks', 'block_contender') is None)
+        self.assertEqual(execute_raw(self.ex, "SELECT number, merkle_leaves FROM block_bodies"), ((1, 'AB' * 32),))
+
+
+class TestContractCache(TestCase):
+
+    def test_put_get(self):
+        cache = ContractCache()
+        info = ('author', None, 'code')
+        cache.put('c', info)
+
+        self.assertEqual(cache.get('c'), info)
+        self.assertTrue(cache.get('d') is None)
+        self.assertEqual(cache.stats(), {'size': 1, 'hits': 1, 'misses': 1, 'invalidations': 0})
+
+    def test_put_new_code_replaces_old(self):
+        cache = ContractCache()
+        cache.put('c', ('author', None, 'old code'))
+        cache.put('c', ('author', None, 'new code'))
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('c')[2], 'new code')
+
+    def test_invalidate(self):
+        cache = ContractCache()
+        cache.put('c', ('author', None, 'code'))
+
+        cache.invalidate('c')
+
+        self.assertTrue(cache.get('c') is None)
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = ContractCache(max_size=2)
+        cache.put('a', ('author', None, 'a'))
+        cache.put('b', ('author', None, 'b'))
+        cache.get('a')
+        cache.put('c', ('author', None, 'c'))
+
+        self.assertTrue(cache.get('b') is None)
+        self.assertEqual(cache.get('a')[2], 'a')
+        self.assertEqual(cache.get('c')[2], 'c')
+
 
 if __name__ == '__main__':
     unittest.main()
-
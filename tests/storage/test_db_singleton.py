@@ -1,6 +1,8 @@
 from unittest import TestCase
-from cilantro.storage.db import DB, DBSingletonMeta
+from cilantro.storage.db import DB, DBSingletonMeta, RWLock
 import os
+import time
+import threading
 import multiprocessing
 
 
@@ -79,11 +81,92 @@ class TestDBSingleton(TestCase):
         self.assertTrue(len(after_creation1) == len(after_creation2))
         self.assertEqual(lock1, lock2)
 
-    # TODO -- test locking functionality
+    def test_reader_uses_pooled_executer(self):
+        with DB() as db:
+            writer_ex = db.ex
+
+        with DB().reader() as db:
+            reader_ex = db.ex
+
+            # Nested reader blocks reuse the same connection
+            with DB().reader() as db2:
+                self.assertTrue(db2.ex is reader_ex)
+
+        self.assertFalse(reader_ex is writer_ex)
+        self.assertTrue(DB().ex is writer_ex)
+        self.assertEqual(DB().lock_stats()['read']['count'], 1)
+
+    def test_reader_inside_writer_uses_writer_executer(self):
+        with DB() as db:
+            with DB().reader() as db2:
+                self.assertTrue(db2.ex is db.ex)
 
     # TODO -- test reset_db() function
 
 
+class TestRWLock(TestCase):
+
+    def test_readers_share_lock(self):
+        lock = RWLock()
+        lock.acquire_read()
+
+        # Another thread should be able to read while we hold the read lock
+        t = threading.Thread(target=lambda: (lock.acquire_read(), lock.release()))
+        t.start()
+        t.join(timeout=1)
+        self.assertFalse(t.is_alive())
+
+        lock.release()
+
+    def test_writer_excludes_readers(self):
+        lock = RWLock()
+        events = []
+
+        def read():
+            lock.acquire_read()
+            events.append('read')
+            lock.release()
+
+        lock.acquire_write()
+        t = threading.Thread(target=read)
+        t.start()
+        time.sleep(0.1)
+        events.append('write done')
+        lock.release()
+        t.join(timeout=1)
+
+        self.assertEqual(events, ['write done', 'read'])
+        self.assertEqual(lock.stats['read'].count, 1)
+        self.assertTrue(lock.stats['read'].max_wait >= 0.1)
+
+    def test_reentrant(self):
+        lock = RWLock()
+
+        lock.acquire_write()
+        lock.acquire_write()
+        lock.acquire_read()
+        lock.release()
+        lock.release()
+        self.assertTrue(lock.is_writer())
+        lock.release()
+        self.assertFalse(lock.is_writer())
+
+        lock.acquire_read()
+        lock.acquire_read()
+        lock.release()
+        lock.release()
+
+        # The lock should be completely free again
+        lock.acquire_write()
+        lock.release()
+
+    def test_cant_upgrade_read_lock(self):
+        lock = RWLock()
+        lock.acquire_read()
+
+        self.assertRaises(AssertionError, lock.acquire_write)
+
+
 
 
 
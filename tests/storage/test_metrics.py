@@ -0,0 +1,87 @@
+from unittest import TestCase
+from unittest import mock
+from cilantro.storage.metrics import *
+from cilantro.storage.db import DB, DBSingletonMeta
+from cilantro.storage.tables import execute_raw
+
+
+class TestStorageMetrics(TestCase):
+
+    def setUp(self):
+        self.metrics = StorageMetrics()
+
+    def test_histogram_buckets(self):
+        h = LatencyHistogram()
+        for seconds in (0.0005, 0.003, 0.003, 60):
+            h.record(seconds)
+
+        d = h.as_dict()
+        self.assertEqual(d['count'], 4)
+        self.assertEqual(d['max'], 60)
+        self.assertEqual(d['buckets'], {'<=1ms': 1, '<=5ms': 2, '>5000ms': 1})
+
+    def test_query_recorded_per_call_site(self):
+        self.metrics.record_query("SELECT 1", 0.01, rows_read=3)
+        self.metrics.record_query("INSERT INTO t VALUES (1)", 0.02, rows_written=1)
+
+        stats = self.metrics.snapshot()['queries']['test_metrics.test_query_recorded_per_call_site']
+        self.assertEqual(stats['latency']['count'], 2)
+        self.assertEqual(stats['rows_read'], 3)
+        self.assertEqual(stats['rows_written'], 1)
+
+    def test_slow_query_captured(self):
+        self.metrics.record_query("SELECT 1", 0.001)
+        self.metrics.record_query("SELECT SLEEP(1)", SLOW_QUERY_SECONDS)
+
+        slow = self.metrics.snapshot()['slow_queries']
+        self.assertEqual(len(slow), 1)
+        self.assertEqual(slow[0]['query'], "SELECT SLEEP(1)")
+        self.assertEqual(slow[0]['site'], 'test_metrics.test_slow_query_captured')
+
+    def test_slow_query_log_bounded(self):
+        for i in range(SLOW_QUERY_LOG_SIZE + 5):
+            self.metrics.record_query("SELECT {}".format(i), SLOW_QUERY_SECONDS)
+
+        slow = self.metrics.snapshot()['slow_queries']
+        self.assertEqual(len(slow), SLOW_QUERY_LOG_SIZE)
+        self.assertEqual(slow[0]['query'], "SELECT 5")
+
+    def test_reset_on_fork(self):
+        self.metrics.record_lock_wait('write lock', 0.1)
+
+        with mock.patch('os.getpid', return_value=self.metrics._pid + 1):
+            self.assertEqual(self.metrics.snapshot()['lock_waits'], {})
+
+    def test_is_write_query(self):
+        self.assertTrue(is_write_query("  insert into t VALUES (1)"))
+        self.assertTrue(is_write_query("DELETE FROM t"))
+        self.assertFalse(is_write_query("SELECT * FROM t"))
+
+
+class TestDBMetrics(TestCase):
+
+    def setUp(self):
+        DBSingletonMeta._instances.clear()
+        DB()  # Creating the instance builds the tables, whose queries should not be counted
+        storage_metrics.reset()
+
+    def test_execute_raw_recorded(self):
+        with DB() as db:
+            execute_raw(db.ex, "SELECT 1 UNION SELECT 2")
+
+        snapshot = storage_metrics.snapshot()
+        stats = snapshot['queries']['test_metrics.test_execute_raw_recorded']
+        self.assertEqual(stats['latency']['count'], 1)
+        self.assertEqual(stats['rows_read'], 2)
+
+        self.assertEqual(snapshot['lock_waits']['write lock']['count'], 1)
+        self.assertEqual(snapshot['lock_holds']['test_metrics.test_execute_raw_recorded']['count'], 1)
+
+    def test_nested_lock_hold_recorded_once(self):
+        with DB():
+            with DB().reader():
+                with DB():
+                    pass
+
+        holds = storage_metrics.snapshot()['lock_holds']
+        self.assertEqual(holds['test_metrics.test_nested_lock_hold_recorded_once']['count'], 1)
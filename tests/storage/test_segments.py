@@ -0,0 +1,248 @@
+from unittest import TestCase
+from unittest.mock import patch
+from cilantro.storage.segments import *
+from cilantro.storage.blocks import BlockStorageDriver, BlockStorageDatabaseException, GENESIS_HASH
+from cilantro.messages.consensus.block_contender import build_test_contender
+from cilantro.messages.transaction.base import build_test_transaction
+from cilantro.protocol.structures.merkle_tree import MerkleTree
+from cilantro.constants.testnet import TESTNET_MASTERNODES
+from cilantro.utils import Hasher
+import tempfile
+import shutil
+import os
+
+
+def _random_block(num_txs=3) -> tuple:
+    block = os.urandom(100)
+    txs = [os.urandom(50 + i) for i in range(num_txs)]
+    return Hasher.hash(block), block, [(Hasher.hash(tx), tx) for tx in txs]
+
+
+class TestSegmentStore(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_append_and_get(self):
+        store = SegmentStore(self.path)
+        block_hash, block, txs = _random_block()
+
+        self.assertEqual(store.append_block(block_hash, block, txs), 1)
+
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.latest(), (1, block_hash))
+        self.assertEqual(store.get_block(number=1), block)
+        self.assertEqual(store.get_block(hash=block_hash), block)
+        self.assertEqual(store.get_block_transactions(block_hash), [tx for _, tx in txs])
+        for tx_hash, tx in txs:
+            self.assertEqual(store.get_transaction(tx_hash), tx)
+
+    def test_get_transaction_location(self):
+        store = SegmentStore(self.path)
+        store.append_block(*_random_block())
+        block_hash, block, txs = _random_block()
+        store.append_block(block_hash, block, txs)
+
+        self.assertEqual(store.get_transaction_location(txs[1][0]), (2, block_hash, 1))
+        self.assertTrue(store.get_transaction_location('A' * 64) is None)
+
+    def test_get_nonexisting(self):
+        store = SegmentStore(self.path)
+
+        self.assertTrue(store.latest() is None)
+        self.assertTrue(store.get_block(number=1) is None)
+        self.assertTrue(store.get_block(hash='A' * 64) is None)
+        self.assertTrue(store.get_transaction('A' * 64) is None)
+        self.assertTrue(store.get_block_transactions('A' * 64) is None)
+
+    def test_append_duplicate_block(self):
+        store = SegmentStore(self.path)
+        block_hash, block, txs = _random_block()
+        store.append_block(block_hash, block, txs)
+
+        self.assertRaises(SegmentStoreException, store.append_block, block_hash, block, txs)
+
+    def test_rolls_over_segments(self):
+        store = SegmentStore(self.path, max_segment_bytes=256)
+        blocks = [_random_block() for _ in range(5)]
+        for b in blocks:
+            store.append_block(*b)
+
+        self.assertTrue(len([f for f in os.listdir(self.path) if f.endswith('.seg')]) > 1)
+        for i, (block_hash, block, txs) in enumerate(blocks):
+            self.assertEqual(store.get_block(number=i + 1), block)
+            self.assertEqual(store.get_block_transactions(block_hash), [tx for _, tx in txs])
+
+    def test_reopen(self):
+        store = SegmentStore(self.path)
+        blocks = [_random_block() for _ in range(3)]
+        for b in blocks:
+            store.append_block(*b)
+        store.close()
+
+        store = SegmentStore(self.path)
+        self.assertEqual(store.latest(), (3, blocks[-1][0]))
+        self.assertEqual(store.get_block(hash=blocks[1][0]), blocks[1][1])
+        self.assertEqual(store.get_transaction(blocks[0][2][0][0]), blocks[0][2][0][1])
+
+    def test_reader_sees_appends(self):
+        writer = SegmentStore(self.path)
+        reader = SegmentStore(self.path)
+
+        block_hash, block, txs = _random_block()
+        writer.append_block(block_hash, block, txs)
+
+        self.assertEqual(reader.get_block(hash=block_hash), block)
+        self.assertEqual(reader.get_transaction(txs[0][0]), txs[0][1])
+
+    def test_second_store_read_only_during_write(self):
+        writer = SegmentStore(self.path)
+        first = _random_block()
+        writer.append_block(*first)
+
+        # Simulate the writer being part way through appending a block, with its data written but not its index entries
+        seg_path = os.path.join(self.path, SEGMENT_FILE_FORMAT.format(0))
+        writer._segment(0).write(b'in progress')
+        size = os.path.getsize(seg_path)
+
+        reader = SegmentStore(self.path)
+
+        self.assertFalse(writer.read_only)
+        self.assertTrue(reader.read_only)
+        self.assertEqual(os.path.getsize(seg_path), size)
+        self.assertEqual(reader.get_block(hash=first[0]), first[1])
+        self.assertRaises(SegmentStoreException, reader.append_block, *_random_block())
+
+        second = _random_block()
+        self.assertEqual(writer.append_block(*second), 2)
+        self.assertEqual(reader.get_block(hash=second[0]), second[1])
+        self.assertEqual(reader.get_transaction(second[2][0][0]), second[2][0][1])
+
+        # Once the writer closes, the next store opened can write
+        writer.close()
+        reader.close()
+        self.assertFalse(SegmentStore(self.path).read_only)
+
+    def test_recover_drops_incomplete_block(self):
+        store = SegmentStore(self.path)
+        blocks = [_random_block() for _ in range(3)]
+        for b in blocks:
+            store.append_block(*b)
+        store.close()
+
+        # Simulate a crash part way through writing the last block's data, and its index entry
+        seg_path = os.path.join(self.path, SEGMENT_FILE_FORMAT.format(0))
+        os.truncate(seg_path, os.path.getsize(seg_path) - 1)
+        with open(os.path.join(self.path, BLOCK_INDEX_FILE), 'ab') as f:
+            f.write(b'partial')
+
+        store = SegmentStore(self.path)
+        self.assertEqual(store.latest(), (2, blocks[1][0]))
+        self.assertTrue(store.get_block(hash=blocks[2][0]) is None)
+        self.assertTrue(store.get_transaction(blocks[2][2][0][0]) is None)
+
+        # The store can be appended to again
+        block_hash, block, txs = _random_block()
+        self.assertEqual(store.append_block(block_hash, block, txs), 3)
+        self.assertEqual(store.get_block(number=3), block)
+
+    def test_compressed_store(self):
+        store = SegmentStore(self.path, compress=True)
+        blocks = [_random_block(num_txs=4) for _ in range(3)]
+        for b in blocks:
+            store.append_block(*b)
+        store.close()
+
+        store = SegmentStore(self.path, compress=True)
+        for block_hash, block, txs in blocks:
+            self.assertEqual(store.get_block(hash=block_hash), block)
+            self.assertEqual(store.get_block_transactions(block_hash), [tx for _, tx in txs])
+            for tx_hash, tx in txs:
+                self.assertEqual(store.get_transaction(tx_hash), tx)
+
+    def test_detects_corruption(self):
+        store = SegmentStore(self.path)
+        block_hash, block, txs = _random_block()
+        store.append_block(block_hash, block, txs)
+        store.close()
+
+        seg_path = os.path.join(self.path, SEGMENT_FILE_FORMAT.format(0))
+        with open(seg_path, 'r+b') as f:
+            f.seek(os.path.getsize(seg_path) - 1)
+            f.write(b'\x00' if block[-1] else b'\x01')
+
+        store = SegmentStore(self.path)
+        self.assertRaises(SegmentCorruptionException, store.get_block, number=1)
+
+
+class TestSegmentBlockStorage(TestCase):
+    """
+    Runs BlockStorageDriver against the segment store backend
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.patchers = [patch('cilantro.storage.blocks.BLOCK_STORAGE_BACKEND', 'segments'),
+                         patch('cilantro.storage.blocks.SEGMENT_STORE_DIR', self.path)]
+        for p in self.patchers:
+            p.start()
+
+        BlockStorageDriver._backend = None
+        BlockStorageDriver.invalidate_cache()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+        BlockStorageDriver._backend = None
+        BlockStorageDriver.invalidate_cache()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _store_block(self) -> tuple:
+        raw_transactions = [build_test_transaction().serialize() for _ in range(4)]
+        bc = build_test_contender(tree=MerkleTree(raw_transactions))
+        block_hash = BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_transactions,
+                                                    publisher_sk=TESTNET_MASTERNODES[0]['sk'], timestamp=9000)
+        return block_hash, raw_transactions
+
+    def test_seeds_genesis(self):
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), GENESIS_HASH)
+        self.assertEqual(BlockStorageDriver.get_block(number=1)['hash'], GENESIS_HASH)
+
+    def test_store_and_get_block(self):
+        block_hash, raw_transactions = self._store_block()
+
+        BlockStorageDriver.invalidate_cache()
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), block_hash)
+        self.assertEqual(BlockStorageDriver.get_latest_block()['hash'], block_hash)
+        self.assertEqual(BlockStorageDriver.get_block(hash=block_hash)['number'], 2)
+        self.assertEqual(BlockStorageDriver.get_raw_transactions_from_block(block_hash), raw_transactions)
+        self.assertEqual(BlockStorageDriver.get_raw_transactions(Hasher.hash(raw_transactions[2])), [raw_transactions[2]])
+        self.assertEqual(BlockStorageDriver.get_tx_location(Hasher.hash(raw_transactions[2])),
+                         {'block_number': 2, 'block_hash': block_hash, 'position': 2})
+
+    def test_get_blocks_and_validate(self):
+        hashes = [self._store_block()[0] for _ in range(3)]
+
+        self.assertEqual(BlockStorageDriver.get_child_block_hashes(GENESIS_HASH), hashes)
+        self.assertEqual(BlockStorageDriver.get_child_block_hashes(hashes[0], limit=1), hashes[1:2])
+
+        # This should not blow up
+        BlockStorageDriver.validate_blockchain()
+
+    def test_tip_of_unseeded_store(self):
+        # The store is locked by a writer that has not seeded it yet, so the backend opens it read only and empty
+        writer = SegmentStore(self.path)
+        self.addCleanup(writer.close)
+
+        self.assertRaises(BlockStorageDatabaseException, BlockStorageDriver.get_latest_block_hash)
+
+    def test_reset_backend(self):
+        self._store_block()
+
+        BlockStorageDriver.reset_backend()
+
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), GENESIS_HASH)
@@ -0,0 +1,96 @@
+from unittest import TestCase
+from unittest.mock import patch
+from cilantro.storage.sharding import ShardedBlockBackend, shard_owners
+from cilantro.storage.blocks import BlockStorageDriver, GENESIS_HASH
+from cilantro.storage.db import reset_db
+from cilantro.storage.tables import execute_raw
+from cilantro.messages.consensus.block_contender import build_test_contender
+from cilantro.messages.transaction.base import build_test_transaction
+from cilantro.protocol.structures.merkle_tree import MerkleTree
+from cilantro.constants.testnet import TESTNET_MASTERNODES
+from cilantro.utils import Hasher
+
+TEST_SHARDS = ['cilantro_test_shard_{}'.format(i) for i in range(3)]
+
+
+class TestShardOwners(TestCase):
+
+    def test_ranges_round_robin(self):
+        owners = [shard_owners(n, num_shards=3, range_size=2, replication=1) for n in range(1, 9)]
+
+        self.assertEqual(owners, [[0], [0], [1], [1], [2], [2], [0], [0]])
+
+    def test_replicas_follow_primary(self):
+        self.assertEqual(shard_owners(5, num_shards=3, range_size=2, replication=2), [2, 0])
+
+    def test_replication_capped_by_shards(self):
+        self.assertEqual(shard_owners(1, num_shards=2, range_size=10, replication=5), [0, 1])
+
+
+class TestShardedBlockBackend(TestCase):
+
+    def setUp(self):
+        reset_db()
+        self.backend = ShardedBlockBackend(TEST_SHARDS, range_size=2, replication=2)
+        self.backend.reset()
+
+        BlockStorageDriver._get_backend()  # Ensures the driver's per process caches are set up before patching them
+        self.patch = patch.object(BlockStorageDriver, '_backend', self.backend)
+        self.patch.start()
+        BlockStorageDriver.invalidate_cache()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.backend.reset()
+        BlockStorageDriver.invalidate_cache()
+
+    def _store_blocks(self, num_blocks) -> list:
+        stored = []
+        for _ in range(num_blocks):
+            raw_transactions = [build_test_transaction().serialize() for _ in range(4)]
+            bc = build_test_contender(tree=MerkleTree(raw_transactions))
+            block_hash = BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_transactions,
+                                                        publisher_sk=TESTNET_MASTERNODES[0]['sk'], timestamp=9000)
+            stored.append((block_hash, raw_transactions))
+        return stored
+
+    def _shard_numbers(self, shard) -> list:
+        with shard.connection() as ex:
+            return sorted(r[0] for r in execute_raw(ex, "SELECT `number` FROM block_bodies"))
+
+    def test_blocks_routed_to_owners(self):
+        self._store_blocks(5)  # Block numbers 2 to 6
+
+        self.assertEqual(self._shard_numbers(self.backend.shards[0]), [2, 5, 6])
+        self.assertEqual(self._shard_numbers(self.backend.shards[1]), [2, 3, 4])
+        self.assertEqual(self._shard_numbers(self.backend.shards[2]), [3, 4, 5, 6])
+
+    def test_reads(self):
+        stored = self._store_blocks(3)
+
+        for block_hash, raw_transactions in stored:
+            block = BlockStorageDriver.get_block(hash=block_hash)
+            self.assertEqual(block['hash'], block_hash)
+            self.assertTrue(block['block_contender'])
+            self.assertEqual(BlockStorageDriver.get_raw_transactions_from_block(block_hash), raw_transactions)
+            self.assertEqual(BlockStorageDriver.get_raw_transactions([Hasher.hash(tx) for tx in raw_transactions]),
+                             raw_transactions)
+
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), stored[-1][0])
+        self.assertEqual([b['hash'] for b in BlockStorageDriver.get_blocks(after_hash=GENESIS_HASH)],
+                         [h for h, _ in stored])
+
+    def test_genesis_read_locally(self):
+        self._store_blocks(1)
+
+        self.assertEqual(BlockStorageDriver.get_block(number=1)['hash'], GENESIS_HASH)
+
+    def test_failover_to_replica(self):
+        stored = self._store_blocks(1)  # Block number 2, on shards 0 and 1
+        BlockStorageDriver.invalidate_cache()
+
+        with patch.object(self.backend.shards[0], '_connect', side_effect=ConnectionError("shard down")):
+            self.backend.shards[0]._close()
+            block = BlockStorageDriver.get_block(hash=stored[0][0])
+
+        self.assertTrue(block['block_contender'])
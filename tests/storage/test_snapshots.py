@@ -0,0 +1,125 @@
+from unittest import TestCase
+from cilantro.storage.snapshots import *
+from cilantro.storage.snapshots import _encode_value, _decode_value
+from cilantro.storage.db import reset_db, DB
+from cilantro.storage.blocks import BlockStorageDriver, GENESIS_HASH
+from cilantro.storage.tables import execute_raw
+from cilantro.storage.state import get_state_root
+from cilantro.messages.consensus.block_contender import build_test_contender
+from cilantro.messages.transaction.base import build_test_transaction
+from cilantro.protocol.structures.merkle_tree import MerkleTree
+from cilantro.constants.testnet import TESTNET_MASTERNODES
+from decimal import Decimal
+import datetime
+import tempfile
+import json
+import os
+
+
+class TestSnapshots(TestCase):
+
+    def setUp(self):
+        reset_db()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def _store_block(self) -> str:
+        raw_transactions = [build_test_transaction().serialize() for _ in range(4)]
+        bc = build_test_contender(tree=MerkleTree(raw_transactions))
+        return BlockStorageDriver.store_block(block_contender=bc, raw_transactions=raw_transactions,
+                                              publisher_sk=TESTNET_MASTERNODES[0]['sk'], timestamp=9000)
+
+    @staticmethod
+    def _dump_table(table_name) -> list:
+        with DB() as db:
+            return sorted(execute_raw(db.ex, "SELECT * FROM `{}`".format(table_name)), key=repr)
+
+    def test_export_import(self):
+        block_hash = self._store_block()
+        contracts = self._dump_table('smart_contracts')
+
+        info = export_snapshot(self.path)
+        self.assertEqual(info['block_hash'], block_hash)
+        self.assertEqual(info['block_number'], 2)
+        self.assertTrue('smart_contracts' in info['tables'])
+        self.assertFalse('blocks' in info['tables'])
+        self.assertFalse('state_nodes' in info['tables'])
+
+        reset_db()
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), GENESIS_HASH)
+
+        self.assertEqual(import_snapshot(self.path), block_hash)
+        self.assertEqual(BlockStorageDriver.get_latest_block_hash(), block_hash)
+        self.assertEqual(BlockStorageDriver.get_latest_block_number(), 2)
+        self.assertEqual(self._dump_table('smart_contracts'), contracts)
+        self.assertEqual(get_state_root(block_hash), info['state_root'])
+
+        # New blocks should link to the snapshot block
+        new_hash = self._store_block()
+        self.assertEqual(BlockStorageDriver.get_block(hash=new_hash)['prev_block_hash'], block_hash)
+
+    def test_validate_after_import(self):
+        for _ in range(3):
+            self._store_block()
+        export_snapshot(self.path)
+
+        reset_db()
+        import_snapshot(self.path)
+
+        # The snapshot block is number 4, and blocks 2 and 3 are not stored
+        self.assertEqual(BlockStorageDriver.get_chain_start_number(), 4)
+        BlockStorageDriver.validate_blockchain()
+        BlockStorageDriver.validate_blockchain(async=True, num_workers=2)
+
+        self._store_block()
+        BlockStorageDriver.validate_blockchain()
+        BlockStorageDriver.validate_blockchain(async=True, num_workers=2)
+
+    def test_export_at_old_block_hash(self):
+        self._store_block()
+        self.assertRaises(SnapshotException, export_snapshot, self.path, block_hash=GENESIS_HASH)
+
+    def test_import_onto_nonempty_db(self):
+        export_snapshot(self.path)
+        self._store_block()
+
+        self.assertRaises(SnapshotException, import_snapshot, self.path)
+
+    def test_state_root_mismatch(self):
+        export_snapshot(self.path)
+        snapshot = read_snapshot(self.path)
+        next(t for t in snapshot['tables'] if t['name'] == 'smart_contracts')['rows'].pop()
+        payload = zlib.compress(json.dumps(snapshot, default=_encode_value).encode())
+        with open(self.path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + Hasher.hash(payload, return_bytes=True) + payload)
+
+        reset_db()
+        self.assertRaises(SnapshotException, import_snapshot, self.path)
+
+    def test_corrupt_snapshot(self):
+        export_snapshot(self.path)
+
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+
+        self.assertRaises(SnapshotChecksumException, read_snapshot, self.path)
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'definitely not a snapshot')
+
+        self.assertRaises(SnapshotException, read_snapshot, self.path)
+
+    def test_encode_decode_values(self):
+        values = [b'\x00\xff', datetime.datetime(1, 1, 1), datetime.date(2018, 7, 4), datetime.timedelta(seconds=90),
+                  Decimal('1.2500'), 'str', 7, None]
+
+        encoded = json.dumps(values, default=_encode_value)
+
+        self.assertEqual(json.loads(encoded, object_hook=_decode_value), values)
@@ -0,0 +1,78 @@
+from unittest import TestCase
+from cilantro.storage.state import StateCommitment, compute_state_root, get_state_root, load_state_tree
+from cilantro.storage.db import reset_db, DB
+from cilantro.storage.tables import execute_raw
+
+
+class TestStateCommitment(TestCase):
+
+    def setUp(self):
+        reset_db()
+        with DB() as db:
+            execute_raw(db.ex, "CREATE TABLE balances (wallet VARCHAR(64) PRIMARY KEY, amount INT NOT NULL)")
+            execute_raw(db.ex, "INSERT INTO balances VALUES ('alice', 10), ('bob', 20)")
+            db.ex.conn.commit()
+
+    def _commit(self, state: StateCommitment, statements=(), block_hash='') -> str:
+        with DB() as db:
+            for statement in statements:
+                execute_raw(db.ex, statement)
+            root = state.commit(db.ex, block_hash=block_hash)
+            db.ex.conn.commit()
+            return root
+
+    def _full_root(self) -> str:
+        with DB() as db:
+            return compute_state_root(db.ex)
+
+    def test_first_commit_builds_tree(self):
+        state = StateCommitment()
+
+        self.assertEqual(self._commit(state), self._full_root())
+
+    def test_incremental_updates_match_rebuild(self):
+        state = StateCommitment()
+        first = self._commit(state)
+
+        root = self._commit(state, ["UPDATE balances SET amount = 5 WHERE wallet = 'alice'",
+                                    "DELETE FROM balances WHERE wallet = 'bob'",
+                                    "INSERT INTO balances VALUES ('carl', 30)"])
+
+        self.assertNotEqual(root, first)
+        self.assertEqual(root, self._full_root())
+        with DB() as db:
+            self.assertEqual(load_state_tree(db.ex).root.hex(), root)
+            self.assertFalse(execute_raw(db.ex, "SELECT 1 FROM state_changes"))
+
+    def test_rolled_back_writes_ignored(self):
+        state = StateCommitment()
+        root = self._commit(state)
+
+        with DB() as db:
+            execute_raw(db.ex, "UPDATE balances SET amount = 0")
+            db.ex.conn.rollback()
+
+        self.assertEqual(self._commit(state), root)
+
+    def test_new_table(self):
+        state = StateCommitment()
+        self._commit(state)
+
+        root = self._commit(state, ["CREATE TABLE notes (body TEXT)", "INSERT INTO notes VALUES ('hi')"])
+
+        self.assertEqual(root, self._full_root())
+
+    def test_root_recorded_per_block(self):
+        state = StateCommitment()
+        root = self._commit(state, block_hash='AB' * 32)
+
+        self.assertEqual(get_state_root('AB' * 32), root)
+        self.assertIsNone(get_state_root('CD' * 32))
+
+    def test_reloads_after_reset(self):
+        state = StateCommitment()
+        self._commit(state, ["INSERT INTO balances VALUES ('carl', 30)"])
+
+        reset_db()
+
+        self.assertEqual(self._commit(state), self._full_root())
@@ -0,0 +1,63 @@
+from unittest import TestCase
+from unittest.mock import patch
+from cilantro.storage.transactions import *
+from cilantro.storage.db import reset_db, DB
+from cilantro.storage.tables import execute_raw
+from cilantro.messages.transaction.base import build_test_transaction
+import os
+
+
+class TestTxCompression(TestCase):
+
+    def setUp(self):
+        reset_db()
+
+    def test_compress_decompress(self):
+        raw_tx = build_test_transaction().serialize()
+
+        with patch('cilantro.storage.transactions.TX_COMPRESSION', True):
+            payload, dict_version = compress_tx(raw_tx)
+
+        self.assertTrue(dict_version > 0)
+        self.assertLess(len(payload), len(raw_tx))
+        self.assertEqual(decompress_tx(payload, dict_version), raw_tx)
+
+    def test_compression_disabled(self):
+        raw_tx = build_test_transaction().serialize()
+
+        with patch('cilantro.storage.transactions.TX_COMPRESSION', False):
+            self.assertEqual(compress_tx(raw_tx), (raw_tx, 0))
+
+    def test_incompressible_stored_raw(self):
+        raw_tx = os.urandom(24)
+
+        with patch('cilantro.storage.transactions.TX_COMPRESSION', True):
+            self.assertEqual(compress_tx(raw_tx), (raw_tx, 0))
+
+    def test_dictionary_stored_once(self):
+        self.assertEqual(tx_dictionaries.current()[0], 1)
+        tx_dictionaries.clear()
+        self.assertEqual(tx_dictionaries.current()[0], 1)
+
+        with DB() as db:
+            rows = execute_raw(db.ex, "SELECT `version`, `data` FROM tx_dictionaries")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(decode_tx(rows[0][1]), build_tx_dictionary())
+
+    def test_old_dictionary_still_readable(self):
+        raw_tx = build_test_transaction().serialize()
+        with patch('cilantro.storage.transactions.TX_COMPRESSION', True):
+            old_payload, old_version = compress_tx(raw_tx)
+
+            # Changed templates produce a new dictionary, under a new version
+            tx_dictionaries.clear()
+            with patch('cilantro.storage.transactions.build_tx_dictionary', return_value=b'some other templates'):
+                new_version = tx_dictionaries.current()[0]
+
+        self.assertEqual(new_version, old_version + 1)
+
+        tx_dictionaries.clear()
+        self.assertEqual(decompress_tx(old_payload, old_version), raw_tx)
+
+    def test_missing_dictionary(self):
+        self.assertRaises(TxDictionaryException, decompress_tx, b'\x00', 99)
@@ -0,0 +1,49 @@
+from unittest import TestCase
+from cilantro.storage.tx_filter import TransactionFilter
+import tempfile
+import shutil
+import os
+
+
+class TestTransactionFilter(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'tx_filter.bloom')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_load(self):
+        tx_filter = TransactionFilter(capacity=100, error_rate=0.01)
+        tx_filter.add_block(2, 'AB' * 32, ['CD' * 32, 'EF' * 32])
+        tx_filter.save(self.path)
+
+        loaded = TransactionFilter.load(self.path)
+
+        self.assertEqual((loaded.block_number, loaded.block_hash), (2, 'ab' * 32))
+        self.assertTrue(loaded.might_contain('EF' * 32))
+        self.assertFalse(loaded.might_contain('12' * 32))
+        self.assertEqual(loaded.unsaved_blocks, 0)
+
+    def test_load_missing(self):
+        self.assertTrue(TransactionFilter.load(self.path) is None)
+
+    def test_load_corrupt(self):
+        tx_filter = TransactionFilter(capacity=100, error_rate=0.01)
+        tx_filter.add_block(1, 'AB' * 32, ['CD' * 32])
+        tx_filter.save(self.path)
+
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+
+        self.assertTrue(TransactionFilter.load(self.path) is None)
+
+    def test_add_block_out_of_order(self):
+        tx_filter = TransactionFilter(capacity=100, error_rate=0.01)
+        tx_filter.add_block(5, 'AB' * 32, [])
+
+        self.assertRaises(AssertionError, tx_filter.add_block, 5, 'CD' * 32, [])
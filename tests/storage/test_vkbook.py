@@ -0,0 +1,42 @@
+from unittest import TestCase
+from cilantro.storage.db import VKBook
+
+
+class TestVKBook(TestCase):
+
+    def setUp(self):
+        self.original = (VKBook.get_masternodes(), VKBook.get_delegates(), VKBook.get_witnesses())
+
+    def tearDown(self):
+        VKBook._build(*self.original)
+
+    def test_membership(self):
+        for vk in VKBook.MASTERNODES:
+            self.assertTrue(VKBook.is_masternode(vk))
+            self.assertFalse(VKBook.is_delegate(vk))
+        for vk in VKBook.DELEGATES:
+            self.assertTrue(VKBook.is_delegate(vk))
+        for vk in VKBook.WITNESSES:
+            self.assertTrue(VKBook.is_witness(vk))
+
+        for vk in VKBook.MASTERNODES + VKBook.DELEGATES + VKBook.WITNESSES:
+            self.assertTrue(VKBook.is_member(vk))
+        self.assertFalse(VKBook.is_member('A' * 64))
+
+    def test_get_all(self):
+        self.assertEqual(VKBook.get_all(), tuple(VKBook.MASTERNODES + VKBook.DELEGATES + VKBook.WITNESSES))
+
+    def test_getters_immutable(self):
+        for getter in (VKBook.get_all, VKBook.get_masternodes, VKBook.get_delegates, VKBook.get_witnesses):
+            self.assertIsInstance(getter(), tuple)
+
+    def test_rebuild(self):
+        delegates = ['A' * 64, 'B' * 64]
+
+        VKBook._build(VKBook.MASTERNODES, delegates, VKBook.WITNESSES)
+
+        self.assertEqual(VKBook.get_delegates(), tuple(delegates))
+        self.assertTrue(VKBook.is_delegate('A' * 64))
+        self.assertTrue(VKBook.is_member('B' * 64))
+        self.assertFalse(VKBook.is_delegate(VKBook.DELEGATES[0]))
+        self.assertFalse(VKBook.is_member(VKBook.DELEGATES[0]))
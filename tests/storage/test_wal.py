@@ -0,0 +1,189 @@
+from unittest import TestCase
+from cilantro.storage.wal import WALBlockBackend, WriteAheadLog, WALException, RECORD_HEADER
+import tempfile
+import threading
+import shutil
+import os
+
+
+class MemoryBlockBackend:
+    """
+    A minimal block storage backend, which stores blocks in a list. If 'gate' is set, inserts block until it is set.
+    """
+
+    def __init__(self):
+        self.blocks = [{'number': 0, 'hash': '0' * 64}]
+        self.txs = {}
+        self.gate = None
+        self.waiting = threading.Event()  # Set once an insert is blocked on the gate
+
+    def insert_blocks(self, blocks, first_num=0):
+        gate = self.gate
+        if gate:
+            self.waiting.set()
+            gate.wait()
+        assert not first_num or first_num == len(self.blocks), "Blocks do not follow the tip"
+        numbers = []
+        for block, raw_transactions, tx_hashes in blocks:
+            number = len(self.blocks)
+            self.blocks.append({**block, 'number': number})
+            for position, (tx_hash, raw_tx) in enumerate(zip(tx_hashes, raw_transactions)):
+                self.txs[tx_hash] = (number, block['hash'], position, raw_tx)
+            numbers.append(number)
+        return numbers
+
+    def get_block(self, number=0, hash='', cols=()):
+        for block in self.blocks:
+            if (number and block['number'] == number) or (hash and block['hash'] == hash):
+                return {col: block[col] for col in cols} if cols else dict(block)
+        return None
+
+    def get_latest_block(self):
+        return dict(self.blocks[-1])
+
+    def get_blocks(self, after_hash='', after_number=0, limit=0, cols=()):
+        blocks = [{col: b[col] for col in cols} for b in self.blocks if b['number'] > after_number]
+        return blocks[:limit] if limit else blocks
+
+    def get_tip(self):
+        return self.blocks[-1]['number'], self.blocks[-1]['hash']
+
+    def iter_raw_transactions(self, hashes, is_block_hashes=False):
+        for h in hashes:
+            for tx_hash, (_, block_hash, _, raw_tx) in self.txs.items():
+                if (block_hash if is_block_hashes else tx_hash) == h:
+                    yield h, raw_tx
+
+    def get_tx_locations(self, tx_hashes):
+        return {h: self.txs[h][:3] for h in tx_hashes if h in self.txs}
+
+    def reset(self):
+        self.__init__()
+
+
+def build_block(i):
+    block = {'hash': '{:02x}'.format(i) * 32, 'merkle_leaves': 'ff' * 32}
+    return block, [b'tx' + bytes([i])], ['{:02x}'.format(i + 100) * 32]
+
+
+class TestBlockWAL(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'blocks.wal')
+        self.inner = MemoryBlockBackend()
+        self.wals = []
+
+    def tearDown(self):
+        if self.inner.gate:
+            self.inner.gate.set()
+        for wal in self.wals:
+            wal.close()
+        shutil.rmtree(self.dir)
+
+    def _open(self, recover=True):
+        wal = WALBlockBackend(self.inner, self.path, recover=recover)
+        self.wals.append(wal)
+        return wal
+
+    def test_pending_blocks_readable(self):
+        self.inner.gate = threading.Event()
+        wal = self._open()
+
+        self.assertEqual(wal.insert_blocks([build_block(1), build_block(2)]), [1, 2])
+
+        # Nothing is committed until the gate opens, but the blocks are readable through the WAL
+        self.assertEqual(len(self.inner.blocks), 1)
+        self.assertEqual(wal.get_tip(), (2, build_block(2)[0]['hash']))
+        self.assertEqual(wal.get_block(hash=build_block(1)[0]['hash'])['number'], 1)
+        self.assertEqual(wal.get_latest_block()['number'], 2)
+        self.assertEqual(wal.get_blocks(after_number=0, cols=('number',)), [{'number': 1}, {'number': 2}])
+        self.assertEqual(wal.get_blocks(after_hash=build_block(1)[0]['hash'], cols=('hash',)),
+                         [{'hash': build_block(2)[0]['hash']}])
+        self.assertEqual(list(wal.iter_raw_transactions([build_block(2)[2][0]])), [(build_block(2)[2][0], b'tx\x02')])
+        self.assertEqual(wal.get_tx_locations([build_block(1)[2][0]]),
+                         {build_block(1)[2][0]: (1, build_block(1)[0]['hash'], 0)})
+
+    def test_flush_commits(self):
+        wal = self._open()
+        wal.insert_blocks([build_block(1)])
+        wal.insert_blocks([build_block(2)])
+
+        self.assertTrue(wal.flush(timeout=5))
+
+        self.assertEqual([b['hash'] for b in self.inner.blocks[1:]], [build_block(1)[0]['hash'],
+                                                                      build_block(2)[0]['hash']])
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(wal.get_tip(), (2, build_block(2)[0]['hash']))
+
+    def test_recovery(self):
+        self.inner.gate = threading.Event()
+        wal = self._open()
+        wal.insert_blocks([build_block(1), build_block(2)])
+        self.assertTrue(self.inner.waiting.wait(timeout=5))
+
+        # Simulate a crash, in which the first block was committed but the second one was not. The committer stays
+        # blocked on the old gate
+        self.inner.gate = None
+        self.inner.insert_blocks([build_block(1)])
+        wal.closed = True
+        self.wals.remove(wal)
+        wal.wal.close()
+
+        recovered = self._open()
+
+        self.assertEqual([b['hash'] for b in self.inner.blocks[1:]], [build_block(1)[0]['hash'],
+                                                                      build_block(2)[0]['hash']])
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(recovered.insert_blocks([build_block(3)]), [3])
+
+    def test_torn_record_ignored(self):
+        self.inner.gate = threading.Event()
+        wal = self._open()
+        wal.insert_blocks([build_block(1)])
+        self.assertTrue(self.inner.waiting.wait(timeout=5))
+
+        self.inner.gate = None
+        wal.closed = True
+        self.wals.remove(wal)
+        wal.wal.close()
+
+        with open(self.path, 'ab') as f:
+            f.write(RECORD_HEADER.pack(100, 0) + b'partial')
+
+        log = WriteAheadLog(self.path)
+        self.assertEqual(len(log.read()), 1)
+        log.close()
+
+    def test_open_without_recovery_discards_log(self):
+        self.inner.gate = threading.Event()
+        wal = self._open()
+        wal.insert_blocks([build_block(1)])
+        self.assertTrue(self.inner.waiting.wait(timeout=5))
+
+        self.inner.gate = None
+        wal.closed = True
+        self.wals.remove(wal)
+        wal.wal.close()
+
+        reset = self._open(recover=False)
+
+        self.assertEqual(len(self.inner.blocks), 1)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(reset.insert_blocks([build_block(2)]), [1])
+
+    def test_number_mismatch_stops_committer(self):
+        self.inner.gate = threading.Event()
+        wal = self._open()
+        wal.insert_blocks([build_block(1)])
+        self.assertTrue(self.inner.waiting.wait(timeout=5))
+
+        # Another writer stores a block behind the log's back, so the logged block can not be committed as number 1.
+        # The first commit attempt fails as the gate opens, and the retry finds the numbers taken
+        self.inner.blocks.append({**build_block(9)[0], 'number': 1})
+        self.inner.gate.set()
+
+        self.assertFalse(wal.flush(timeout=5))
+        self.assertEqual(len(self.inner.blocks), 2)
+        with self.assertRaises(WALException):
+            wal.insert_blocks([build_block(2)])